@@ -1,10 +1,12 @@
 from django.contrib import admin
-from .models import Line, Station, Category, Place, Post
+from .models import Line, Station, StationLink, Category, Place, Post, Subscription
 
 admin.site.register(Line)
 admin.site.register(Station)
+admin.site.register(StationLink)
 admin.site.register(Category)
 admin.site.register(Place)
+admin.site.register(Subscription)
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
@@ -0,0 +1,143 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.http import HttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from .authentication import REVOKED_KEY, is_revoked
+from .fastpath import FastStationSerializer, FastPlaceSerializer, FastPostPublicSerializer, FastCommentSerializer
+from .geo import near, station_index
+from .models import Station, Place, Comment, SearchTerm
+from .pagination import after_cursor, encode_cursor
+from .ranking import SORTS
+from .search import search
+from .views import explore_queryset
+
+# Async twins of the busiest read endpoints (explore, stations/nearest, places near me
+# and comments by post), served under /api/async/. Run behind an ASGI server
+# (uvicorn metro_backend.asgi:application) so a worker isn't tied up while it waits
+# on the database; under WSGI they still work, one request per thread.
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type="application/json")
+
+
+async def aget_user(request):
+    auth = JWTAuthentication()
+    header = auth.get_header(request)
+    raw = auth.get_raw_token(header) if header else None
+    if raw is None:
+        return AnonymousUser()
+    token = auth.get_validated_token(raw)
+    if getattr(settings, "JWT_STATELESS", False):
+        if is_revoked(token, await cache.aget(REVOKED_KEY.format(token.get(api_settings.USER_ID_CLAIM)))):
+            raise InvalidToken("Token has been revoked")
+        return api_settings.TOKEN_USER_CLASS(token)
+    user = await User.objects.filter(pk=token[api_settings.USER_ID_CLAIM], is_active=True).afirst()
+    if user is None:
+        raise AuthenticationFailed("User not found", code="user_not_found")
+    return user
+
+
+def page_size(request):
+    try:
+        return min(max(int(request.GET.get("page_size", PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return PAGE_SIZE
+
+
+async def keyset_page(request, rows, field):
+    # rows are ordered by (-field, id)
+    size = page_size(request)
+    cursor = request.GET.get("cursor")
+    if cursor:
+        rows = after_cursor(rows, field, cursor)
+        if rows is None:
+            return None, None
+    page = [r async for r in rows.order_by(f"-{field}", "id")[:size + 1]]
+    next_url = None
+    if len(page) > size:
+        page = page[:size]
+        params = request.GET.copy()
+        params["cursor"] = encode_cursor(page[-1][field], page[-1]["id"])
+        next_url = request.build_absolute_uri(f"{request.path}?{params.urlencode()}")
+    return page, next_url
+
+
+async def explore(request):
+    try:
+        user = await aget_user(request)
+    except AuthenticationFailed as e:
+        return json_response(e.detail if isinstance(e.detail, dict) else {"detail": e.detail}, status=401)
+    qs = explore_queryset(request.GET, user)
+    fast = FastPostPublicSerializer({"request": request})
+    field = SORTS.get(request.GET.get("sort")) or ("search_rank" if "search_rank" in qs.query.annotations else "created_at")
+    page, next_url = await keyset_page(request, fast.values(qs, field), field)
+    if page is None:
+        return json_response({"detail": "Invalid cursor"}, status=404)
+    return json_response({"next": next_url, "previous": None, "results": fast.many(page)})
+
+
+async def stations_nearest(request):
+    try:
+        lat = float(request.GET.get("lat"))
+        lng = float(request.GET.get("lng"))
+        limit = int(request.GET.get("limit", 1))
+    except (TypeError, ValueError):
+        return json_response({"error": "lat and lng are required"}, status=400)
+    # the k-d tree lives in memory; only a rebuild after reference data changes hits the db
+    found = await sync_to_async(station_index.nearest)(lat, lng, limit)
+    fast = FastStationSerializer()
+    rows = {r["id"]: r async for r in fast.values(Station.objects.filter(pk__in=[pk for _d, pk in found]))}
+    data = []
+    for d, pk in found:
+        r = rows.get(pk)
+        if r is not None:
+            item = fast.to_dict(r)
+            item["distance_km"] = round(d, 3)
+            data.append(item)
+    return json_response(data)
+
+
+async def places_near(request):
+    try:
+        lat = float(request.GET.get("lat"))
+        lng = float(request.GET.get("lng"))
+        radius_km = request.GET.get("radius_km")
+        radius_km = float(radius_km) if radius_km else None
+        limit = min(int(request.GET.get("limit", 50)), 500)
+    except (TypeError, ValueError):
+        return json_response({"error": "lat and lng are required, radius_km and limit must be numbers"}, status=400)
+    qs = Place.objects.all()
+    cat_id = request.GET.get("category_id")
+    if cat_id:
+        qs = qs.filter(category_id=cat_id)
+    station_id = request.GET.get("station_id")
+    if station_id:
+        qs = qs.filter(nearest_station_id=station_id)
+    q = request.GET.get("q")
+    if q:
+        qs = search(qs, SearchTerm.PLACE, q)
+    fast = FastPlaceSerializer({"request": request})
+    rows = fast.values(near(qs, lat, lng, radius_km)[:max(limit, 0)], "distance_km")
+    return json_response(fast.many([r async for r in rows]))
+
+
+async def comments(request):
+    try:
+        post_id = int(request.GET.get("post_id"))
+    except (TypeError, ValueError):
+        return json_response({"error": "post_id is required"}, status=400)
+    fast = FastCommentSerializer({"request": request})
+    page, next_url = await keyset_page(request, fast.values(Comment.objects.filter(post_id=post_id)), "created_at")
+    if page is None:
+        return json_response({"detail": "Invalid cursor"}, status=404)
+    return json_response({"next": next_url, "previous": None, "results": fast.many(page)})
@@ -0,0 +1,48 @@
+import time
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser as BaseTokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+# Tokens carry username and is_staff, so requests are authenticated from the token
+# alone (request.user is a TokenUser, use request.user.id rather than the object in
+# queries). The one thing a token can't know is that its user was deactivated or had
+# their role changed since it was issued; those users go on a short revocation list
+# in the cache.
+REVOKED_KEY = "jwt:revoked:{}"
+
+
+class TokenUser(BaseTokenUser):
+    # simplejwt puts the id in the token as a string; compare like User.id does
+    @cached_property
+    def id(self):
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+
+def add_user_claims(token, user):
+    token["username"] = user.get_username()
+    token["is_staff"] = user.is_staff
+    token["is_superuser"] = user.is_superuser
+    return token
+
+
+def revoke_user_tokens(user_id):
+    # access tokens issued before now are refused until they would have expired anyway;
+    # refreshing fails for inactive users and gives everyone else up to date claims
+    timeout = int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()) + 60
+    cache.set(REVOKED_KEY.format(user_id), int(time.time()), timeout=timeout)
+
+
+def is_revoked(token, revoked_at):
+    # iat has one second resolution, so a token from the same second counts as revoked
+    return revoked_at is not None and token.get("iat", 0) <= revoked_at
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        if is_revoked(validated_token, cache.get(REVOKED_KEY.format(user.id))):
+            raise InvalidToken("Token has been revoked")
+        return user
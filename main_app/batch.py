@@ -0,0 +1,172 @@
+import io
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from contextvars import copy_context
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+from rest_framework.permissions import AllowAny, SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .db_router import pick_replica, read_from_replica
+from .metrics import registry
+from .middleware import QueryCollector, ReadReplicaMiddleware, RequestMetricsMiddleware
+
+logger = logging.getLogger(__name__)
+
+# POST /api/batch/ runs several API requests in one round trip, e.g. everything the
+# app loads on startup. Sub-requests go straight to their views with the batch's own
+# Authorization header, skipping the middleware. With "parallel": true, consecutive
+# reads run concurrently; a write waits for everything before it to finish. Each
+# sub-request is recorded in the metrics as route "batch:<its route>".
+MAX_REQUESTS = 20
+METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE"}
+# headers of the batch request that aren't passed on to its sub-requests
+SKIP_HEADERS = {"HTTP_IF_NONE_MATCH", "HTTP_IF_MODIFIED_SINCE", "HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"}
+RESULT_HEADERS = ("ETag", "Location")
+
+_executor = None
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, "BATCH_MAX_WORKERS", 4),
+            thread_name_prefix="metro-batch",
+        )
+    return _executor
+
+
+def sub_request(parent, method, path, body=None, headers=None):
+    path, _, query = path.partition("?")
+    data = json.dumps(body).encode() if body is not None else b""
+    environ = {k: v for k, v in parent.META.items() if k.startswith("HTTP_") and k not in SKIP_HEADERS}
+    environ.update({
+        f"HTTP_{name.upper().replace('-', '_')}": value for name, value in (headers or {}).items()
+    })
+    environ.update({
+        "REQUEST_METHOD": method,
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "SCRIPT_NAME": parent.META.get("SCRIPT_NAME", ""),
+        "SERVER_NAME": parent.META.get("SERVER_NAME", "localhost"),
+        "SERVER_PORT": parent.META.get("SERVER_PORT", "80"),
+        "REMOTE_ADDR": parent.META.get("REMOTE_ADDR", ""),
+        "CONTENT_TYPE": "application/json",
+        "CONTENT_LENGTH": str(len(data)),
+        "wsgi.input": io.BytesIO(data),
+        "wsgi.url_scheme": parent.scheme,
+    })
+    return WSGIRequest(environ)
+
+
+def result(response):
+    out = {"status": response.status_code}
+    if isinstance(response, Response):
+        out["body"] = response.data
+    elif response.streaming:
+        return {"status": 400, "body": {"error": "streamed responses can't be batched"}}
+    elif response.content:
+        content = response.content.decode(response.charset)
+        out["body"] = json.loads(content) if response.get("Content-Type", "").startswith("application/json") else content
+    else:
+        out["body"] = None
+    headers = {h: response[h] for h in RESULT_HEADERS if response.has_header(h)}
+    if headers:
+        out["headers"] = headers
+    return out
+
+
+def run(parent, spec):
+    try:
+        match = resolve(spec["path"].partition("?")[0])
+    except Resolver404:
+        return {"status": 404, "body": {"detail": "Not found."}}
+    view_class = getattr(match.func, "cls", None)
+    if view_class is None or not issubclass(view_class, APIView) or issubclass(view_class, BatchView):
+        return {"status": 400, "body": {"error": f"{spec['path']} can't be batched"}}
+    request = sub_request(parent, spec["method"], spec["path"], spec.get("body"), spec.get("headers"))
+    collector, start = QueryCollector(keep_sql=False), time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            if getattr(settings, "METRICS_ENABLED", True):
+                RequestMetricsMiddleware.wrap_connections(stack, collector)
+            out = result(match.func(request, *match.args, **match.kwargs))
+    except Exception:
+        logger.exception("batched %s %s failed", spec["method"], spec["path"])
+        out = {"status": 500, "body": {"error": "internal error"}}
+    if getattr(settings, "METRICS_ENABLED", True):
+        duplicates = {fp: n for fp, n in collector.fingerprints.items() if n > 1}
+        registry.record(f"batch:{match.url_name or 'unnamed'}", out["status"],
+                        (time.perf_counter() - start) * 1000, collector.db_ms, collector.count, duplicates)
+    return out
+
+
+def run_in_thread(context, parent, spec):
+    # the copied context carries the replica choice into the pool thread
+    try:
+        return context.run(run, parent, spec)
+    finally:
+        close_old_connections()
+
+
+class BatchView(APIView):
+    """
+    {"requests": [{"method": "GET", "path": "/api/lines/"}, ...], "parallel": true}
+    -> {"results": [{"status": 200, "body": ...}, ...]} in the same order.
+    Each sub-request is authenticated and permission checked by its own view.
+    """
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        specs = request.data.get("requests") if isinstance(request.data, dict) else None
+        error = self.validate(specs)
+        if error:
+            return Response({"error": error}, status=400)
+        for spec in specs:
+            spec["method"] = spec.get("method", "GET").upper()
+
+        parent = request._request
+        read_only = all(spec["method"] in SAFE_METHODS for spec in specs)
+        parent.read_only = read_only
+        # one replica for the whole batch, like any other request
+        replica = pick_replica() if read_only and not ReadReplicaMiddleware.is_pinned(parent) else None
+        with read_from_replica(replica):
+            if request.data.get("parallel"):
+                results = self.run_parallel(parent, specs)
+            else:
+                results = [run(parent, spec) for spec in specs]
+        return Response({"results": results})
+
+    def validate(self, specs):
+        if not isinstance(specs, list) or not 1 <= len(specs) <= MAX_REQUESTS:
+            return f"requests takes a list of 1 to {MAX_REQUESTS} requests"
+        for spec in specs:
+            if not isinstance(spec, dict) or not isinstance(spec.get("path"), str) or not spec["path"].startswith("/"):
+                return 'each request needs a "path" starting with /'
+            if str(spec.get("method", "GET")).upper() not in METHODS:
+                return f"method must be one of {', '.join(sorted(METHODS))}"
+            if not isinstance(spec.get("headers", {}), dict):
+                return "headers must be an object"
+        return None
+
+    def run_parallel(self, parent, specs):
+        results, reads = [], []
+
+        def wait_for_reads():
+            results.extend(f.result() for f in reads)
+            reads.clear()
+
+        for spec in specs:
+            if spec["method"] in SAFE_METHODS:
+                reads.append(executor().submit(run_in_thread, copy_context(), parent, spec))
+            else:
+                wait_for_reads()
+                results.append(run(parent, spec))
+        wait_for_reads()
+        return results
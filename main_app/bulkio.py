@@ -0,0 +1,362 @@
+import csv
+import json
+from decimal import Decimal
+from django.core.management.color import no_style
+from django.db import IntegrityError, connection, transaction
+from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
+from .caching import bump_refdata_version
+from .geo import station_index
+from .models import Line, Station, Category, Place, SearchTerm
+from .serializers import LineSerializer, StationSerializer, CategorySerializer, PlaceSerializer
+from . import search, tiles
+
+FORMATS = ("csv", "jsonl", "geojson")
+
+
+def guess_format(path):
+    for ext, fmt in ((".csv", "csv"), (".jsonl", "jsonl"), (".ndjson", "jsonl"), (".geojson", "geojson"), (".json", "geojson")):
+        if path.lower().endswith(ext):
+            return fmt
+    return None
+
+
+# ---- reading -------------------------------------------------------------
+
+class BadRow:
+    # a row the reader could not parse; the importer reports it and carries on
+    def __init__(self, message):
+        self.message = message
+
+
+def parse_json(text, to_row=dict):
+    try:
+        obj = json.loads(text)
+    except json.JSONDecodeError as e:
+        return BadRow(f"invalid JSON: {e}")
+    if not isinstance(obj, dict):
+        return BadRow("expected a JSON object")
+    try:
+        return to_row(obj)
+    except (AttributeError, TypeError, ValueError, IndexError, KeyError) as e:
+        return BadRow(f"invalid feature: {e}")
+
+def read_csv(f):
+    for i, row in enumerate(csv.DictReader(f), start=2):
+        yield i, {k: v for k, v in row.items() if k is not None and v != ""}
+
+
+def read_jsonl(f):
+    for i, line in enumerate(f, start=1):
+        line = line.strip()
+        if line:
+            yield i, parse_json(line)
+
+
+def feature_to_row(feature):
+    if not isinstance(feature, dict):
+        raise TypeError("expected a Feature object")
+    row = dict(feature.get("properties") or {})
+    geometry = feature.get("geometry") or {}
+    if geometry.get("type") == "Point":
+        row["lng"], row["lat"] = geometry["coordinates"][:2]
+    if feature.get("id") is not None and "id" not in row:
+        row["id"] = feature["id"]
+    return row
+
+
+def read_geojson(f, chunk_size=1 << 16):
+    """Yield features one at a time from a FeatureCollection (or one feature per line) without loading the file."""
+    buf = f.read(chunk_size)
+    head = buf.lstrip("\x1e \t\r\n")
+    if head.startswith("{") and '"features"' not in buf and '"Feature"' in head.split("\n", 1)[0]:
+        # GeoJSON text sequence / newline-delimited features
+        n = 0
+        for line in _lines(buf, f):
+            line = line.strip("\x1e \t\r\n")
+            if line:
+                n += 1
+                yield n, parse_json(line, feature_to_row)
+        return
+
+    decoder = json.JSONDecoder()
+    while True:
+        start = buf.find('"features"')
+        bracket = buf.find("[", start) if start != -1 else -1
+        if bracket != -1:
+            break
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        buf += chunk
+    buf, n = buf[bracket + 1:], 0
+    while True:
+        buf = buf.lstrip(" \t\r\n,")
+        if buf.startswith("]"):
+            return
+        try:
+            feature, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError as e:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                # truncated or broken past this point: the features before it still count
+                yield n + 1, BadRow(f"invalid JSON, stopped reading: {e}")
+                return
+            buf += chunk
+            continue
+        buf = buf[end:]
+        n += 1
+        try:
+            row = feature_to_row(feature)
+        except (AttributeError, TypeError, ValueError, IndexError, KeyError) as e:
+            row = BadRow(f"invalid feature: {e}")
+        yield n, row
+
+
+def _lines(first, f):
+    pending = first
+    for line in f:
+        pending += line
+        *complete, pending = pending.split("\n")
+        yield from complete
+    yield from pending.split("\n")
+
+
+READERS = {"csv": read_csv, "jsonl": read_jsonl, "geojson": read_geojson}
+
+
+# ---- validation --------------------------------------------------------------
+
+class CachedRelatedField(serializers.Field):
+    # resolves ids from a dict preloaded into the serializer context instead of one query per row
+    default_error_messages = {"does_not_exist": 'Invalid pk "{pk_value}" - object does not exist.'}
+
+    def __init__(self, cache, **kwargs):
+        self.cache = cache
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        try:
+            return self.context[self.cache][int(data)]
+        except (KeyError, TypeError, ValueError):
+            self.fail("does_not_exist", pk_value=data)
+
+    def to_representation(self, value):
+        return value.pk
+
+
+class ImportSerializerMixin:
+    # uniqueness is resolved by the upsert, not by a lookup per row
+    def get_fields(self):
+        fields = super().get_fields()
+        for field in fields.values():
+            field.validators = [v for v in field.validators if not isinstance(v, UniqueValidator)]
+        return fields
+
+    def get_validators(self):
+        return []
+
+
+class LineImportSerializer(ImportSerializerMixin, LineSerializer):
+    pass
+
+
+class CategoryImportSerializer(ImportSerializerMixin, CategorySerializer):
+    pass
+
+
+class StationImportSerializer(ImportSerializerMixin, StationSerializer):
+    line_id = CachedRelatedField("lines", source="line", write_only=True)
+
+    class Meta(StationSerializer.Meta):
+        fields = StationSerializer.Meta.fields + ["sequence"]
+
+
+class PlaceImportSerializer(ImportSerializerMixin, PlaceSerializer):
+    id = serializers.IntegerField(required=False, min_value=1)
+    category = CachedRelatedField("categories")
+
+
+class Spec:
+    def __init__(self, model, serializer, unique_fields, update_fields, natural_keys=(), export_fields=(), point=False):
+        self.model = model
+        self.serializer = serializer
+        self.unique_fields = unique_fields
+        self.update_fields = update_fields
+        self.natural_keys = natural_keys  # (column, context cache, target column)
+        self.export_fields = export_fields
+        self.point = point
+
+
+SPECS = {
+    "lines": Spec(Line, LineImportSerializer, ["code"], ["name", "color"],
+                  export_fields=("code", "name", "color")),
+    "categories": Spec(Category, CategoryImportSerializer, ["code"], ["name"],
+                       export_fields=("code", "name")),
+    "stations": Spec(Station, StationImportSerializer, ["code"], ["name", "line", "lat", "lng", "sequence"],
+                     natural_keys=[("line_code", "line_codes", "line_id")],
+                     export_fields=("code", "name", ("line_code", "line__code"), "sequence", "lat", "lng"), point=True),
+    "places": Spec(Place, PlaceImportSerializer, ["id"],
+                   ["name", "description", "category", "lat", "lng", "nearest_station", "nearest_station_distance_km"],
+                   natural_keys=[("category_code", "category_codes", "category")],
+                   export_fields=("id", "name", "description", ("category_code", "category__code"), "lat", "lng"), point=True),
+}
+
+
+class Importer:
+    def __init__(self, kind, batch_size=1000, on_error=None):
+        self.spec = SPECS[kind]
+        self.kind = kind
+        self.batch_size = batch_size
+        self.on_error = on_error or (lambda row_no, errors: None)
+        self.context = {}
+        self.ok = 0
+        self.failed = 0
+        self.refresh_context()
+
+    def refresh_context(self):
+        if self.kind == "stations":
+            lines = Line.objects.in_bulk()
+            self.context.update(lines=lines, line_codes={l.code: l.pk for l in lines.values()})
+        if self.kind == "places":
+            categories = Category.objects.in_bulk()
+            self.context.update(categories=categories, category_codes={c.code: c.pk for c in categories.values()})
+            self.context["stations"] = station_index.tree()  # looked up once, not per row
+
+    def error(self, row_no, errors):
+        self.failed += 1
+        self.on_error(row_no, errors)
+
+    def build(self, row_no, row):
+        row = dict(row)
+        for column, cache, target in self.spec.natural_keys:
+            if column in row:
+                code = row.pop(column)
+                if code not in self.context[cache]:
+                    self.error(row_no, {column: [f'unknown code "{code}"']})
+                    return None
+                row[target] = self.context[cache][code]
+        s = self.spec.serializer(data=row, context=self.context)
+        if not s.is_valid():
+            self.error(row_no, s.errors)
+            return None
+        obj = self.spec.model(**s.validated_data)
+        if isinstance(obj, Place):
+            obj.assign_nearest_station(self.context["stations"])
+        return obj
+
+    def run(self, rows):
+        batch = []
+        for row_no, row in rows:
+            if isinstance(row, BadRow):
+                self.error(row_no, {"non_field_errors": [row.message]})
+                continue
+            obj = self.build(row_no, row)
+            if obj is not None:
+                batch.append((row_no, obj))
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+        self.flush(batch)
+        self.finish()
+        return self.ok, self.failed
+
+    def upsert(self, objs):
+        spec = self.spec
+        if spec.unique_fields == ["id"]:
+            new = [o for o in objs if o.pk is None]
+            existing = [o for o in objs if o.pk is not None]
+            saved = spec.model.objects.bulk_create(new)
+            if existing:
+                saved += spec.model.objects.bulk_create(
+                    existing, update_conflicts=True, unique_fields=["id"], update_fields=spec.update_fields,
+                )
+            return saved
+        return spec.model.objects.bulk_create(
+            objs, update_conflicts=True, unique_fields=spec.unique_fields, update_fields=spec.update_fields,
+        )
+
+    def flush(self, batch):
+        if not batch:
+            return
+        try:
+            with transaction.atomic():
+                saved = self.upsert([obj for _n, obj in batch])
+            self.ok += len(batch)
+        except IntegrityError:
+            # find the offending rows one by one, keep the rest
+            saved = []
+            for row_no, obj in batch:
+                try:
+                    with transaction.atomic():
+                        saved += self.upsert([obj])
+                    self.ok += 1
+                except IntegrityError as e:
+                    self.error(row_no, {"non_field_errors": [str(e)]})
+        if self.kind == "places":
+            # bulk_create skips the signals that keep the search index current
+            search.index_objects(SearchTerm.PLACE, [o for o in saved if o.pk is not None])
+
+    def finish(self):
+        if self.kind in ("lines", "stations", "categories"):
+            bump_refdata_version()
+        if self.kind in ("stations", "places"):
+            tiles.invalidate_all()
+        if self.kind == "places":
+            # rows imported with their ids leave the id sequence behind (PostgreSQL)
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Place]):
+                    cursor.execute(sql)
+
+
+# ---- writing -----------------------------------------------------------------
+
+def export_rows(kind, chunk_size=2000):
+    spec = SPECS[kind]
+    columns = [f if isinstance(f, str) else f[0] for f in spec.export_fields]
+    lookups = [f if isinstance(f, str) else f[1] for f in spec.export_fields]
+    qs = spec.model.objects.order_by("pk").values_list(*lookups)
+    for values in qs.iterator(chunk_size=chunk_size):
+        yield dict(zip(columns, values))
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def write_csv(kind, rows, out):
+    spec = SPECS[kind]
+    writer = csv.DictWriter(out, fieldnames=[f if isinstance(f, str) else f[0] for f in spec.export_fields])
+    writer.writeheader()
+    n = 0
+    for row in rows:
+        writer.writerow(row)
+        n += 1
+    return n
+
+
+def write_jsonl(kind, rows, out):
+    n = 0
+    for row in rows:
+        out.write(json.dumps(row, default=_json_default, ensure_ascii=False) + "\n")
+        n += 1
+    return n
+
+
+def write_geojson(kind, rows, out):
+    if not SPECS[kind].point:
+        raise ValueError(f"{kind} have no coordinates, use csv or jsonl")
+    out.write('{"type": "FeatureCollection", "features": [\n')
+    n = 0
+    for row in rows:
+        lat, lng = row.pop("lat"), row.pop("lng")
+        feature = {"type": "Feature", "geometry": {"type": "Point", "coordinates": [lng, lat]}, "properties": row}
+        out.write((",\n" if n else "") + json.dumps(feature, default=_json_default, ensure_ascii=False))
+        n += 1
+    out.write("\n]}\n")
+    return n
+
+
+WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "geojson": write_geojson}
@@ -0,0 +1,69 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from rest_framework import status
+from rest_framework.response import Response
+from .models import CacheVersion
+
+# one version for lines, stations and categories: stations embed their line,
+# so any change to the three of them invalidates every cached response
+REFDATA = "refdata"
+
+
+def get_version(name):
+    return CacheVersion.objects.filter(name=name).values_list("version", flat=True).first() or 1
+
+
+def bump_version(name):
+    if CacheVersion.objects.filter(name=name).update(version=F("version") + 1):
+        return
+    try:
+        with transaction.atomic():
+            CacheVersion.objects.create(name=name, version=2)
+    except IntegrityError:
+        CacheVersion.objects.filter(name=name).update(version=F("version") + 1)
+
+
+def refdata_version():
+    return get_version(REFDATA)
+
+
+def bump_refdata_version():
+    bump_version(REFDATA)
+
+
+def etag_matches(request, etag):
+    header = request.headers.get("If-None-Match", "")
+    return header.strip() == "*" or etag in [t.strip() for t in header.split(",")]
+
+
+class VersionedCacheMixin:
+    """Caches GET list/retrieve responses under the reference data version, with ETags."""
+
+    def cached_response(self, request, build):
+        version = refdata_version()
+        path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+        # the same data in a compact format (renderers.py) is a different representation
+        fmt = getattr(getattr(request, "accepted_renderer", None), "format", "json")
+        etag = f'"{version}-{path[:16]}"' if fmt in ("json", "api") else f'"{version}-{path[:16]}-{fmt}"'
+        headers = {"ETag": etag, "Cache-Control": "public, no-cache"}
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        key = f"refdata:{version}:{path}"
+        data = cache.get(key)
+        if data is None:
+            response = build()
+            if response.status_code != 200:
+                return response
+            data = response.data
+            cache.set(key, data, getattr(settings, "REFDATA_CACHE_TIMEOUT", 60 * 60 * 24))
+        return Response(data, status=200, headers=headers)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(VersionedCacheMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(VersionedCacheMixin, self).retrieve(request, *args, **kwargs))
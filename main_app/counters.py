@@ -0,0 +1,42 @@
+from django.db.models import Avg, Case, Count, F, Sum, FloatField, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce
+from .models import Post, Comment, Rating
+
+
+def bump_comments(post_id, delta):
+    if post_id and delta:
+        Post.objects.filter(pk=post_id).update(comments_count=F("comments_count") + delta)
+
+
+def bump_ratings(post_id, count_delta, sum_delta):
+    if not post_id or not (count_delta or sum_delta):
+        return
+    # every F() here reads the row's pre-update values, so one UPDATE stays consistent
+    new_count = F("ratings_count") + count_delta
+    new_sum = F("ratings_sum") + sum_delta
+    Post.objects.filter(pk=post_id).update(
+        ratings_count=new_count,
+        ratings_sum=new_sum,
+        avg_rating=Case(
+            When(ratings_count__gt=-count_delta, then=Cast(new_sum, FloatField()) / Cast(new_count, FloatField())),
+            default=Value(None),
+            output_field=FloatField(),
+        ),
+    )
+
+
+def rebuild(queryset=None):
+    """Recompute every counter from the comments and ratings tables."""
+    if queryset is None:
+        queryset = Post.objects.all()
+    comments = (
+        Comment.objects.filter(post=OuterRef("pk")).order_by()
+        .values("post").annotate(n=Count("id")).values("n")
+    )
+    ratings = Rating.objects.filter(post=OuterRef("pk")).order_by().values("post")
+    return queryset.update(
+        comments_count=Coalesce(Subquery(comments, output_field=IntegerField()), 0),
+        ratings_count=Coalesce(Subquery(ratings.annotate(n=Count("id")).values("n"), output_field=IntegerField()), 0),
+        ratings_sum=Coalesce(Subquery(ratings.annotate(s=Sum("value")).values("s"), output_field=IntegerField()), 0),
+        avg_rating=Subquery(ratings.annotate(a=Avg("value")).values("a"), output_field=FloatField()),
+    )
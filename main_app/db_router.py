@@ -0,0 +1,40 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+# The replica picked by ReadReplicaMiddleware for a safe request that isn't pinned to the
+# primary, once per request so its reads don't mix replicas that lag by different amounts.
+# Anything else (writes, management commands, background tasks) reads from the primary.
+_use_replica = ContextVar("use_replica", default=None)
+
+
+def pick_replica():
+    replicas = getattr(settings, "DATABASE_REPLICAS", [])
+    return random.choice(replicas) if replicas else None
+
+
+@contextmanager
+def read_from_replica(alias):
+    # alias None reads from the primary
+    token = _use_replica.set(alias)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _use_replica.get() or "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # replicas get their schema through replication
+        return db not in getattr(settings, "DATABASE_REPLICAS", [])
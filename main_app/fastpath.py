@@ -0,0 +1,146 @@
+# Read-only twins of the Station, Place, PostPublic and Comment serializers for the
+# hot list endpoints: they build the same dicts straight from values() rows, reusing the
+# DRF fields' to_representation for scalars. tests.py checks both render the same bytes.
+from django.core.files.storage import default_storage
+from .serializers import StationSerializer, PlaceSerializer, PostPublicSerializer, CommentSerializer
+
+
+class FastSerializer:
+    serializer_class = None
+    columns = ()
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        self.fields = self.serializer_class(context=self.context).fields
+        self.compile()
+
+    def compile(self):
+        pass
+
+    def values(self, queryset, *extra):
+        extra = [c for c in extra if c not in self.columns]
+        return queryset.values(*self.columns, *extra)
+
+    def many(self, rows):
+        to_dict = self.to_dict
+        return [to_dict(r) for r in rows]
+
+
+class FastStationSerializer(FastSerializer):
+    serializer_class = StationSerializer
+    columns = ("id", "name", "code", "lat", "lng", "line_id", "line__name", "line__code", "line__color")
+
+    def compile(self):
+        self.lat = self.fields["lat"].to_representation
+        self.lng = self.fields["lng"].to_representation
+
+    def to_dict(self, r):
+        return {
+            "id": r["id"],
+            "name": r["name"],
+            "code": r["code"],
+            "lat": self.lat(r["lat"]),
+            "lng": self.lng(r["lng"]),
+            "line": {"id": r["line_id"], "name": r["line__name"], "code": r["line__code"], "color": r["line__color"]},
+        }
+
+
+class FastPlaceSerializer(FastSerializer):
+    serializer_class = PlaceSerializer
+    columns = (
+        "id", "name", "description",
+        "category_id", "category__name", "category__code",
+        "nearest_station_id", "nearest_station__name", "nearest_station__code", "nearest_station__line__code",
+        "nearest_station_distance_km", "lat", "lng", "created_by_id", "created_at",
+    )
+
+    def compile(self):
+        self.lat = self.fields["lat"].to_representation
+        self.lng = self.fields["lng"].to_representation
+        self.created_at = self.fields["created_at"].to_representation
+
+    def to_dict(self, r):
+        station_id = r["nearest_station_id"]
+        distance = r["nearest_station_distance_km"]
+        d = {
+            "id": r["id"],
+            "name": r["name"],
+            "description": r["description"],
+            "category": r["category_id"],
+            "category_detail": {"id": r["category_id"], "name": r["category__name"], "code": r["category__code"]},
+            "nearest_station": station_id,
+            "nearest_station_detail": None if station_id is None else {
+                "id": station_id, "name": r["nearest_station__name"],
+                "code": r["nearest_station__code"], "line": r["nearest_station__line__code"],
+            },
+            "nearest_station_distance_km": None if distance is None else float(distance),
+            "lat": self.lat(r["lat"]),
+            "lng": self.lng(r["lng"]),
+            "created_by": r["created_by_id"],
+            "created_at": None if r["created_at"] is None else self.created_at(r["created_at"]),
+        }
+        # like the DRF field, distance_km is only present when it was annotated
+        if "distance_km" in r:
+            d["distance_km"] = None if r["distance_km"] is None else float(r["distance_km"])
+        return d
+
+
+class FastPostPublicSerializer(FastSerializer):
+    serializer_class = PostPublicSerializer
+    columns = (
+        "id", "title", "body", "image", "image_variants",
+        "place_id", "place__name", "station_id", "station__code",
+        "created_by_id", "created_by__username", "created_at", "updated_at",
+        "comments_count", "ratings_count", "avg_rating", "my_rating",
+    )
+
+    def compile(self):
+        self.created_at = self.fields["created_at"].to_representation
+        self.updated_at = self.fields["updated_at"].to_representation
+        self.image_variants = self.fields["image_variants"].to_representation
+        self.request = self.context.get("request")
+
+    def image(self, name):
+        if not name:
+            return None
+        url = default_storage.url(name)
+        return self.request.build_absolute_uri(url) if self.request is not None else url
+
+    def to_dict(self, r):
+        d = {
+            "id": r["id"],
+            "title": r["title"],
+            "body": r["body"],
+            "image": self.image(r["image"]),
+            "image_variants": self.image_variants(r["image_variants"]),
+            "place": None if r["place_id"] is None else {"id": r["place_id"], "name": r["place__name"]},
+            "station": None if r["station_id"] is None else {"id": r["station_id"], "code": r["station__code"]},
+        }
+        # DRF drops author entirely when the post has no creator
+        if r["created_by_id"] is not None:
+            d["author"] = r["created_by__username"]
+        d["created_at"] = self.created_at(r["created_at"])
+        d["updated_at"] = self.updated_at(r["updated_at"])
+        d["comments_count"] = r["comments_count"]
+        d["ratings_count"] = r["ratings_count"]
+        d["avg_rating"] = None if r["avg_rating"] is None else float(r["avg_rating"])
+        d["my_rating"] = r["my_rating"]
+        return d
+
+
+class FastCommentSerializer(FastSerializer):
+    serializer_class = CommentSerializer
+    columns = ("id", "post_id", "body", "created_by_id", "created_by__username", "created_at")
+
+    def compile(self):
+        self.created_at = self.fields["created_at"].to_representation
+
+    def to_dict(self, r):
+        return {
+            "id": r["id"],
+            "post": r["post_id"],
+            "body": r["body"],
+            "created_by": r["created_by_id"],
+            "author": r["created_by__username"],
+            "created_at": self.created_at(r["created_at"]),
+        }
@@ -0,0 +1,136 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Post, Subscription, TimelineEntry
+
+# Station and place feeds. A new public post is copied into the timeline of every
+# follower (write-time fan-out), so opening the app reads one user's timeline off
+# its index. Sources with more than FEED_FANOUT_MAX_SUBSCRIBERS followers are
+# "hot": their posts aren't copied, they are merged in when the timeline is read.
+
+BATCH_SIZE = 1000
+BACKFILL = 50  # recent posts copied into a timeline on subscribe
+UNREAD_CAP = 100  # unread counts of hot sources stop counting here
+
+
+def max_subscribers():
+    return getattr(settings, "FEED_FANOUT_MAX_SUBSCRIBERS", 5000)
+
+
+def source(sub):
+    return {"station_id": sub.station_id} if sub.station_id else {"place_id": sub.place_id}
+
+
+def subscribe(user_id, station=None, place=None):
+    src = {"station": station} if station else {"place": place}
+    followers = Subscription.objects.filter(**src)
+    hot = followers.filter(fanout=False).exists() or followers.count() >= max_subscribers()
+    try:
+        with transaction.atomic():
+            sub = Subscription.objects.create(user_id=user_id, fanout=not hot, **src)
+    except IntegrityError:
+        return Subscription.objects.get(user_id=user_id, **src), False
+    if hot:
+        # a source stays hot from here on: going back to fan-out would leave the
+        # posts published meanwhile out of every timeline
+        followers.filter(fanout=True).update(fanout=False)
+    else:
+        backfill(sub)
+    return sub, True
+
+
+def backfill(sub):
+    posts = Post.objects.filter(is_public=True, **source(sub)).order_by("-created_at").values_list("id", "created_at")
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=sub.user_id, post_id=pk, post_created_at=created) for pk, created in posts[:BACKFILL]],
+        ignore_conflicts=True,
+    )
+
+
+def unsubscribe(sub):
+    # the source's posts leave the timeline, unless another followed source also has them
+    still_followed = Q()
+    for other in Subscription.objects.filter(user_id=sub.user_id).exclude(pk=sub.pk):
+        still_followed |= Q(**{f"post__{k}": v for k, v in source(other).items()})
+    entries = TimelineEntry.objects.filter(user_id=sub.user_id, **{f"post__{k}": v for k, v in source(sub).items()})
+    if still_followed:
+        entries = entries.exclude(still_followed)
+    with transaction.atomic():
+        entries.delete()
+        sub.delete()
+
+
+def fan_out(post_id):
+    post = Post.objects.filter(pk=post_id, is_public=True).values("id", "created_at", "station_id", "place_id").first()
+    if post is None or not (post["station_id"] or post["place_id"]):
+        return 0
+    match = Q()
+    if post["station_id"]:
+        match |= Q(station_id=post["station_id"])
+    if post["place_id"]:
+        match |= Q(place_id=post["place_id"])
+    subs = Subscription.objects.filter(match, fanout=True)
+
+    last_id, total = 0, 0
+    while True:
+        users = list(
+            subs.filter(user_id__gt=last_id).order_by("user_id")
+            .values_list("user_id", flat=True).distinct()[:BATCH_SIZE]
+        )
+        if not users:
+            break
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=u, post_id=post["id"], post_created_at=post["created_at"]) for u in users],
+            ignore_conflicts=True,
+        )
+        total += len(users)
+        last_id = users[-1]
+    subs.update(unread_count=F("unread_count") + 1)
+    return total
+
+
+def unread_counts(subs):
+    """{subscription id: unread posts}; hot sources are counted from the posts table."""
+    counts = {}
+    for sub in subs:
+        if sub.fanout:
+            counts[sub.pk] = sub.unread_count
+        else:
+            recent = Post.objects.filter(is_public=True, created_at__gt=sub.last_read_at, **source(sub))
+            counts[sub.pk] = recent[:UNREAD_CAP].count()
+    return counts
+
+
+def mark_read(subs):
+    return subs.update(unread_count=0, last_read_at=timezone.now())
+
+
+def timeline(user_id, subs, rows, size, after=None):
+    """
+    One page of the user's feed, newest first, and whether there is more.
+    rows turns a Post queryset into the row dicts to return; after is the
+    (created_at, id) of the last post already sent.
+    """
+    # one Q, so the timeline join is shared by the filter and the ordering
+    entries = Q(timeline_entries__user_id=user_id)
+    if after is not None:
+        entries &= (
+            Q(timeline_entries__post_created_at__lt=after[0])
+            | Q(timeline_entries__post_created_at=after[0], timeline_entries__post_id__gt=after[1])
+        )
+    own = Post.objects.filter(entries, is_public=True).order_by("-timeline_entries__post_created_at", "timeline_entries__post_id")
+    found = list(rows(own)[:size + 1])
+
+    hot = Q()
+    for sub in subs:
+        if not sub.fanout:
+            hot |= Q(**source(sub))
+    if hot:
+        merged = Post.objects.filter(hot, is_public=True)
+        if after is not None:
+            merged = merged.filter(Q(created_at__lt=after[0]) | Q(created_at=after[0], id__gt=after[1]))
+        seen = {r["id"] for r in found}
+        found += [r for r in rows(merged.order_by("-created_at", "id"))[:size + 1] if r["id"] not in seen]
+        found.sort(key=lambda r: (-r["created_at"].timestamp(), r["id"]))
+    return found[:size], len(found) > size
@@ -0,0 +1,154 @@
+import heapq
+import math
+import threading
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cast, Cos, Least, Power, Radians, Round, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    R = EARTH_RADIUS_KM
+    lat1, lon1, lat2, lon2 = map(float, (lat1, lon1, lat2, lon2))
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
+    return 2*R*math.asin(math.sqrt(a))
+
+
+def distance_expression(lat, lng, lat_field="lat", lng_field="lng"):
+    """Haversine distance in km from (lat, lng) to each row, computed by the database."""
+    flat = Radians(Cast(F(lat_field), FloatField()))
+    flng = Radians(Cast(F(lng_field), FloatField()))
+    lat0 = math.radians(float(lat))
+    lng0 = math.radians(float(lng))
+    a = (
+        Power(Sin((flat - Value(lat0)) / 2), 2)
+        + Value(math.cos(lat0)) * Cos(flat) * Power(Sin((flng - Value(lng0)) / 2), 2)
+    )
+    return Round(
+        Value(2 * EARTH_RADIUS_KM) * ASin(Least(Sqrt(a), Value(1.0))),
+        3,
+        output_field=FloatField(),
+    )
+
+
+def bounding_box(lat, lng, radius_km):
+    """(min_lat, max_lat, min_lng, max_lng) enclosing a circle of radius_km.
+
+    A box that crosses the antimeridian wraps around, so min_lng > max_lng.
+    """
+    lat, lng = float(lat), float(lng)
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    ratio = math.sin(radius_km / EARTH_RADIUS_KM) / max(math.cos(math.radians(lat)), 1e-12)
+    if not 0 < ratio < 1 or abs(lat) + dlat >= 90:
+        return (max(lat - dlat, -90.0), min(lat + dlat, 90.0), -180.0, 180.0)
+    dlng = math.degrees(math.asin(ratio))
+    wrap = lambda x: (x + 180.0) % 360.0 - 180.0
+    return (lat - dlat, lat + dlat, wrap(lng - dlng), wrap(lng + dlng))
+
+
+def near(qs, lat, lng, radius_km=None):
+    # bounding box first so the lat/lng index does the heavy filtering,
+    # then the exact distance is computed and sorted by the database
+    if radius_km is not None:
+        min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+        qs = qs.filter(lat__gte=min_lat, lat__lte=max_lat)
+        if min_lng <= max_lng:
+            qs = qs.filter(lng__gte=min_lng, lng__lte=max_lng)
+        else:
+            qs = qs.filter(Q(lng__gte=min_lng) | Q(lng__lte=max_lng))
+    qs = qs.annotate(distance_km=distance_expression(lat, lng))
+    if radius_km is not None:
+        qs = qs.filter(distance_km__lte=radius_km)
+    return qs.order_by("distance_km", "id")
+
+
+def to_xyz(lat, lng):
+    # points on the unit sphere: chord length grows with great-circle
+    # distance, so a plain euclidean k-d tree gives the same nearest order
+    phi, lam = math.radians(float(lat)), math.radians(float(lng))
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+
+class KDTree:
+    def __init__(self, points):
+        # points: list of (key, lat, lng)
+        self.items = [(key, float(lat), float(lng), to_xyz(lat, lng)) for key, lat, lng in points]
+        self.root = self._build(list(range(len(self.items))), 0)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _build(self, idx, depth):
+        if not idx:
+            return None
+        axis = depth % 3
+        idx.sort(key=lambda i: self.items[i][3][axis])
+        mid = len(idx) // 2
+        return (idx[mid], axis, self._build(idx[:mid], depth + 1), self._build(idx[mid + 1:], depth + 1))
+
+    def nearest(self, lat, lng, k=1):
+        """Return up to k (distance_km, key) pairs, closest first."""
+        if k < 1 or self.root is None:
+            return []
+        target = to_xyz(lat, lng)
+        heap = []  # max-heap on squared chord distance: (-d2, key index)
+
+        def visit(node):
+            if node is None:
+                return
+            i, axis, left, right = node
+            p = self.items[i][3]
+            d2 = (p[0]-target[0])**2 + (p[1]-target[1])**2 + (p[2]-target[2])**2
+            if len(heap) < k:
+                heapq.heappush(heap, (-d2, i))
+            elif d2 < -heap[0][0]:
+                heapq.heapreplace(heap, (-d2, i))
+            diff = target[axis] - p[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            if len(heap) < k or diff * diff < -heap[0][0]:
+                visit(far)
+
+        visit(self.root)
+        found = []
+        for _neg, i in heap:
+            key, plat, plng, _xyz = self.items[i]
+            found.append((haversine_km(lat, lng, plat, plng), key))
+        found.sort()
+        return found
+
+
+class StationIndex:
+    """Process-wide k-d tree over station coordinates, rebuilt lazily after changes."""
+
+    def __init__(self):
+        self._tree = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._tree = None
+
+    def tree(self):
+        # the shared reference data version also catches edits made by other processes
+        from .caching import refdata_version
+        version = refdata_version()
+        tree = self._tree
+        if tree is None or self._version != version:
+            from .models import Station
+            with self._lock:
+                if self._tree is None or self._version != version:
+                    self._tree = KDTree(Station.objects.values_list("id", "lat", "lng"))
+                    self._version = version
+                tree = self._tree
+        return tree
+
+    def nearest(self, lat, lng, k=1):
+        return self.tree().nearest(lat, lng, k)
+
+
+station_index = StationIndex()
@@ -0,0 +1,68 @@
+import io
+import posixpath
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+from .models import Post
+
+# name -> max width; each variant is written as WebP and JPEG
+VARIANT_WIDTHS = {"thumb": 320, "medium": 800, "large": 1600}
+VARIANT_FORMATS = {"webp": ("WEBP", {"quality": 80, "method": 4}), "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True})}
+
+
+def variant_name(post_id, variant, ext):
+    return posixpath.join("posts", "variants", str(post_id), f"{variant}.{ext}")
+
+
+def encode(img, fmt, options):
+    buf = io.BytesIO()
+    img.save(buf, fmt, **options)
+    return buf.getvalue()
+
+
+def replace_file(name, data):
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    return default_storage.save(name, ContentFile(data))
+
+
+def delete_variants(variants):
+    for name in iter_variant_files(variants):
+        if default_storage.exists(name):
+            default_storage.delete(name)
+
+
+def iter_variant_files(variants):
+    for key, formats in (variants or {}).items():
+        if key != "source":
+            yield from formats.values()
+
+
+def process_post_image(post_id):
+    """Strip EXIF from the original and write the resized variants, decoding the upload once."""
+    post = Post.objects.filter(pk=post_id).only("id", "image", "image_variants").first()
+    if post is None or not post.image:
+        return
+    source = post.image.name
+    with post.image.open("rb") as f:
+        img = Image.open(f)
+        original_format = img.format or "JPEG"
+        img = ImageOps.exif_transpose(img)
+        img.load()
+
+    # re-encoding without passing exif drops it (GPS, camera serials, ...)
+    rgb = img.convert("RGB") if img.mode not in ("RGB", "L") else img
+    original = img if original_format in ("PNG", "WEBP", "GIF") else rgb
+    source = replace_file(source, encode(original, original_format, {"quality": 90} if original_format == "JPEG" else {}))
+
+    variants = {"source": source}
+    for variant, width in VARIANT_WIDTHS.items():
+        resized = rgb.copy()
+        resized.thumbnail((width, width * 4), Image.LANCZOS)
+        variants[variant] = {
+            ext: replace_file(variant_name(post_id, variant, ext), encode(resized, fmt, options))
+            for ext, (fmt, options) in VARIANT_FORMATS.items()
+        }
+
+    # if the upload was replaced meanwhile, the job for the new file writes the variants
+    Post.objects.filter(pk=post_id, image=post.image.name).update(image=source, image_variants=variants)
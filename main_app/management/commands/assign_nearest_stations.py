@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from main_app.geo import station_index
+from main_app.models import Place
+
+
+class Command(BaseCommand):
+    help = "Recompute nearest_station and its distance for every place (re-run after stations change)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        station_index.invalidate()
+        tree = station_index.tree()  # once for the whole run
+        batch_size = opts["batch_size"]
+        qs = Place.objects.only("id", "lat", "lng", "nearest_station_id", "nearest_station_distance_km").order_by("pk")
+        last_id, seen, changed = 0, 0, 0
+        while True:
+            batch = list(qs.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            dirty = []
+            for place in batch:
+                before = (place.nearest_station_id, place.nearest_station_distance_km)
+                place.assign_nearest_station(tree)
+                if (place.nearest_station_id, place.nearest_station_distance_km) != before:
+                    dirty.append(place)
+            Place.objects.bulk_update(dirty, ["nearest_station", "nearest_station_distance_km"])
+            seen += len(batch)
+            changed += len(dirty)
+            last_id = batch[-1].pk
+        self.stdout.write(self.style.SUCCESS(f"Checked {seen} places, updated {changed}"))
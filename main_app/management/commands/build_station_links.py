@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from main_app.caching import bump_refdata_version
+from main_app.geo import haversine_km
+from main_app.models import Station, StationLink
+
+
+class Command(BaseCommand):
+    help = "Generate line links from Station.sequence and transfer links between nearby stations on different lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--speed-kmh", type=float, default=35.0, help="average speed between stations")
+        parser.add_argument("--dwell-seconds", type=int, default=30)
+        parser.add_argument("--transfer-radius-km", type=float, default=0.3)
+        parser.add_argument("--transfer-seconds", type=int, default=300)
+
+    def handle(self, *args, **opts):
+        stations = list(Station.objects.order_by("line_id", "sequence", "code"))
+        links = {}
+
+        by_line = {}
+        for s in stations:
+            if s.sequence is not None:
+                by_line.setdefault(s.line_id, []).append(s)
+        for line_stations in by_line.values():
+            for a, b in zip(line_stations, line_stations[1:]):
+                km = haversine_km(a.lat, a.lng, b.lat, b.lng)
+                seconds = round(km / opts["speed_kmh"] * 3600) + opts["dwell_seconds"]
+                links[(a.id, b.id)] = (StationLink.LINE, seconds)
+
+        for i, a in enumerate(stations):
+            for b in stations[i + 1:]:
+                if a.line_id != b.line_id and haversine_km(a.lat, a.lng, b.lat, b.lng) <= opts["transfer_radius_km"]:
+                    links[(a.id, b.id)] = (StationLink.TRANSFER, opts["transfer_seconds"])
+
+        with transaction.atomic():
+            StationLink.objects.all().delete()
+            StationLink.objects.bulk_create([
+                StationLink(from_station_id=a, to_station_id=b, kind=kind, travel_seconds=seconds)
+                for (a, b), (kind, seconds) in links.items()
+            ])
+            # bulk_create skips signals, so drop the cached graph explicitly
+            transaction.on_commit(bump_refdata_version)
+        self.stdout.write(self.style.SUCCESS(f"Created {len(links)} station links"))
@@ -0,0 +1,28 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from main_app.bulkio import FORMATS, SPECS, WRITERS, export_rows, guess_format
+
+
+class Command(BaseCommand):
+    help = "Stream lines, categories, stations or places out as CSV, JSON Lines or GeoJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=list(SPECS))
+        parser.add_argument("--output", default="-", help="output file, or - for stdout")
+        parser.add_argument("--format", choices=FORMATS)
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        fmt = opts["format"] or (guess_format(opts["output"]) if opts["output"] != "-" else "jsonl")
+        if fmt is None:
+            raise CommandError("cannot tell the format from the file name, pass --format")
+        out = sys.stdout if opts["output"] == "-" else open(opts["output"], "w", newline="" if fmt == "csv" else None, encoding="utf-8")
+        try:
+            n = WRITERS[fmt](opts["kind"], export_rows(opts["kind"], chunk_size=opts["chunk_size"]), out)
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        if out is not sys.stdout:
+            self.stdout.write(self.style.SUCCESS(f"Exported {n} {opts['kind']} to {opts['output']}"))
@@ -0,0 +1,46 @@
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from main_app.bulkio import FORMATS, READERS, SPECS, Importer, guess_format
+
+
+class Command(BaseCommand):
+    help = "Stream lines, categories, stations or places from CSV, JSON Lines or GeoJSON and upsert them in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=list(SPECS))
+        parser.add_argument("path", help="input file, or - for stdin")
+        parser.add_argument("--format", choices=FORMATS)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--errors", help="write rejected rows as JSON Lines to this file")
+        parser.add_argument("--max-printed-errors", type=int, default=20)
+
+    def handle(self, *args, **opts):
+        fmt = opts["format"] or guess_format(opts["path"])
+        if fmt is None:
+            raise CommandError("cannot tell the format from the file name, pass --format")
+
+        errors_out = open(opts["errors"], "w") if opts["errors"] else None
+        printed = 0
+
+        def on_error(row_no, errors):
+            nonlocal printed
+            if errors_out:
+                errors_out.write(json.dumps({"row": row_no, "errors": errors}, default=str) + "\n")
+            if printed < opts["max_printed_errors"]:
+                self.stderr.write(f"row {row_no}: {json.dumps(errors, default=str)}")
+                printed += 1
+
+        f = sys.stdin if opts["path"] == "-" else open(opts["path"], newline="" if fmt == "csv" else None, encoding="utf-8")
+        try:
+            importer = Importer(opts["kind"], batch_size=opts["batch_size"], on_error=on_error)
+            ok, failed = importer.run(READERS[fmt](f))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+            if errors_out:
+                errors_out.close()
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {ok} {opts['kind']}, {failed} rows rejected"))
+        if opts["kind"] == "stations" and ok:
+            self.stdout.write("Stations changed: run assign_nearest_stations and build_station_links to refresh derived data")
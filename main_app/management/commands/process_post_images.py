@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from main_app.images import process_post_image
+from main_app.models import Post
+
+
+class Command(BaseCommand):
+    help = "Strip EXIF and generate resized variants for post images that do not have them yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="reprocess images that already have variants")
+
+    def handle(self, *args, **opts):
+        qs = Post.objects.exclude(image="").exclude(image__isnull=True).only("id", "image", "image_variants")
+        done = 0
+        for post in qs.iterator(chunk_size=500):
+            if opts["all"] or post.image_variants.get("source") != post.image.name:
+                process_post_image(post.pk)
+                done += 1
+        self.stdout.write(self.style.SUCCESS(f"Processed {done} images"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from main_app.counters import rebuild
+from main_app.models import Post
+
+
+class Command(BaseCommand):
+    help = "Recompute comments_count, ratings_count, ratings_sum and avg_rating on every post"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **opts):
+        batch = opts["batch_size"]
+        last_id, total = 0, 0
+        while True:
+            ids = list(Post.objects.filter(pk__gt=last_id).order_by("pk").values_list("pk", flat=True)[:batch])
+            if not ids:
+                break
+            total += rebuild(Post.objects.filter(pk__in=ids))
+            last_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt counters for {total} posts"))
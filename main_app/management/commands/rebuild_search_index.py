@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from main_app.models import SearchTerm
+from main_app.search import reindex
+
+
+class Command(BaseCommand):
+    help = "Rebuild the post and place search index"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--kind", choices=[k for k, _label in SearchTerm.KIND_CHOICES])
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **opts):
+        kinds = [opts["kind"]] if opts["kind"] else [k for k, _label in SearchTerm.KIND_CHOICES]
+        for kind in kinds:
+            total = reindex(kind, batch_size=opts["batch_size"])
+            self.stdout.write(self.style.SUCCESS(f"Indexed {total} {kind} rows"))
@@ -0,0 +1,32 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from main_app import ranking
+from main_app.models import Post, Comment
+
+
+class Command(BaseCommand):
+    help = "Recompute trending and top scores; run periodically so comment velocity stays current"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="every post instead of the recently commented ones")
+        parser.add_argument("--hours", type=float, default=ranking.COMMENT_WINDOW / timedelta(hours=1) * 2,
+                            help="posts commented on in the last N hours (at least the comment window plus the run interval)")
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        if opts["all"]:
+            ids = Post.objects.values_list("pk", flat=True)
+        else:
+            since = timezone.now() - timedelta(hours=opts["hours"])
+            ids = Comment.objects.filter(created_at__gte=since).values_list("post_id", flat=True).distinct()
+        field = "pk" if opts["all"] else "post_id"
+
+        last_id, total = 0, 0
+        while True:
+            batch = list(ids.filter(**{f"{field}__gt": last_id}).order_by(field)[:opts["batch_size"]])
+            if not batch:
+                break
+            total += ranking.rescore(batch)
+            last_id = batch[-1]
+        self.stdout.write(self.style.SUCCESS(f"Rescored {total} posts"))
@@ -0,0 +1,201 @@
+import json
+import platform
+import random
+import re
+import statistics
+import subprocess
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from main_app.models import Station, Place, Post, Comment, Rating
+from main_app.serializers import TokenObtainPairSerializer
+
+BBOX = (24.55, 24.97, 46.55, 46.91)
+QUERIES_HEADER = re.compile(r'desc="(\d+) queries"')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+class Command(BaseCommand):
+    help = "Measure latency percentiles, throughput and query counts of the hot API endpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=200)
+        parser.add_argument("--warmup", type=int, default=10)
+        parser.add_argument("--endpoint", action="append", help="only run these endpoints (repeatable)")
+        parser.add_argument("--user", help="username for authenticated endpoints (default: first bench user)")
+        parser.add_argument("--output", help="write the JSON report here")
+        parser.add_argument("--compare", help="earlier JSON report to diff against")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--base-url", help="benchmark a running server (e.g. http://127.0.0.1:8000) instead of the in-process client")
+        parser.add_argument("--concurrency", type=int, default=1, help="parallel clients, only with --base-url")
+
+    def endpoints(self, rng):
+        max_post = Post.objects.order_by("-pk").values_list("pk", flat=True).first() or 1
+
+        def point():
+            return rng.uniform(BBOX[0], BBOX[1]), rng.uniform(BBOX[2], BBOX[3])
+
+        def nearest(prefix="/api/"):
+            lat, lng = point()
+            return f"{prefix}stations/nearest/?lat={lat:.6f}&lng={lng:.6f}&limit=3"
+
+        def places(prefix="/api/"):
+            lat, lng = point()
+            return f"{prefix}places/?lat={lat:.6f}&lng={lng:.6f}&radius_km=2&limit=50"
+
+        return {
+            "stations_nearest": (nearest, False),
+            "places_near": (places, False),
+            "explore": (lambda: "/api/explore/", False),
+            "posts": (lambda: "/api/posts/", True),
+            "comments": (lambda: f"/api/comments/?post_id={rng.randint(1, max_post)}", False),
+            "ratings": (lambda: "/api/ratings/", True),
+            # same reads through the async views (main_app/async_views.py)
+            "async_stations_nearest": (lambda: nearest("/api/async/"), False),
+            "async_places_near": (lambda: places("/api/async/"), False),
+            "async_explore": (lambda: "/api/async/explore/", False),
+            "async_comments": (lambda: f"/api/async/comments/?post_id={rng.randint(1, max_post)}", False),
+        }
+
+    def handle(self, *args, **opts):
+        rng = random.Random(opts["seed"])
+        host = next((h for h in settings.ALLOWED_HOSTS if h and "*" not in h and not h.startswith(".")), "localhost")
+        anon = Client(HTTP_HOST=host)
+        user = User.objects.filter(username=opts["user"] or "bench0").first() or User.objects.order_by("pk").first()
+        if user is None:
+            raise CommandError("no users found, run seed_bench_data first")
+        token = str(TokenObtainPairSerializer.get_token(user).access_token)
+        authed = Client(HTTP_HOST=host, HTTP_AUTHORIZATION=f"Bearer {token}")
+
+        endpoints = self.endpoints(rng)
+        if opts["endpoint"]:
+            unknown = set(opts["endpoint"]) - set(endpoints)
+            if unknown:
+                raise CommandError(f"unknown endpoints: {', '.join(sorted(unknown))}")
+            endpoints = {k: v for k, v in endpoints.items() if k in opts["endpoint"]}
+
+        report = {"meta": self.meta(user, opts), "endpoints": {}}
+        for name, (make_url, needs_auth) in endpoints.items():
+            if opts["base_url"]:
+                headers = {"Authorization": f"Bearer {token}"} if needs_auth else {}
+                fetch = self.http_fetch(opts["base_url"], headers)
+            else:
+                fetch = self.client_fetch(authed if needs_auth else anon)
+            for _ in range(opts["warmup"]):
+                fetch(make_url())
+            # urls are drawn up front so the random sequence doesn't depend on thread timing
+            urls = [make_url() for _ in range(opts["iterations"])]
+            started = time.perf_counter()
+            if opts["base_url"] and opts["concurrency"] > 1:
+                with ThreadPoolExecutor(opts["concurrency"]) as pool:
+                    results = list(pool.map(fetch, urls))
+            else:
+                results = [fetch(url) for url in urls]
+            elapsed = time.perf_counter() - started
+
+            timings = sorted(ms for ms, _q, _s in results)
+            queries = [q for _ms, q, _s in results if q is not None]
+            statuses = {}
+            for _ms, _q, status in results:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            report["endpoints"][name] = {
+                "iterations": opts["iterations"],
+                "concurrency": opts["concurrency"] if opts["base_url"] else 1,
+                "p50_ms": round(percentile(timings, 50), 3),
+                "p90_ms": round(percentile(timings, 90), 3),
+                "p99_ms": round(percentile(timings, 99), 3),
+                "mean_ms": round(statistics.fmean(timings), 3),
+                "max_ms": round(timings[-1], 3),
+                "throughput_rps": round(opts["iterations"] / elapsed, 2),
+                "queries_mean": round(statistics.fmean(queries), 2) if queries else None,
+                "queries_max": max(queries) if queries else None,
+                "status": statuses,
+            }
+            r = report["endpoints"][name]
+            self.stdout.write(f"{name:22} p50 {r['p50_ms']:8.2f}ms  p99 {r['p99_ms']:8.2f}ms  "
+                              f"{r['throughput_rps']:8.1f} rps  {r['queries_mean'] or 0:5.1f} queries  {statuses}")
+
+        if opts["output"]:
+            with open(opts["output"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {opts['output']}"))
+        if opts["compare"]:
+            with open(opts["compare"]) as f:
+                self.compare(json.load(f), report)
+
+    def client_fetch(self, client):
+        def fetch(url):
+            with CaptureQueriesContext(connection) as ctx:
+                t0 = time.perf_counter()
+                res = client.get(url)
+                if res.streaming:
+                    b"".join(res.streaming_content)
+                ms = (time.perf_counter() - t0) * 1000
+            return ms, len(ctx.captured_queries), res.status_code
+        return fetch
+
+    def http_fetch(self, base_url, headers):
+        def fetch(url):
+            req = urllib.request.Request(base_url.rstrip("/") + url, headers=headers)
+            t0 = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=60) as res:
+                    res.read()
+                    status, timing = res.status, res.headers.get("Server-Timing", "")
+            except urllib.error.HTTPError as e:
+                status, timing = e.code, e.headers.get("Server-Timing", "")
+            except OSError:
+                status, timing = "error", ""
+            ms = (time.perf_counter() - t0) * 1000
+            # the query count comes from the metrics middleware's Server-Timing header
+            m = QUERIES_HEADER.search(timing)
+            return ms, int(m.group(1)) if m else None, status
+        return fetch
+
+    def meta(self, user, opts):
+        try:
+            commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            "commit": commit,
+            "timestamp": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "database": connection.vendor,
+            "user": user.username,
+            "base_url": opts["base_url"],
+            "concurrency": opts["concurrency"],
+            "rows": {
+                "stations": Station.objects.count(), "places": Place.objects.count(), "posts": Post.objects.count(),
+                "comments": Comment.objects.count(), "ratings": Rating.objects.count(),
+            },
+        }
+
+    def compare(self, old, new):
+        self.stdout.write(f"\nvs {old['meta'].get('commit')} ({old['meta'].get('timestamp')})")
+        for name, cur in new["endpoints"].items():
+            prev = old["endpoints"].get(name)
+            if not prev:
+                continue
+            parts = []
+            for key in ("p50_ms", "p99_ms", "throughput_rps", "queries_mean"):
+                if cur.get(key) is None:
+                    continue
+                if prev.get(key):
+                    parts.append(f"{key} {(cur[key] - prev[key]) / prev[key] * 100:+6.1f}%")
+            self.stdout.write(f"{name:22} " + "  ".join(parts))
@@ -0,0 +1,126 @@
+import random
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from main_app.geo import KDTree
+from main_app import tiles
+from main_app.models import Line, Station, Category, Place, Post, Comment, Rating
+
+# rough shape of the Riyadh network: (code, name, color, start, end, stations)
+LINES = [
+    ("L1", "Blue", "#0072ce", (24.962, 46.700), (24.581, 46.776), 25),
+    ("L2", "Red", "#e4002b", (24.734, 46.612), (24.820, 46.858), 15),
+    ("L3", "Orange", "#ff8200", (24.616, 46.550), (24.720, 46.905), 22),
+    ("L4", "Yellow", "#ffd100", (24.687, 46.685), (24.958, 46.702), 9),
+    ("L5", "Green", "#00b140", (24.748, 46.637), (24.660, 46.732), 11),
+    ("L6", "Purple", "#8a2ab8", (24.958, 46.702), (24.808, 46.842), 11),
+]
+BBOX = (24.55, 24.97, 46.55, 46.91)
+CATEGORIES = [("Cafe", "CAF"), ("Restaurant", "RES"), ("Mall", "MAL"), ("Park", "PRK"),
+              ("Museum", "MUS"), ("Hotel", "HTL"), ("Hospital", "HSP"), ("Mosque", "MSQ")]
+WORDS = ("coffee metro station riyadh mall park food family view quiet busy crowded late night "
+         "morning best worst clean new old line blue red green tea dates kabsa shawarma burger").split()
+
+
+def sentence(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+class Command(BaseCommand):
+    help = "Fill the database with a synthetic metro dataset for benchmarks (lines, stations, places, posts, comments, ratings)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--places", type=int, default=100_000)
+        parser.add_argument("--posts", type=int, default=1_000_000)
+        parser.add_argument("--comments-per-post", type=float, default=2.0)
+        parser.add_argument("--ratings-per-post", type=float, default=3.0)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--skip-search-index", action="store_true")
+
+    def handle(self, *args, **opts):
+        rng = random.Random(opts["seed"])
+        batch = opts["batch_size"]
+
+        stations = self.seed_network()
+        tree = KDTree([(s.id, s.lat, s.lng) for s in stations])
+        categories = [Category.objects.get_or_create(code=code, defaults={"name": name})[0] for name, code in CATEGORIES]
+
+        password = make_password("bench-password")
+        start = User.objects.count()
+        users = []
+        for i in range(0, opts["users"], batch):
+            users += User.objects.bulk_create([
+                User(username=f"bench{start + j}", password=password)
+                for j in range(i, min(i + batch, opts["users"]))
+            ])
+        user_ids = [u.id for u in users]
+        self.stdout.write(f"{len(user_ids)} users")
+
+        place_ids = []
+        for i in range(0, opts["places"], batch):
+            rows = []
+            for _ in range(min(batch, opts["places"] - i)):
+                lat, lng = round(rng.uniform(BBOX[0], BBOX[1]), 7), round(rng.uniform(BBOX[2], BBOX[3]), 7)
+                distance, station_id = tree.nearest(lat, lng, 1)[0]
+                rows.append(Place(
+                    name=sentence(rng, 2).title(), description=sentence(rng, 8),
+                    category=rng.choice(categories), lat=lat, lng=lng,
+                    nearest_station_id=station_id, nearest_station_distance_km=round(distance, 3),
+                    created_by_id=rng.choice(user_ids),
+                ))
+            place_ids += [p.id for p in Place.objects.bulk_create(rows)]
+        self.stdout.write(f"{len(place_ids)} places")
+
+        station_ids = [s.id for s in stations]
+        posts = comments = ratings = 0
+        for i in range(0, opts["posts"], batch):
+            rows = [
+                Post(
+                    title=sentence(rng, 4), body=sentence(rng, 25),
+                    station_id=rng.choice(station_ids) if rng.random() < 0.6 else None,
+                    place_id=rng.choice(place_ids) if place_ids and rng.random() < 0.5 else None,
+                    is_public=rng.random() < 0.9, created_by_id=rng.choice(user_ids),
+                )
+                for _ in range(min(batch, opts["posts"] - i))
+            ]
+            created = Post.objects.bulk_create(rows)
+            posts += len(created)
+            comment_rows, rating_rows = [], []
+            for post in created:
+                for _ in range(int(rng.expovariate(1 / opts["comments_per_post"])) if opts["comments_per_post"] else 0):
+                    comment_rows.append(Comment(post_id=post.id, body=sentence(rng, 10), created_by_id=rng.choice(user_ids)))
+                n = min(len(user_ids), int(rng.expovariate(1 / opts["ratings_per_post"])) if opts["ratings_per_post"] else 0)
+                for user_id in rng.sample(user_ids, n):
+                    rating_rows.append(Rating(post_id=post.id, value=rng.randint(1, 5), created_by_id=user_id))
+            comments += len(Comment.objects.bulk_create(comment_rows, batch_size=batch))
+            ratings += len(Rating.objects.bulk_create(rating_rows, batch_size=batch))
+            self.stdout.write(f"\r{posts} posts, {comments} comments, {ratings} ratings", ending="")
+        self.stdout.write("")
+
+        # bulk_create skips the signals that normally maintain these
+        call_command("rebuild_post_counters", stdout=self.stdout)
+        call_command("recompute_post_scores", "--all", stdout=self.stdout)
+        if not opts["skip_search_index"]:
+            call_command("rebuild_search_index", stdout=self.stdout)
+        tiles.invalidate_all()
+        self.stdout.write(self.style.SUCCESS("Benchmark dataset ready"))
+
+    def seed_network(self):
+        stations = []
+        for code, name, color, (lat0, lng0), (lat1, lng1), count in LINES:
+            line, _ = Line.objects.get_or_create(code=code, defaults={"name": name, "color": color})
+            for i in range(count):
+                t = i / (count - 1)
+                station, _ = Station.objects.get_or_create(
+                    code=f"{code}-{i + 1:02d}",
+                    defaults={
+                        "name": f"{name} {i + 1}", "line": line, "sequence": i,
+                        "lat": round(lat0 + (lat1 - lat0) * t, 6), "lng": round(lng0 + (lng1 - lng0) * t, 6),
+                    },
+                )
+                stations.append(station)
+        call_command("build_station_links", stdout=self.stdout)
+        return stations
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from main_app import tiles
+
+
+class Command(BaseCommand):
+    help = "Build and cache the map tiles that have places or stations in them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-zoom", type=int, default=0)
+        parser.add_argument("--max-zoom", type=int, default=tiles.CLUSTER_BELOW,
+                            help="deeper tiles are small and cheap to build on first request")
+        parser.add_argument("--rebuild", action="store_true", help="drop every cached tile first")
+
+    def handle(self, *args, **opts):
+        if not settings.SHARED_CACHE:
+            raise CommandError("tiles cached by this command would stay in its own process: set CACHE_BACKEND to a shared cache")
+        if opts["rebuild"]:
+            tiles.invalidate_all()
+        total = 0
+        for z in range(opts["min_zoom"], min(opts["max_zoom"], tiles.MAX_ZOOM) + 1):
+            found = tiles.occupied_tiles(z)
+            for x, y in found:
+                tiles.get_tile(z, x, y)
+            total += len(found)
+            self.stdout.write(f"zoom {z}: {len(found)} tiles")
+        self.stdout.write(self.style.SUCCESS(f"Cached {total} tiles"))
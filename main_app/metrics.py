@@ -0,0 +1,93 @@
+import re
+import threading
+from collections import Counter
+
+# request duration buckets in milliseconds
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+MAX_FINGERPRINTS_PER_ROUTE = 20
+
+_IN_LIST = re.compile(r"IN \((?:%s, )*%s\)")
+_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    # params are passed separately, so only IN lists of varying length need folding
+    return _IN_LIST.sub("IN (...)", _SPACES.sub(" ", sql.strip()))
+
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.buckets = [0] * len(BUCKETS)
+        self.wall_ms = 0.0
+        self.db_ms = 0.0
+        self.queries = 0
+        self.query_buckets = [0] * len(BUCKETS)
+        self.duplicate_queries = 0
+        self.statuses = Counter()
+        self.fingerprints = Counter()
+
+
+class Registry:
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def record(self, route, status, wall_ms, db_ms, queries, duplicates):
+        with self.lock:
+            stats = self.routes.setdefault(route, RouteStats())
+            stats.count += 1
+            stats.wall_ms += wall_ms
+            stats.db_ms += db_ms
+            stats.queries += queries
+            stats.statuses[status] += 1
+            for i, bound in enumerate(BUCKETS):
+                if wall_ms <= bound:
+                    stats.buckets[i] += 1
+                if queries <= bound:
+                    stats.query_buckets[i] += 1
+            for fp, n in duplicates.items():
+                stats.duplicate_queries += n - 1
+                if fp in stats.fingerprints or len(stats.fingerprints) < MAX_FINGERPRINTS_PER_ROUTE:
+                    stats.fingerprints[fp] += n - 1
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+
+        def histogram(name, help_text, attr, total_attr):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for route, s in sorted(self.routes.items()):
+                for bound, n in zip(BUCKETS, getattr(s, attr)):
+                    lines.append(f'{name}_bucket{{route="{route}",le="{bound}"}} {n}')
+                lines.append(f'{name}_bucket{{route="{route}",le="+Inf"}} {s.count}')
+                lines.append(f'{name}_sum{{route="{route}"}} {round(getattr(s, total_attr), 3)}')
+                lines.append(f'{name}_count{{route="{route}"}} {s.count}')
+
+        with self.lock:
+            histogram("metro_request_duration_ms", "Request wall time in milliseconds.", "buckets", "wall_ms")
+            histogram("metro_request_queries", "SQL queries per request.", "query_buckets", "queries")
+            lines.append("# HELP metro_request_db_ms_total Time spent in SQL, in milliseconds.")
+            lines.append("# TYPE metro_request_db_ms_total counter")
+            for route, s in sorted(self.routes.items()):
+                lines.append(f'metro_request_db_ms_total{{route="{route}"}} {round(s.db_ms, 3)}')
+            lines.append("# HELP metro_requests_total Requests by status code.")
+            lines.append("# TYPE metro_requests_total counter")
+            for route, s in sorted(self.routes.items()):
+                for status, n in sorted(s.statuses.items()):
+                    lines.append(f'metro_requests_total{{route="{route}",status="{status}"}} {n}')
+            lines.append("# HELP metro_duplicate_queries_total Repeated identical SQL within one request (N+1 suspects).")
+            lines.append("# TYPE metro_duplicate_queries_total counter")
+            for route, s in sorted(self.routes.items()):
+                for fp, n in s.fingerprints.most_common():
+                    sql = fp.replace("\\", "\\\\").replace('"', '\\"')[:200]
+                    lines.append(f'metro_duplicate_queries_total{{route="{route}",sql="{sql}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
@@ -0,0 +1,180 @@
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from .db_router import pick_replica, read_from_replica
+from .metrics import fingerprint, registry
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCollector:
+    def __init__(self, keep_sql):
+        self.count = 0
+        self.db_ms = 0.0
+        self.fingerprints = Counter()
+        self.keep_sql = keep_sql
+        self.log = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            self.count += 1
+            self.db_ms += ms
+            self.fingerprints[fingerprint(sql)] += 1
+            if self.keep_sql:
+                # statement text only: bound params carry usernames, password hashes, tokens
+                self.log.append((round(ms, 3), fingerprint(sql)))
+
+
+class RequestMetricsMiddleware:
+    """Records wall time, SQL time, query count and repeated queries per route."""
+    # async capable so ASGI requests to the async views don't get pushed onto a thread
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not getattr(settings, "METRICS_ENABLED", True):
+            return self.get_response(request)
+        collector, start = self.begin()
+        with ExitStack() as stack:
+            self.wrap_connections(stack, collector)
+            response = self.get_response(request)
+        return self.finish(request, response, collector, start)
+
+    async def __acall__(self, request):
+        if not getattr(settings, "METRICS_ENABLED", True):
+            return await self.get_response(request)
+        collector, start = self.begin()
+        # connections are per thread and the ORM runs on the request's sync thread,
+        # so the wrappers are attached (and removed) from there
+        stack = ExitStack()
+        await sync_to_async(self.wrap_connections)(stack, collector)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response, collector, start)
+
+    @staticmethod
+    def wrap_connections(stack, collector):
+        for conn in connections.all():
+            stack.enter_context(conn.execute_wrapper(collector))
+
+    def begin(self):
+        sampled = (
+            getattr(settings, "METRICS_SLOW_QUERY_LOG", False)
+            and random.random() < getattr(settings, "METRICS_SLOW_SAMPLE_RATE", 0.05)
+        )
+        return QueryCollector(keep_sql=sampled), time.perf_counter()
+
+    def finish(self, request, response, collector, start):
+        wall_ms = (time.perf_counter() - start) * 1000
+        slow_ms = getattr(settings, "METRICS_SLOW_REQUEST_MS", 500)
+
+        match = getattr(request, "resolver_match", None)
+        route = match.url_name if match and match.url_name else "unmatched"
+        duplicates = {fp: n for fp, n in collector.fingerprints.items() if n > 1}
+        registry.record(route, response.status_code, wall_ms, collector.db_ms, collector.count, duplicates)
+
+        response["Server-Timing"] = (
+            f'app;dur={wall_ms - collector.db_ms:.1f}, '
+            f'db;dur={collector.db_ms:.1f};desc="{collector.count} queries"'
+        )
+        if slow_ms is not None and wall_ms >= slow_ms:
+            # the path without its query string, which can hold search terms or tokens
+            logger.warning(
+                "slow request %s %s (%s) %.1fms, %d queries, %.1fms in db%s",
+                request.method, request.path, route, wall_ms, collector.count, collector.db_ms,
+                "".join(f"\n  {ms}ms {sql}" for ms, sql in collector.log),
+            )
+        return response
+
+
+class ReadReplicaMiddleware:
+    """Sends safe-method requests to the read replicas, except right after the same user wrote something."""
+    # a write pins the client to the primary for REPLICA_PIN_SECONDS: by cookie, and by
+    # user id in the cache for API clients that send a bearer token but keep no cookies
+    sync_capable = True
+    async_capable = True
+    pin_cookie = "pin_primary"
+
+    def __init__(self, get_response):
+        if not getattr(settings, "DATABASE_REPLICAS", []):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        key = self.pin_key(request)
+        if request.method in SAFE_METHODS:
+            with read_from_replica(None if self.is_pinned(request, key) else pick_replica()):
+                return self.get_response(request)
+        response = self.get_response(request)
+        # read_only: an unsafe request that only read, like a batch of GETs (see batch.py)
+        if response.status_code < 400 and not getattr(request, "read_only", False):
+            self.set_pin_cookie(response)
+            if key:
+                cache.set(key, True, self.pin_seconds())
+        return response
+
+    async def __acall__(self, request):
+        key = self.pin_key(request)
+        if request.method in SAFE_METHODS:
+            pinned = request.COOKIES.get(self.pin_cookie) is not None or bool(key and await cache.aget(key))
+            with read_from_replica(None if pinned else pick_replica()):
+                return await self.get_response(request)
+        response = await self.get_response(request)
+        if response.status_code < 400 and not getattr(request, "read_only", False):
+            self.set_pin_cookie(response)
+            if key:
+                await cache.aset(key, True, self.pin_seconds())
+        return response
+
+    def pin_seconds(self):
+        return getattr(settings, "REPLICA_PIN_SECONDS", 10)
+
+    def set_pin_cookie(self, response):
+        response.set_cookie(self.pin_cookie, "1", max_age=self.pin_seconds(), httponly=True, samesite="Lax")
+
+    @classmethod
+    def is_pinned(cls, request, key=None):
+        key = key or cls.pin_key(request)
+        return request.COOKIES.get(cls.pin_cookie) is not None or bool(key and cache.get(key))
+
+    @staticmethod
+    def pin_key(request):
+        # runs before DRF authentication, so the user comes from the token itself
+        auth = JWTAuthentication()
+        header = auth.get_header(request)
+        raw = auth.get_raw_token(header) if header else None
+        if raw is None:
+            return None
+        try:
+            token = auth.get_validated_token(raw)
+        except InvalidToken:
+            return None
+        return f"db-pin:{token.get(jwt_settings.USER_ID_CLAIM)}"
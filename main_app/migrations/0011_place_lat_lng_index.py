@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0010_post_is_public_comment_rating'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['lat', 'lng'], name='place_lat_lng_idx'),
+        ),
+    ]
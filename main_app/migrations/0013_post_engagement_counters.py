@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:26
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, FloatField, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model("main_app", "Post")
+    Comment = apps.get_model("main_app", "Comment")
+    Rating = apps.get_model("main_app", "Rating")
+    comments = Comment.objects.filter(post=OuterRef("pk")).order_by().values("post")
+    ratings = Rating.objects.filter(post=OuterRef("pk")).order_by().values("post")
+    Post.objects.update(
+        comments_count=Coalesce(Subquery(comments.annotate(n=Count("id")).values("n"), output_field=IntegerField()), 0),
+        ratings_count=Coalesce(Subquery(ratings.annotate(n=Count("id")).values("n"), output_field=IntegerField()), 0),
+        ratings_sum=Coalesce(Subquery(ratings.annotate(s=Sum("value")).values("s"), output_field=IntegerField()), 0),
+        avg_rating=Subquery(ratings.annotate(a=Avg("value")).values("a"), output_field=FloatField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0012_cursor_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='avg_rating',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='ratings_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='ratings_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
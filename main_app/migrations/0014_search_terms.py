@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:27
+
+import re
+from collections import Counter
+from django.db import migrations, models
+
+
+# a copy of search.tokenize as it was when this migration was written
+def tokenize(text):
+    return [t[:64] for t in re.findall(r"\w+", (text or "").lower(), re.UNICODE)]
+
+
+def build_index(apps, schema_editor):
+    SearchTerm = apps.get_model("main_app", "SearchTerm")
+    sources = [
+        ("post", apps.get_model("main_app", "Post"), [("title", 3), ("body", 1)]),
+        ("place", apps.get_model("main_app", "Place"), [("name", 3), ("description", 1)]),
+    ]
+    for kind, model, fields in sources:
+        terms = []
+        for obj in model.objects.only("pk", *[f for f, _w in fields]).iterator(chunk_size=1000):
+            weights = Counter()
+            for field, weight in fields:
+                for token in tokenize(getattr(obj, field)):
+                    weights[token] += weight
+            terms += [SearchTerm(kind=kind, object_id=obj.pk, token=t, weight=w) for t, w in weights.items()]
+            if len(terms) >= 5000:
+                SearchTerm.objects.bulk_create(terms)
+                terms = []
+        SearchTerm.objects.bulk_create(terms)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0013_post_engagement_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', 'Post'), ('place', 'Place')], max_length=10)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('token', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField(default=1)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'object_id'], name='searchterm_object_idx')],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'token', 'object_id'), name='searchterm_unique_token')],
+            },
+        ),
+        migrations.RunPython(build_index, migrations.RunPython.noop),
+    ]
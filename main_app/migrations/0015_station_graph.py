@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0014_search_terms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='station',
+            name='sequence',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='StationLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('line', 'Line'), ('transfer', 'Transfer')], default='line', max_length=10)),
+                ('travel_seconds', models.PositiveIntegerField()),
+                ('from_station', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='links_out', to='main_app.station')),
+                ('to_station', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='links_in', to='main_app.station')),
+            ],
+            options={
+                'unique_together': {('from_station', 'to_station')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0015_station_graph'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='nearest_station_distance_km',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:42
+
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.utils import timezone
+
+# the scores as ranking.py defined them when this migration was written
+PRIOR_MEAN = 3.0
+PRIOR_WEIGHT = 5
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+HALF_LIFE = timedelta(hours=24)
+COMMENT_WINDOW = timedelta(hours=6)
+COMMENT_WEIGHT = 2.0
+
+
+def top_score(ratings_count, ratings_sum):
+    return (PRIOR_MEAN * PRIOR_WEIGHT + ratings_sum) / (PRIOR_WEIGHT + ratings_count)
+
+
+def trending_score(created_at, ratings_count, ratings_sum, recent_comments):
+    quality = top_score(ratings_count, ratings_sum) / 5
+    engagement = ratings_count * quality + COMMENT_WEIGHT * recent_comments
+    return math.log2(1 + engagement) + (created_at - EPOCH) / HALF_LIFE
+
+
+def backfill_scores(apps, schema_editor):
+    Post = apps.get_model("main_app", "Post")
+    since = timezone.now() - COMMENT_WINDOW
+    rows = (
+        Post.objects.order_by("pk")
+        .values("id", "created_at", "ratings_count", "ratings_sum")
+        .annotate(recent_comments=Count("comments", filter=Q(comments__created_at__gte=since)))
+    )
+    batch = []
+    for r in rows.iterator(chunk_size=2000):
+        batch.append(Post(
+            pk=r["id"],
+            top_score=top_score(r["ratings_count"], r["ratings_sum"]),
+            trending_score=trending_score(r["created_at"], r["ratings_count"], r["ratings_sum"], r["recent_comments"]),
+        ))
+        if len(batch) >= 2000:
+            Post.objects.bulk_update(batch, ["top_score", "trending_score"])
+            batch = []
+    Post.objects.bulk_update(batch, ["top_score", "trending_score"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0017_post_image_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='top_score',
+            field=models.FloatField(default=3.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['is_public', '-trending_score', 'id'], name='post_public_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['is_public', '-top_score', 'id'], name='post_public_top_idx'),
+        ),
+        migrations.RunPython(backfill_scores, migrations.RunPython.noop),
+    ]
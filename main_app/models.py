@@ -1,6 +1,22 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+class TracksLoadedValues:
+    # remembers the values a row had in the database, so signals can apply deltas
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_loaded()
+        return instance
+
+    def remember_loaded(self):
+        self._loaded = {f: self.__dict__.get(f) for f in self.tracked_fields}
+
+    def loaded(self, field):
+        return getattr(self, "_loaded", {}).get(field)
+
 class Line(models.Model):
     name = models.CharField(max_length=100)
     code = models.CharField(max_length=10, unique=True)
@@ -9,15 +25,34 @@ class Line(models.Model):
     def __str__(self):
         return f"{self.code} - {self.name}"
 
-class Station(models.Model):
+class Station(TracksLoadedValues, models.Model):
+    tracked_fields = ("lat", "lng")  # so the map tiles it moves out of are refreshed (tiles.py)
     name = models.CharField(max_length=120)
     code = models.CharField(max_length=20, unique=True)
     line = models.ForeignKey(Line, on_delete=models.CASCADE, related_name="stations")
     lat = models.DecimalField(max_digits=9, decimal_places=6)
     lng = models.DecimalField(max_digits=9, decimal_places=6)
+    sequence = models.PositiveSmallIntegerField(null=True, blank=True)  # order along the line
 
     def __str__(self):
         return f"{self.code} - {self.name}"
+
+class StationLink(models.Model):
+    # an edge of the metro graph, usable in both directions
+    LINE = "line"
+    TRANSFER = "transfer"
+    KIND_CHOICES = [(LINE, "Line"), (TRANSFER, "Transfer")]
+
+    from_station = models.ForeignKey(Station, on_delete=models.CASCADE, related_name="links_out")
+    to_station = models.ForeignKey(Station, on_delete=models.CASCADE, related_name="links_in")
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=LINE)
+    travel_seconds = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ("from_station", "to_station")
+
+    def __str__(self):
+        return f"{self.from_station_id} -> {self.to_station_id} ({self.kind}, {self.travel_seconds}s)"
     
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -26,11 +61,13 @@ class Category(models.Model):
     def __str__(self):
         return f"{self.name} ({self.code})"
 
-class Place(models.Model):
+class Place(TracksLoadedValues, models.Model):
+    tracked_fields = ("lat", "lng")
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="places")
     nearest_station = models.ForeignKey(Station, on_delete=models.SET_NULL, null=True, blank=True, related_name="places")
+    nearest_station_distance_km = models.FloatField(null=True, blank=True, editable=False)
     lat = models.DecimalField(max_digits=15, decimal_places=7)
     lng = models.DecimalField(max_digits=15, decimal_places=7)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="places")
@@ -38,33 +75,95 @@ class Place(models.Model):
 
     class Meta:
         ordering = ["name"]
+        indexes = [
+            models.Index(fields=["lat", "lng"], name="place_lat_lng_idx"),
+            models.Index(fields=["name", "id"], name="place_name_id_idx"),
+        ]
 
     def __str__(self):
         return self.name
 
+    def assign_nearest_station(self, tree=None):
+        # loops over many places pass the station tree in, instead of checking it is current for each one
+        from .geo import station_index
+        if self.lat is None or self.lng is None:
+            found = []
+        else:
+            found = (tree if tree is not None else station_index.tree()).nearest(self.lat, self.lng, 1)
+        if found:
+            self.nearest_station_distance_km = round(found[0][0], 3)
+            self.nearest_station_id = found[0][1]
+        else:
+            self.nearest_station_distance_km = None
+            self.nearest_station_id = None
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or {"lat", "lng"} & set(update_fields):
+            self.assign_nearest_station()
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | {"nearest_station", "nearest_station_distance_km"}
+        super().save(*args, **kwargs)
+
 class Post(models.Model):
     title = models.CharField(max_length=200)
     body = models.TextField(blank=True)
     image = models.ImageField(upload_to="posts/", null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)  # written by images.py
     station = models.ForeignKey("Station", on_delete=models.SET_NULL, null=True, blank=True, related_name="posts")
     place = models.ForeignKey("Place", on_delete=models.SET_NULL, null=True, blank=True, related_name="posts")
     is_public = models.BooleanField(default=True)  # NEW
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="posts")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # kept up to date by signals (see counters.py), never written from the post itself
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+    ratings_count = models.PositiveIntegerField(default=0, editable=False)
+    ratings_sum = models.PositiveIntegerField(default=0, editable=False)
+    avg_rating = models.FloatField(null=True, blank=True, editable=False)
+    # feed ranking, see ranking.py
+    trending_score = models.FloatField(default=0, editable=False)
+    top_score = models.FloatField(default=3.0, editable=False)
+
+    COUNTER_FIELDS = ("comments_count", "ratings_count", "ratings_sum", "avg_rating")
+    MANAGED_FIELDS = COUNTER_FIELDS + ("image_variants", "trending_score", "top_score")
+
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["-created_at", "id"], name="post_created_id_idx"),
+            models.Index(fields=["is_public", "-created_at", "id"], name="post_public_created_id_idx"),
+            models.Index(fields=["created_by", "-created_at", "id"], name="post_owner_created_id_idx"),
+            models.Index(fields=["is_public", "-trending_score", "id"], name="post_public_trending_idx"),
+            models.Index(fields=["is_public", "-top_score", "id"], name="post_public_top_idx"),
+        ]
     def _str_(self): return self.title
 
-class Comment(models.Model):
+    def save(self, *args, **kwargs):
+        # a stale instance must not overwrite counters or image variants written elsewhere
+        if not self._state.adding and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.MANAGED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+class Comment(TracksLoadedValues, models.Model):
+    tracked_fields = ("post_id",)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="comments")
     body = models.TextField()
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="comments")
     created_at = models.DateTimeField(auto_now_add=True)
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["-created_at", "id"], name="comment_created_id_idx"),
+            # a post's newest comments: the per-post window in comment batches and paging one post's comments
+            models.Index(fields=["post", "-created_at", "id"], name="comment_post_created_idx"),
+        ]
 
-class Rating(models.Model):
+class Rating(TracksLoadedValues, models.Model):
+    tracked_fields = ("post_id", "value")
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="ratings")
     value = models.PositiveSmallIntegerField()
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="ratings")
@@ -72,5 +171,64 @@ class Rating(models.Model):
     class Meta:
         unique_together = ("post", "created_by")
         ordering = ["-created_at"]
+        indexes = [models.Index(fields=["created_by", "-created_at", "id"], name="rating_user_created_id_idx")]
+
+
+
+
+class SearchTerm(models.Model):
+    # inverted index for post and place search, maintained by search.py
+    POST = "post"
+    PLACE = "place"
+    KIND_CHOICES = [(POST, "Post"), (PLACE, "Place")]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    token = models.CharField(max_length=64)
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "token", "object_id"], name="searchterm_unique_token"),
+        ]
+        indexes = [models.Index(fields=["kind", "object_id"], name="searchterm_object_idx")]
+
+
+class Subscription(models.Model):
+    # a user following a station or a place feed, see feeds.py
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="subscriptions")
+    station = models.ForeignKey(Station, on_delete=models.CASCADE, null=True, blank=True, related_name="subscriptions")
+    place = models.ForeignKey(Place, on_delete=models.CASCADE, null=True, blank=True, related_name="subscriptions")
+    # False once the station/place has too many followers to copy posts into every timeline
+    fanout = models.BooleanField(default=True, editable=False)
+    unread_count = models.PositiveIntegerField(default=0, editable=False)
+    last_read_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(station__isnull=False, place__isnull=True) | models.Q(station__isnull=True, place__isnull=False),
+                name="subscription_one_source",
+            ),
+            models.UniqueConstraint(fields=["user", "station"], condition=models.Q(station__isnull=False), name="subscription_unique_station"),
+            models.UniqueConstraint(fields=["user", "place"], condition=models.Q(place__isnull=False), name="subscription_unique_place"),
+        ]
+
+
+class TimelineEntry(models.Model):
+    # a post copied into a follower's timeline when it is published
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="timeline")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="timeline_entries")
+    post_created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "post"], name="timeline_unique_post")]
+        indexes = [models.Index(fields=["user", "-post_created_at", "post"], name="timeline_user_created_idx")]
 
 
+class CacheVersion(models.Model):
+    # version counters of cached data (see caching.py). Kept in the database rather
+    # than the cache so a bump reaches every process and a version never goes back.
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.PositiveBigIntegerField(default=1)
@@ -0,0 +1,120 @@
+import base64
+import json
+from datetime import datetime
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+from .ranking import SORTS
+
+
+class RankedCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    keyset_field = None
+    keyset_descending = True
+
+    def get_ordering(self, request, queryset, view):
+        # search results (see search.py) page by relevance instead
+        if "search_rank" in queryset.query.annotations:
+            return ("-search_rank", "id")
+        return self.ordering
+
+    def get_keyset(self, ordering):
+        # (field, id) and ("-field", id) orderings page by a (field, id) cursor that goes
+        # straight to the next row. DRF's cursor only keeps the field and skips rows
+        # sharing its value with an OFFSET, which grows with every tie (search ranks,
+        # scores, posts imported with one timestamp, places with the same name).
+        if len(ordering) == 2 and ordering[1] == "id":
+            return ordering[0].lstrip("-"), ordering[0].startswith("-")
+        return None, True
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = self.get_ordering(request, queryset, view)
+        self.keyset_field, self.keyset_descending = self.get_keyset(ordering)
+        if self.keyset_field is None:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        field = self.keyset_field
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            queryset = after_cursor(queryset, field, encoded, self.keyset_descending)
+            if queryset is None:
+                raise NotFound(self.invalid_cursor_message)
+        self.page = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        self.keyset_next = None
+        if len(self.page) > self.page_size:
+            self.page = self.page[:self.page_size]
+            last = self.page[-1]
+            value, pk = (last[field], last["id"]) if isinstance(last, dict) else (getattr(last, field), last.pk)
+            self.keyset_next = replace_query_param(self.base_url, self.cursor_query_param, encode_cursor(value, pk))
+        return self.page
+
+    def get_next_link(self):
+        if self.keyset_field:
+            return self.keyset_next
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.keyset_field:
+            return None  # keyset pages only go forward
+        return super().get_previous_link()
+
+
+class NewestFirstCursorPagination(RankedCursorPagination):
+    ordering = ("-created_at", "id")
+
+
+class NameCursorPagination(RankedCursorPagination):
+    ordering = ("name", "id")
+
+
+class FeedCursorPagination(NewestFirstCursorPagination):
+    # ?sort=trending|top|new picks a stored score (see ranking.py), each with its own index
+    def get_ordering(self, request, queryset, view):
+        sort = request.query_params.get("sort")
+        if sort in SORTS:
+            return (f"-{SORTS[sort]}", "id")
+        return super().get_ordering(request, queryset, view)
+
+
+# keyset cursors for views that page by hand: the sort value and id of the last row
+# sent, so the next page is an index range scan instead of an OFFSET
+
+def encode_cursor(value, pk):
+    value = {"dt": value.isoformat()} if isinstance(value, datetime) else value
+    return base64.urlsafe_b64encode(json.dumps([value, pk]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["dt"])
+        return value, int(pk)
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def after_cursor(queryset, field, cursor, descending=True):
+    """The rows of queryset that come after the cursor, or None if it doesn't fit field."""
+    decoded = decode_cursor(cursor)
+    if decoded is None:
+        return None
+    value, pk = decoded
+    try:
+        # a datetime for created_at, a number for scores and ranks
+        value = queryset.query.chain().resolve_ref(field).output_field.to_python(value)
+    except (ValidationError, ValueError, TypeError):
+        return None
+    if value is None:
+        return None
+    lookup = "lt" if descending else "gt"
+    return queryset.filter(Q(**{f"{field}__{lookup}": value}) | Q(**{field: value, "id__gt": pk}))
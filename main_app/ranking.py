@@ -0,0 +1,51 @@
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db.models import Count, Q
+from django.utils import timezone
+from .models import Post
+
+# top: rating average pulled towards PRIOR_MEAN until a post has a few ratings
+PRIOR_MEAN = 3.0
+PRIOR_WEIGHT = 5
+
+# trending: log2(engagement) plus the post's age measured in half-lives. Adding the
+# age instead of multiplying by a decay gives the same order, but a stored score
+# doesn't go stale as time passes: it only changes with engagement, and one
+# half-life of age is worth a doubling of engagement.
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+HALF_LIFE = timedelta(hours=24)
+# comment velocity: comments in the last COMMENT_WINDOW; they drop out of the window
+# with time, which is why recompute_post_scores runs periodically
+COMMENT_WINDOW = timedelta(hours=6)
+COMMENT_WEIGHT = 2.0
+
+SORTS = {"trending": "trending_score", "top": "top_score", "new": "created_at"}
+
+
+def top_score(ratings_count, ratings_sum):
+    return (PRIOR_MEAN * PRIOR_WEIGHT + ratings_sum) / (PRIOR_WEIGHT + ratings_count)
+
+
+def trending_score(created_at, ratings_count, ratings_sum, recent_comments):
+    quality = top_score(ratings_count, ratings_sum) / 5
+    engagement = ratings_count * quality + COMMENT_WEIGHT * recent_comments
+    return math.log2(1 + engagement) + (created_at - EPOCH) / HALF_LIFE
+
+
+def rescore(post_ids):
+    """Recompute the stored scores of these posts from their counters and recent comments."""
+    since = timezone.now() - COMMENT_WINDOW
+    rows = (
+        Post.objects.filter(pk__in=post_ids).order_by()
+        .values("id", "created_at", "ratings_count", "ratings_sum")
+        .annotate(recent_comments=Count("comments", filter=Q(comments__created_at__gte=since)))
+    )
+    posts = [
+        Post(
+            pk=r["id"],
+            top_score=top_score(r["ratings_count"], r["ratings_sum"]),
+            trending_score=trending_score(r["created_at"], r["ratings_count"], r["ratings_sum"], r["recent_comments"]),
+        )
+        for r in rows
+    ]
+    return Post.objects.bulk_update(posts, ["top_score", "trending_score"])
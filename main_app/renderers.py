@@ -0,0 +1,88 @@
+import json
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:  # pip install msgpack to offer application/msgpack
+    msgpack = None
+
+# Compact bodies for the bulk lists (stations, places, explore), picked by Accept
+# header or ?format=columns / ?format=msgpack. Rows become parallel arrays, one per
+# field:
+#
+#   {"count": 2, "columns": {"id": [1, 2], "lat": [24.69, 24.7], "line": [1, 1], ...},
+#    "refs": {"line": {"1": {"name": "Blue", "code": "L1", "color": "#0072ce"}}}}
+#
+# Nested objects with an id (a station's line, a place's category) are sent once in
+# refs and referenced by id; a "<name>_detail" object next to a "<name>" id column
+# goes into refs under <name>. Coordinates are numbers instead of decimal strings.
+# A field missing from some rows (like author) is null in those rows. Paginated
+# lists keep their next/previous links.
+FLOAT_FIELDS = {"lat", "lng"}
+
+
+def columnar(data):
+    if isinstance(data, dict) and "results" in data:
+        out = {k: v for k, v in data.items() if k != "results"}
+        out.update(columnar(data["results"]))
+        return out
+    if not isinstance(data, list):
+        return data  # errors and single objects stay as they are
+
+    names = list(dict.fromkeys(k for row in data for k in row))
+    columns, refs = {}, {}
+    for name in names:
+        values = [row.get(name) for row in data]
+        objects = [v for v in values if v is not None]
+        if objects and all(isinstance(v, dict) and "id" in v for v in objects):
+            ref = name[:-len("_detail")] if name.endswith("_detail") and name[:-len("_detail")] in names else name
+            table = refs.setdefault(ref, {})
+            for v in objects:
+                table[str(v["id"])] = {k: x for k, x in v.items() if k != "id"}
+            if ref != name:
+                continue  # the ids are already in the <ref> column
+            values = [None if v is None else v["id"] for v in values]
+        elif name in FLOAT_FIELDS:
+            values = [None if v is None else float(v) for v in values]
+        columns[name] = values
+    return {"count": len(data), "columns": columns, "refs": refs}
+
+
+class ColumnarJSONRenderer(BaseRenderer):
+    media_type = "application/vnd.metro.columns+json"
+    format = "columns"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return json.dumps(columnar(data), cls=JSONEncoder, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        # dates, decimals and lazy strings go out as the JSON renderer would send them
+        return msgpack.packb(columnar(data), default=JSONEncoder().default, use_bin_type=True)
+
+
+COMPACT_RENDERERS = [ColumnarJSONRenderer] + ([MessagePackRenderer] if msgpack else [])
+
+
+class CompactRenderersMixin:
+    """Lets clients ask a list view for the columnar or msgpack body."""
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + COMPACT_RENDERERS
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        patch_vary_headers(response, ["Accept"])
+        return response
@@ -0,0 +1,119 @@
+import heapq
+import threading
+from django.conf import settings
+from .geo import haversine_km
+
+
+class StationGraph:
+    def __init__(self, stations, links, precompute=False):
+        # stations: (id, name, code, line_code, lat, lng); links: (from_id, to_id, kind, seconds)
+        self.nodes = {s[0]: {"id": s[0], "name": s[1], "code": s[2], "line": s[3]} for s in stations}
+        self.coords = {s[0]: (float(s[4]), float(s[5])) for s in stations}
+        self.adj = {pk: [] for pk in self.nodes}
+        fastest = 0.0  # km per second, for an admissible A* heuristic
+        for a, b, kind, seconds in links:
+            if a not in self.adj or b not in self.adj:
+                continue
+            self.adj[a].append((b, seconds, kind))
+            self.adj[b].append((a, seconds, kind))
+            km = haversine_km(*self.coords[a], *self.coords[b])
+            if km > 0:
+                fastest = max(fastest, km / seconds) if seconds > 0 else float("inf")
+        self.fastest = fastest
+        self.all_pairs = None
+        if precompute:
+            self.all_pairs = {pk: self._dijkstra(pk) for pk in self.nodes}
+
+    def _heuristic(self, pk, goal):
+        if not self.fastest or self.fastest == float("inf"):
+            return 0.0
+        return haversine_km(*self.coords[pk], *self.coords[goal]) / self.fastest
+
+    def _dijkstra(self, source):
+        dist, prev = {source: 0}, {source: None}
+        heap = [(0, source)]
+        while heap:
+            d, pk = heapq.heappop(heap)
+            if d > dist[pk]:
+                continue
+            for nxt, seconds, kind in self.adj[pk]:
+                nd = d + seconds
+                if nd < dist.get(nxt, float("inf")):
+                    dist[nxt], prev[nxt] = nd, (pk, kind)
+                    heapq.heappush(heap, (nd, nxt))
+        return dist, prev
+
+    def _astar(self, source, goal):
+        dist, prev = {source: 0}, {source: None}
+        heap = [(self._heuristic(source, goal), 0, source)]
+        while heap:
+            _f, d, pk = heapq.heappop(heap)
+            if pk == goal:
+                break
+            if d > dist[pk]:
+                continue
+            for nxt, seconds, kind in self.adj[pk]:
+                nd = d + seconds
+                if nd < dist.get(nxt, float("inf")):
+                    dist[nxt], prev[nxt] = nd, (pk, kind)
+                    heapq.heappush(heap, (nd + self._heuristic(nxt, goal), nd, nxt))
+        return dist, prev
+
+    def route(self, source, goal):
+        """Fastest path between two station ids, or None when they are not connected."""
+        if source not in self.nodes or goal not in self.nodes:
+            return None
+        if self.all_pairs is not None:
+            dist, prev = self.all_pairs[source]
+        else:
+            dist, prev = self._astar(source, goal)
+        if goal not in dist:
+            return None
+
+        path, kinds = [goal], []
+        while prev[path[-1]] is not None:
+            pk, kind = prev[path[-1]]
+            path.append(pk)
+            kinds.append(kind)
+        path.reverse()
+        kinds.reverse()
+        return {
+            "from": source,
+            "to": goal,
+            "total_seconds": dist[goal],
+            "transfers": kinds.count("transfer"),
+            "stops": [self.nodes[pk] for pk in path],
+        }
+
+
+class GraphHolder:
+    """Builds the station graph once per process and rebuilds it when reference data changes."""
+
+    def __init__(self):
+        self._graph = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._graph = None
+
+    def graph(self):
+        from .caching import refdata_version
+        version = refdata_version()
+        graph = self._graph
+        if graph is None or self._version != version:
+            from .models import Station, StationLink
+            with self._lock:
+                if self._graph is None or self._version != version:
+                    self._graph = StationGraph(
+                        Station.objects.values_list("id", "name", "code", "line__code", "lat", "lng"),
+                        StationLink.objects.values_list("from_station_id", "to_station_id", "kind", "travel_seconds"),
+                        precompute=getattr(settings, "ROUTES_PRECOMPUTE_ALL_PAIRS", False),
+                    )
+                    self._version = version
+                graph = self._graph
+        return graph
+
+
+station_graph = GraphHolder()
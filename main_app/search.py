@@ -0,0 +1,78 @@
+import re
+from collections import Counter
+from django.db import transaction
+from django.db.models import IntegerField, OuterRef, Q, Subquery, Sum
+from .models import Post, Place, SearchTerm
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+MAX_TOKEN_LENGTH = 64
+MAX_QUERY_TERMS = 8
+
+# which text fields feed the index, and how much a hit in each one counts
+FIELDS = {
+    SearchTerm.POST: (Post, [("title", 3), ("body", 1)]),
+    SearchTerm.PLACE: (Place, [("name", 3), ("description", 1)]),
+}
+
+
+def tokenize(text):
+    return [t[:MAX_TOKEN_LENGTH] for t in TOKEN_RE.findall((text or "").lower())]
+
+
+def terms_for(kind, obj):
+    weights = Counter()
+    for field, weight in FIELDS[kind][1]:
+        for token in tokenize(getattr(obj, field)):
+            weights[token] += weight
+    return [SearchTerm(kind=kind, object_id=obj.pk, token=t, weight=w) for t, w in weights.items()]
+
+
+def index_objects(kind, objs):
+    objs = list(objs)
+    if not objs:
+        return
+    with transaction.atomic():
+        SearchTerm.objects.filter(kind=kind, object_id__in=[o.pk for o in objs]).delete()
+        SearchTerm.objects.bulk_create([t for o in objs for t in terms_for(kind, o)], batch_size=1000)
+
+
+def unindex(kind, object_id):
+    SearchTerm.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def reindex(kind, batch_size=1000):
+    model, fields = FIELDS[kind]
+    qs = model.objects.only("pk", *[f for f, _w in fields]).order_by("pk")
+    last_id, total = 0, 0
+    while True:
+        batch = list(qs.filter(pk__gt=last_id)[:batch_size])
+        if not batch:
+            return total
+        index_objects(kind, batch)
+        total += len(batch)
+        last_id = batch[-1].pk
+
+
+def _matches(token, prefix):
+    if prefix:
+        return Q(token__gte=token, token__lt=token + "\uffff")
+    return Q(token=token)
+
+
+def search(qs, kind, q):
+    """Keep rows of qs matching every word of q, annotated with a search_rank."""
+    tokens = tokenize(q)[:MAX_QUERY_TERMS]
+    if not tokens:
+        return qs.none()
+    terms = SearchTerm.objects.filter(kind=kind)
+    any_match = Q()
+    for i, token in enumerate(tokens):
+        # the last word may still be being typed, so it matches as a prefix
+        match = _matches(token, prefix=i == len(tokens) - 1)
+        qs = qs.filter(pk__in=terms.filter(match).values("object_id"))
+        any_match |= match
+    rank = (
+        terms.filter(any_match, object_id=OuterRef("pk")).order_by()
+        .values("object_id").annotate(rank=Sum("weight")).values("rank")
+    )
+    return qs.annotate(search_rank=Subquery(rank, output_field=IntegerField()))
@@ -1,7 +1,12 @@
 from rest_framework import serializers
-from .models import Line, Station, Category, Place, Post, Comment, Rating
+from .models import Line, Station, Category, Place, Post, Comment, Rating, Subscription
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from .authentication import add_user_claims
 
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, min_length=6)
@@ -28,6 +33,21 @@ class StationSerializer(serializers.ModelSerializer):
         model = Station
         fields = ["id", "name", "code", "lat", "lng", "line", "line_id"]
 
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        # the new access token copies the refresh token's claims, which may be out of date
+        access = AccessToken(data["access"])
+        user = User.objects.filter(pk=access[jwt_settings.USER_ID_CLAIM]).first()
+        if user is not None:
+            data["access"] = str(add_user_claims(access, user))
+        return data
+
 class MeSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -59,12 +79,13 @@ class PlaceSerializer(serializers.ModelSerializer):
         fields = [
             "id", "name", "description",
             "category", "category_detail",
-            "nearest_station", "nearest_station_detail",
+            "nearest_station", "nearest_station_detail", "nearest_station_distance_km",
             "lat", "lng",
             "created_by", "created_at",
             "distance_km",
         ]
-        read_only_fields = ["created_by", "created_at", "distance_km"]
+        # nearest_station is worked out from lat/lng when the place is saved
+        read_only_fields = ["nearest_station", "nearest_station_distance_km", "created_by", "created_at", "distance_km"]
 
     def validate(self, attrs):
         lat = attrs.get("lat", getattr(self.instance, "lat", None))
@@ -77,13 +98,28 @@ class PlaceSerializer(serializers.ModelSerializer):
             raise ValidationError("lng must be between -180 and 180")
         return attrs
 
+class ImageVariantsField(serializers.ReadOnlyField):
+    # {"thumb": {"webp": url, "jpeg": url}, "medium": ..., "large": ...}
+    def to_representation(self, value):
+        request = self.context.get("request")
+        variants = {}
+        for variant, formats in (value or {}).items():
+            if variant == "source":
+                continue
+            variants[variant] = {}
+            for ext, name in formats.items():
+                url = default_storage.url(name)
+                variants[variant][ext] = request.build_absolute_uri(url) if request else url
+        return variants
+
 class PostSerializer(serializers.ModelSerializer):
     author = serializers.CharField(source="created_by.username", read_only=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Post
         fields = [
-            "id", "title", "body", "image",
+            "id", "title", "body", "image", "image_variants",
             "station", "place",
             "created_by", "author",
             "created_at", "updated_at",
@@ -111,6 +147,7 @@ class PostPublicSerializer(serializers.ModelSerializer):
     comments_count = serializers.IntegerField(read_only=True)
     ratings_count  = serializers.IntegerField(read_only=True)
     avg_rating     = serializers.FloatField(read_only=True)
+    image_variants = ImageVariantsField()
 
     place   = serializers.SerializerMethodField()
     station = serializers.SerializerMethodField()
@@ -119,7 +156,7 @@ class PostPublicSerializer(serializers.ModelSerializer):
     class Meta:
         model = Post
         fields = [
-            "id","title","body","image",
+            "id","title","body","image","image_variants",
             "place","station",
             "author","created_at","updated_at",
             "comments_count","ratings_count","avg_rating",
@@ -137,10 +174,12 @@ class PostPublicSerializer(serializers.ModelSerializer):
         return None
 
     def get_my_rating(self, obj):
+        if hasattr(obj, "my_rating"):
+            return obj.my_rating
         req = self.context.get("request")
         if not req or not req.user.is_authenticated:
             return None
-        r = obj.ratings.filter(created_by=req.user).first()
+        r = obj.ratings.filter(created_by_id=req.user.id).first()
         return getattr(r, "value", None)
 
 class PostOwnerSerializer(serializers.ModelSerializer):
@@ -148,19 +187,38 @@ class PostOwnerSerializer(serializers.ModelSerializer):
     comments_count = serializers.IntegerField(read_only=True)
     ratings_count  = serializers.IntegerField(read_only=True)
     avg_rating     = serializers.FloatField(read_only=True)
+    image_variants = ImageVariantsField()
     my_rating      = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
         fields = [
-            "id","title","body","image","station","place",
+            "id","title","body","image","image_variants","station","place",
             "author","created_at","updated_at",
             "comments_count","ratings_count","avg_rating","my_rating",
         ]
 
     def get_my_rating(self, obj):
+        if hasattr(obj, "my_rating"):
+            return obj.my_rating
         req = self.context.get("request")
         if not req or not req.user.is_authenticated:
             return None
-        r = obj.ratings.filter(created_by=req.user).values_list("value", flat=True).first()
-        return r
\ No newline at end of file
+        r = obj.ratings.filter(created_by_id=req.user.id).values_list("value", flat=True).first()
+        return r
+class SubscriptionSerializer(serializers.ModelSerializer):
+    unread_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Subscription
+        fields = ["id", "station", "place", "unread_count", "last_read_at", "created_at"]
+        read_only_fields = ["last_read_at", "created_at"]
+
+    def validate(self, attrs):
+        if bool(attrs.get("station")) == bool(attrs.get("place")):
+            raise ValidationError("follow either a station or a place")
+        return attrs
+
+    def get_unread_count(self, obj):
+        # hot sources are counted by the view, see feeds.unread_counts
+        return self.context.get("unread_counts", {}).get(obj.pk, obj.unread_count)
@@ -0,0 +1,162 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Line, Category, Station, StationLink, Place, Post, Comment, Rating, SearchTerm
+from .geo import station_index
+from .routing import station_graph
+from .caching import bump_refdata_version
+from .authentication import revoke_user_tokens
+from . import counters, feeds, search, images, ranking, tasks, tiles
+
+
+@receiver([post_save, post_delete], sender=Station)
+def station_changed(sender, instance, **kwargs):
+    transaction.on_commit(station_index.invalidate)
+
+
+@receiver([post_save, post_delete], sender=Station)
+@receiver([post_save, post_delete], sender=Place)
+def map_point_changed(sender, instance, **kwargs):
+    moved = [(instance.lat, instance.lng), (instance.loaded("lat"), instance.loaded("lng"))]
+    transaction.on_commit(lambda: tiles.invalidate_points(moved))
+    instance.remember_loaded()
+
+
+@receiver([post_save, post_delete], sender=Line)
+@receiver([post_save, post_delete], sender=Station)
+@receiver([post_save, post_delete], sender=StationLink)
+def network_changed(sender, instance, **kwargs):
+    transaction.on_commit(station_graph.invalidate)
+
+
+@receiver([post_save, post_delete], sender=Line)
+@receiver([post_save, post_delete], sender=Station)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=StationLink)
+def refdata_changed(sender, instance, **kwargs):
+    transaction.on_commit(bump_refdata_version)
+
+
+def rescore_on_commit(*post_ids):
+    post_ids = {pk for pk in post_ids if pk}
+    if post_ids:
+        transaction.on_commit(lambda: ranking.rescore(post_ids))
+
+
+def deleted_with_post(instance, origin):
+    # deleting a post cascades to its comments and ratings; its counters go with it
+    if isinstance(origin, Post):
+        return origin.pk == instance.post_id
+    return isinstance(origin, QuerySet) and origin.model is Post
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    old_post = instance.loaded("post_id")
+    if created:
+        counters.bump_comments(instance.post_id, 1)
+        rescore_on_commit(instance.post_id)
+    elif old_post is None:
+        counters.rebuild(Post.objects.filter(pk=instance.post_id))
+        rescore_on_commit(instance.post_id)
+    elif old_post != instance.post_id:
+        counters.bump_comments(old_post, -1)
+        counters.bump_comments(instance.post_id, 1)
+        rescore_on_commit(old_post, instance.post_id)
+    instance.remember_loaded()
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, origin=None, **kwargs):
+    if deleted_with_post(instance, origin):
+        return
+    counters.bump_comments(instance.post_id, -1)
+    rescore_on_commit(instance.post_id)
+
+
+@receiver(post_save, sender=Rating)
+def rating_saved(sender, instance, created, **kwargs):
+    old_post, old_value = instance.loaded("post_id"), instance.loaded("value")
+    if created:
+        counters.bump_ratings(instance.post_id, 1, instance.value)
+    elif old_value is None:
+        # saved without being loaded first, so there is no old value to subtract
+        counters.rebuild(Post.objects.filter(pk__in={old_post, instance.post_id} - {None}))
+    elif old_post != instance.post_id:
+        counters.bump_ratings(old_post, -1, -(old_value or 0))
+        counters.bump_ratings(instance.post_id, 1, instance.value)
+    else:
+        counters.bump_ratings(instance.post_id, 0, instance.value - (old_value or 0))
+    rescore_on_commit(old_post, instance.post_id)
+    instance.remember_loaded()
+
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, origin=None, **kwargs):
+    if deleted_with_post(instance, origin):
+        return
+    counters.bump_ratings(instance.post_id, -1, -instance.value)
+    rescore_on_commit(instance.post_id)
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if not created:
+        return
+    # a new post starts with the trending score of its age
+    rescore_on_commit(instance.pk)
+    if instance.is_public and (instance.station_id or instance.place_id):
+        tasks.submit_on_commit(feeds.fan_out, instance.pk)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Place)
+def searchable_saved(sender, instance, update_fields=None, **kwargs):
+    kind = SearchTerm.POST if sender is Post else SearchTerm.PLACE
+    text_fields = {f for f, _w in search.FIELDS[kind][1]}
+    if update_fields is not None and not text_fields & set(update_fields):
+        return
+    transaction.on_commit(lambda: search.index_objects(kind, [instance]))
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Place)
+def searchable_deleted(sender, instance, **kwargs):
+    search.unindex(SearchTerm.POST if sender is Post else SearchTerm.PLACE, instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def post_image_saved(sender, instance, **kwargs):
+    if instance.image and instance.image_variants.get("source") != instance.image.name:
+        tasks.submit_on_commit(images.process_post_image, instance.pk)
+    elif not instance.image and instance.image_variants:
+        # the files go once the cleared image is committed; a rollback still needs them
+        old = instance.image_variants
+        Post.objects.filter(pk=instance.pk).update(image_variants={})
+        instance.image_variants = {}
+        transaction.on_commit(lambda: images.delete_variants(old))
+
+
+@receiver(post_delete, sender=Post)
+def post_image_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: images.delete_variants(instance.image_variants))
+
+
+USER_CLAIM_FIELDS = ("is_active", "is_staff", "is_superuser")
+
+
+@receiver(pre_save, sender=User)
+def user_changing(sender, instance, update_fields=None, **kwargs):
+    # tokens carry these flags, so they stop being trusted when one changes
+    if instance.pk is None or (update_fields is not None and not set(USER_CLAIM_FIELDS) & set(update_fields)):
+        return
+    old = User.objects.filter(pk=instance.pk).values(*USER_CLAIM_FIELDS).first()
+    if old and any(old[f] != getattr(instance, f) for f in USER_CLAIM_FIELDS):
+        transaction.on_commit(lambda: revoke_user_tokens(instance.pk))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: revoke_user_tokens(instance.pk))
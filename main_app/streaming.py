@@ -0,0 +1,83 @@
+import json
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+STREAM_FORMATS = {"ndjson": "application/x-ndjson", "json": "application/json"}
+FLUSH_BYTES = 64 * 1024
+
+
+def stream_format(request):
+    """'ndjson' or 'json' when the client asked for a streamed body, else None."""
+    fmt = request.query_params.get("stream")
+    return fmt if fmt in STREAM_FORMATS else None
+
+
+def _encode(obj):
+    return json.dumps(obj, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":"))
+
+
+class _Chunks:
+    # rows are written out in ~64KB pieces, so memory stays flat however many rows match
+    def __init__(self, to_data, fmt):
+        self.to_data = to_data
+        self.fmt = fmt
+        self.buf, self.size, self.first = ["["] if fmt == "json" else [], 0, True
+
+    def add(self, obj):
+        piece = _encode(self.to_data(obj))
+        if self.fmt == "ndjson":
+            piece += "\n"
+        elif not self.first:
+            piece = "," + piece
+        self.first = False
+        self.buf.append(piece)
+        self.size += len(piece)
+        if self.size >= FLUSH_BYTES:
+            return self.take()
+        return None
+
+    def take(self):
+        out = "".join(self.buf).encode()
+        self.buf, self.size = [], 0
+        return out
+
+    def close(self):
+        if self.fmt == "json":
+            self.buf.append("]")
+        return self.take()
+
+
+def _rows(queryset, to_data, fmt, chunk_size):
+    chunks = _Chunks(to_data, fmt)
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        out = chunks.add(obj)
+        if out:
+            yield out
+    out = chunks.close()
+    if out:
+        yield out
+
+
+async def _arows(queryset, to_data, fmt, chunk_size):
+    chunks = _Chunks(to_data, fmt)
+    async for obj in queryset.aiterator(chunk_size=chunk_size):
+        out = chunks.add(obj)
+        if out:
+            yield out
+    out = chunks.close()
+    if out:
+        yield out
+
+
+def stream_response(request, queryset, to_data, fmt, chunk_size=1000):
+    # the rows are read after the view has returned and the request's replica choice
+    # (see db_router.py) is gone, so the database is picked now
+    queryset = queryset.using(queryset.db)
+    # under ASGI a sync iterator would be read into a list before the first byte is
+    # sent, so ASGI requests get an async one
+    is_asgi = isinstance(getattr(request, "_request", request), ASGIRequest)
+    rows = (_arows if is_asgi else _rows)(queryset, to_data, fmt, chunk_size)
+    response = StreamingHttpResponse(rows, content_type=STREAM_FORMATS[fmt])
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,39 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# local stand-in for a task queue: jobs run on a small thread pool in this process
+_executor = None
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, "BACKGROUND_WORKERS", 2),
+            thread_name_prefix="metro-bg",
+        )
+    return _executor
+
+
+def _run(fn, args):
+    try:
+        fn(*args)
+    except Exception:
+        logger.exception("background task %s failed", getattr(fn, "__name__", fn))
+    finally:
+        close_old_connections()
+
+
+def submit(fn, *args):
+    if getattr(settings, "BACKGROUND_TASKS_EAGER", False):
+        fn(*args)
+        return None
+    return executor().submit(_run, fn, args)
+
+
+def submit_on_commit(fn, *args):
+    transaction.on_commit(lambda: submit(fn, *args))
@@ -1,3 +1,1110 @@
-from django.test import TestCase
+import io
+import json
+import random
+import tempfile
+import time
+from datetime import timedelta
+from urllib.parse import parse_qs, urlparse
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import router
+from django.utils.connection import ConnectionDoesNotExist
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.tokens import AccessToken
+from .fastpath import FastStationSerializer, FastPlaceSerializer, FastPostPublicSerializer
+from .geo import KDTree, bounding_box, distance_expression, haversine_km, station_index
+from .authentication import StatelessJWTAuthentication, revoke_user_tokens
+from .db_router import read_from_replica
+from .metrics import registry
+from .middleware import ReadReplicaMiddleware
+from .routing import station_graph
+from .models import Line, Station, StationLink, Category, Place, Post, Rating, Comment, SearchTerm, Subscription, TimelineEntry
+from .pagination import encode_cursor
+from .streaming import stream_response
+from .serializers import StationSerializer, PlaceSerializer, PostPublicSerializer
+from .views import PlaceViewSet, with_my_rating
+from .writebehind import RatingBuffer, rating_buffer
+from . import batch, bulkio, feeds, images, ranking, search, tiles
 
-# Create your tests here.
+
+class MyRatingQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("rater", password="secret123")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_posts(self, n):
+        for i in range(n):
+            post = Post.objects.create(title=f"post {i}", created_by=self.user)
+            Rating.objects.create(post=post, created_by=self.user, value=(i % 5) + 1)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        return len(ctx.captured_queries), res.json()["results"]
+
+    def test_explore_query_count_does_not_grow_with_posts(self):
+        self.add_posts(2)
+        few, _ = self.count_queries("/api/explore/")
+        self.add_posts(8)
+        many, results = self.count_queries("/api/explore/")
+        self.assertEqual(few, many)
+        self.assertTrue(all(r["my_rating"] is not None for r in results))
+
+    def test_owner_posts_query_count_does_not_grow_with_posts(self):
+        self.add_posts(2)
+        few, _ = self.count_queries("/api/posts/")
+        self.add_posts(8)
+        many, results = self.count_queries("/api/posts/")
+        self.assertEqual(few, many)
+        self.assertTrue(all(r["my_rating"] is not None for r in results))
+
+
+class FastPathParityTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("rater", password="secret123")
+        line = Line.objects.create(name="Blue", code="L1", color="#0000ff")
+        with self.captureOnCommitCallbacks(execute=True):  # the station index is rebuilt on commit
+            self.station = Station.objects.create(line=line, name="Olaya", code="L1-01", lat="24.690000", lng="46.685000")
+        category = Category.objects.create(name="Cafe", code="cafe")
+        self.place = Place.objects.create(name="Near", category=category, lat="24.691000", lng="46.686000", created_by=self.user)
+        Place.objects.create(name="Nowhere", description="no station", category=category, lat="10.000000", lng="10.000000")
+        Station.objects.filter(pk=self.station.pk).update(name="Olaya \u0639")
+        Place.objects.filter(name="Nowhere").update(nearest_station=None, nearest_station_distance_km=None)
+
+        post = Post.objects.create(title="with everything", body="b", place=self.place, station=self.station, created_by=self.user)
+        Post.objects.filter(pk=post.pk).update(
+            image="posts/a.jpg",
+            image_variants={"thumb": {"webp": "posts/variants/a_thumb.webp", "jpeg": "posts/variants/a_thumb.jpg"}},
+        )
+        Post.objects.create(title="anonymous", body="")
+        Rating.objects.create(post=post, created_by=self.user, value=4)
+
+        self.request = APIRequestFactory().get("/api/explore/")
+        self.request.user = self.user
+
+    def assertSameBytes(self, slow, fast):
+        self.assertEqual(JSONRenderer().render(slow), JSONRenderer().render(fast))
+
+    def test_columnar_format(self):
+        res = self.client.get("/api/stations/", HTTP_ACCEPT="application/vnd.metro.columns+json")
+        body = json.loads(res.content)
+        self.assertEqual(res["Content-Type"], "application/vnd.metro.columns+json")
+        self.assertIn("Accept", res["Vary"])
+        self.assertEqual(body["columns"]["lat"], [24.69])
+        self.assertEqual(body["columns"]["line"], [self.station.line_id])
+        self.assertEqual(body["refs"]["line"][str(self.station.line_id)], {"name": "Blue", "code": "L1", "color": "#0000ff"})
+
+        places = json.loads(self.client.get("/api/places/?format=columns").content)
+        self.assertIn("next", places)
+        self.assertNotIn("category_detail", places["columns"])
+        self.assertEqual(places["refs"]["category"][str(self.place.category_id)], {"name": "Cafe", "code": "cafe"})
+        self.assertEqual(places["columns"]["nearest_station"], [self.station.pk, None])
+
+    def test_stations(self):
+        qs = Station.objects.select_related("line").order_by("code")
+        fast = FastStationSerializer()
+        self.assertSameBytes(StationSerializer(qs, many=True).data, fast.many(fast.values(qs)))
+
+    def test_places(self):
+        qs = Place.objects.select_related("category", "nearest_station__line").order_by("name", "id")
+        fast = FastPlaceSerializer()
+        self.assertSameBytes(PlaceSerializer(qs, many=True).data, fast.many(fast.values(qs)))
+
+        near = qs.annotate(distance_km=distance_expression(24.69, 46.685))
+        self.assertSameBytes(PlaceSerializer(near, many=True).data, fast.many(fast.values(near, "distance_km")))
+
+    def test_public_posts(self):
+        context = {"request": self.request}
+        for user in (self.user, None):
+            qs = with_my_rating(Post.objects.select_related("station", "place", "created_by").order_by("id"), user)
+            fast = FastPostPublicSerializer(context)
+            self.assertSameBytes(PostPublicSerializer(qs, many=True, context=context).data, fast.many(fast.values(qs)))
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"], REPLICA_PIN_SECONDS=30)
+class ReadReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user("writer", password="secret123")
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(self.user)}"}
+        self.read_from = None
+
+        def view(request):
+            self.read_from = router.db_for_read(Post)
+            return HttpResponse(status=201 if request.method == "POST" else 200)
+        self.middleware = ReadReplicaMiddleware(view)
+
+    def test_reads_go_to_replica(self):
+        self.middleware(self.factory.get("/api/explore/", **self.auth))
+        self.assertEqual(self.read_from, "replica1")
+
+    @override_settings(DATABASE_REPLICAS=["replica1", "replica2"])
+    def test_one_replica_per_request(self):
+        used = []
+
+        def view(request):
+            used.append({router.db_for_read(Post) for _ in range(20)})
+            return HttpResponse()
+        middleware = ReadReplicaMiddleware(view)
+        for _ in range(20):
+            middleware(self.factory.get("/api/explore/"))
+        self.assertTrue(all(len(aliases) == 1 for aliases in used))
+        self.assertEqual(set.union(*used), {"replica1", "replica2"})
+
+    def test_writes_and_reads_outside_requests_use_primary(self):
+        self.middleware(self.factory.post("/api/posts/", **self.auth))
+        self.assertEqual(self.read_from, "default")
+        self.assertEqual(router.db_for_read(Post), "default")
+        self.assertEqual(router.db_for_write(Post), "default")
+
+    def test_user_reads_own_writes_from_primary(self):
+        res = self.middleware(self.factory.post("/api/posts/", **self.auth))
+        self.middleware(self.factory.get("/api/posts/", **self.auth))
+        self.assertEqual(self.read_from, "default")
+
+        # a cookie-only client is pinned by the cookie
+        request = self.factory.get("/api/explore/")
+        request.COOKIES[ReadReplicaMiddleware.pin_cookie] = res.cookies[ReadReplicaMiddleware.pin_cookie].value
+        self.middleware(request)
+        self.assertEqual(self.read_from, "default")
+
+        # other users still read from the replica
+        self.middleware(self.factory.get("/api/posts/"))
+        self.assertEqual(self.read_from, "replica1")
+
+
+class StatelessJWTTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("rider", password="secret123", email="old@example.com", is_staff=True)
+        res = self.client.post("/api/auth/login/", {"username": "rider", "password": "secret123"})
+        self.access, self.refresh = res.json()["access"], res.json()["refresh"]
+
+    def authenticate(self, token):
+        request = APIRequestFactory().get("/api/explore/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        return StatelessJWTAuthentication().authenticate(request)[0]
+
+    def test_user_comes_from_token_claims(self):
+        with self.assertNumQueries(0):
+            user = self.authenticate(self.access)
+        self.assertEqual((user.id, user.username, user.is_staff), (self.user.id, "rider", True))
+
+    def test_deactivated_user_tokens_are_revoked(self):
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        with self.assertRaises(InvalidToken):
+            self.authenticate(self.access)
+        res = self.client.post("/api/auth/refresh/", {"refresh": self.refresh})
+        self.assertEqual(res.status_code, 401)
+
+    def test_me_returns_fresh_data(self):
+        User.objects.filter(pk=self.user.pk).update(email="new@example.com")
+        res = self.client.get("/api/auth/me/", HTTP_AUTHORIZATION=f"Bearer {self.access}")
+        self.assertEqual(res.json()["email"], "new@example.com")
+
+
+@override_settings(RATINGS_WRITE_BEHIND=True)
+class WriteBehindRatingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("tapper", password="secret123")
+        self.post = Post.objects.create(title="busy", is_public=True, created_by=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # flushes happen when the test asks for them, not on the timer thread
+        patcher = mock.patch.object(RatingBuffer, "start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(rating_buffer.pending.clear)
+
+    def test_taps_coalesce_into_one_rating(self):
+        for value in (2, 5, 4):
+            res = self.client.post("/api/ratings/", {"post": self.post.pk, "value": value})
+            self.assertEqual(res.status_code, 202)
+        self.assertFalse(Rating.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(rating_buffer.flush(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.ratings_count, self.post.ratings_sum), (1, 4))
+        self.client.post("/api/ratings/", {"post": self.post.pk, "value": 1})
+        rating_buffer.flush()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.ratings_count, self.post.ratings_sum), (1, 1))
+
+    def test_reads_see_taps_buffered_by_any_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            rating = Rating.objects.create(post=self.post, created_by=self.user, value=2)
+        other = RatingBuffer()  # another worker's buffer, never flushed here
+        other.add(self.post.pk, self.user.pk, 5)
+        self.assertEqual(self.client.get("/api/explore/").json()["results"][0]["my_rating"], 5)
+        self.assertEqual(self.client.get("/api/posts/").json()["results"][0]["my_rating"], 5)
+        self.assertEqual(self.client.get("/api/ratings/").json()["results"][0]["value"], 5)
+        self.assertEqual(self.client.get(f"/api/ratings/{rating.pk}/").json()["value"], 5)
+        self.assertEqual(Rating.objects.get().value, 2)
+
+        other.discard(self.post.pk, self.user.pk)
+        self.assertIsNone(self.client.get("/api/explore/").json()["results"][0]["my_rating"])
+        self.assertEqual(self.client.get("/api/ratings/").json()["results"], [])
+        self.assertEqual(self.client.get(f"/api/ratings/{rating.pk}/").status_code, 404)
+
+    def test_newer_tap_on_another_worker_wins(self):
+        self.client.post("/api/ratings/", {"post": self.post.pk, "value": 3})
+        other = RatingBuffer()
+        other.add(self.post.pk, self.user.pk, 5)
+        other.flush()
+        rating_buffer.flush()  # holds the older tap
+        self.assertEqual(Rating.objects.get().value, 5)
+
+    def test_delete_elsewhere_drops_older_buffered_tap(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.objects.create(post=self.post, created_by=self.user, value=2)
+        self.client.post("/api/ratings/", {"post": self.post.pk, "value": 5})
+        # another worker deletes the rating while this one still holds the tap
+        RatingBuffer().discard(self.post.pk, self.user.pk)
+        Rating.objects.all().delete()
+        rating_buffer.flush()
+        self.assertFalse(Rating.objects.exists())
+        # a tap after the delete is written as usual
+        self.client.post("/api/ratings/", {"post": self.post.pk, "value": 4})
+        rating_buffer.flush()
+        self.assertEqual(Rating.objects.get().value, 4)
+
+
+class CommentBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("commenter", password="secret123")
+        self.busy, self.quiet, self.empty = (Post.objects.create(title=t, created_by=self.user) for t in ("busy", "quiet", "empty"))
+        for i in range(5):
+            Comment.objects.create(post=self.busy, body=f"c{i}", created_by=self.user)
+        Comment.objects.create(post=self.quiet, body="only", created_by=self.user)
+
+    def test_latest_comments_per_post_in_one_query(self):
+        with self.assertNumQueries(1):
+            res = self.client.get(f"/api/comments/batch/?post_ids={self.busy.pk},{self.quiet.pk},{self.empty.pk}&per_post=2")
+        results = res.json()["results"]
+        self.assertEqual([c["body"] for c in results[str(self.busy.pk)]["comments"]], ["c4", "c3"])
+        self.assertEqual([c["body"] for c in results[str(self.quiet.pk)]["comments"]], ["only"])
+        self.assertEqual(results[str(self.empty.pk)], {"comments": [], "next": None})
+        self.assertIsNone(results[str(self.quiet.pk)]["next"])
+
+        rest = self.client.get(results[str(self.busy.pk)]["next"]).json()["results"]
+        self.assertEqual([c["body"] for c in rest], ["c2", "c1", "c0"])
+
+    def test_bad_parameters(self):
+        for query, error in (
+            ("post_ids=1,x", "post_ids must be a comma separated list of ids"),
+            ("post_ids=", "post_ids takes 1 to 100 ids"),
+            (f"post_ids={self.busy.pk}&per_post=many", "per_post must be a number"),
+        ):
+            res = self.client.get(f"/api/comments/batch/?{query}")
+            self.assertEqual((res.status_code, res.json()["error"]), (400, error))
+
+
+class BatchRequestTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("starter", password="secret123")
+        self.post = Post.objects.create(title="hello", is_public=True, created_by=self.user)
+        # sub-requests authenticate from the batch's own Authorization header
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+    def test_runs_sub_requests_in_order(self):
+        res = self.client.post("/api/batch/", {"requests": [
+            {"path": "/api/lines/"},
+            {"method": "POST", "path": "/api/ratings/", "body": {"post": self.post.pk, "value": 4}},
+            {"path": f"/api/ratings/?post_id={self.post.pk}"},
+            {"path": "/api/missing/"},
+            {"path": "/api/batch/"},
+        ]}, format="json")
+        self.assertEqual(res.status_code, 200)
+        results = res.json()["results"]
+        self.assertEqual([r["status"] for r in results], [200, 201, 200, 404, 400])
+        self.assertIn("ETag", results[0]["headers"])
+        self.assertEqual(results[2]["body"]["results"][0]["value"], 4)
+
+    def test_sub_requests_are_authenticated_by_their_views(self):
+        res = APIClient().post("/api/batch/", {"requests": [{"path": "/api/auth/me/"}, {"path": "/api/explore/"}]}, format="json")
+        self.assertEqual([r["status"] for r in res.json()["results"]], [401, 200])
+
+    def test_sub_requests_are_recorded_in_metrics(self):
+        registry.reset()
+        self.client.post("/api/batch/", {"requests": [{"path": "/api/lines/"}, {"path": "/api/explore/"}]}, format="json")
+        self.assertEqual(registry.routes["batch:line-list"].count, 1)
+        self.assertEqual(registry.routes["batch:explore-list"].statuses[200], 1)
+
+
+class ParallelBatchTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("parallel", password="secret123")
+        self.post = Post.objects.create(title="hello", is_public=True, created_by=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+    def test_results_in_order_and_writes_wait_for_earlier_reads(self):
+        events, real_run = [], batch.run
+
+        def run(parent, spec):
+            events.append(("start", spec["method"], spec["path"]))
+            if spec["path"] == "/api/lines/":
+                time.sleep(0.2)  # the slowest read comes first
+            out = real_run(parent, spec)
+            events.append(("end", spec["method"], spec["path"]))
+            return out
+
+        comments = f"/api/comments/?post_id={self.post.pk}"
+        with mock.patch.object(batch, "run", run):
+            res = self.client.post("/api/batch/", {"parallel": True, "requests": [
+                {"path": "/api/lines/"},
+                {"path": comments},
+                {"method": "POST", "path": "/api/comments/", "body": {"post": self.post.pk, "body": "first"}},
+                {"path": comments},
+            ]}, format="json")
+        results = res.json()["results"]
+        self.assertEqual([r["status"] for r in results], [200, 200, 201, 200])
+        self.assertEqual(results[0]["body"], [])
+        self.assertEqual(results[1]["body"]["results"], [])
+        self.assertEqual([c["body"] for c in results[3]["body"]["results"]], ["first"])
+        write = events.index(("start", "POST", "/api/comments/"))
+        self.assertIn(("end", "GET", "/api/lines/"), events[:write])
+        self.assertIn(("end", "GET", comments), events[:write])
+
+
+class MapTileTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        line = Line.objects.create(name="Blue", code="L1", color="#0000ff")
+        Station.objects.create(line=line, name="Olaya", code="L1-01", lat="24.690000", lng="46.685000")
+        self.category = Category.objects.create(name="Cafe", code="cafe")
+        self.place = Place.objects.create(name="Corner", category=self.category, lat="24.691000", lng="46.686000")
+
+    def get(self, z, lat, lng):
+        x, y = tiles.tile_of(lat, lng, z)
+        return self.client.get(f"/api/tiles/{z}/{x}/{y}/").json()
+
+    def test_points_up_close_and_clusters_zoomed_out(self):
+        tile = self.get(16, 24.691, 46.686)
+        self.assertEqual(tile["places"], [[self.place.pk, 24.691, 46.686, "Corner", self.category.pk]])
+        self.assertEqual(len(tile["stations"]), 1)
+        zoomed_out = self.get(5, 24.691, 46.686)
+        self.assertTrue(zoomed_out["clustered"])
+        self.assertEqual(zoomed_out["places"], [[24.691, 46.686, 1]])
+
+    @override_settings(SHARED_CACHE=True)
+    def test_moving_a_place_refreshes_only_its_tiles(self):
+        self.get(16, 24.691, 46.686)
+        elsewhere = self.get(16, 24.2, 46.2)
+        self.assertEqual(elsewhere["places"], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.place.lat, self.place.lng = "24.200000", "46.200000"
+            self.place.save()
+        self.assertEqual(self.get(16, 24.691, 46.686)["places"], [])
+        self.assertEqual([p[0] for p in self.get(16, 24.2, 46.2)["places"]], [self.place.pk])
+        # tiles the place was never in stay cached
+        other = tiles.tile_of(24.9, 46.9, 16)
+        self.client.get("/api/tiles/16/{}/{}/".format(*other))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.place.save()
+        self.assertIsNotNone(cache.get(tiles.tile_key(tiles.generation(), 16, *other)))
+
+    @override_settings(SHARED_CACHE=False)
+    def test_per_process_cache_starts_a_new_generation(self):
+        gen = tiles.generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.place.save()
+        self.assertEqual(tiles.generation(), gen + 1)
+        cache.clear()  # a restarted worker still sees the new generation
+        self.assertEqual(tiles.generation(), gen + 1)
+
+    def test_sql_clusters_match_tile_of(self):
+        rng = random.Random(7)
+        for i in range(60):
+            Place.objects.create(name=f"P{i}", category=self.category,
+                                 lat=f"{rng.uniform(24.4, 25.0):.6f}", lng=f"{rng.uniform(46.4, 47.0):.6f}")
+        z = 9
+        x, y = tiles.tile_of(24.7, 46.7, z)
+        cells = {}
+        for pk, lat, lng in tiles.points_in(Place, z, x, y):
+            cells.setdefault(tiles.tile_of(lat, lng, z + tiles.CLUSTER_SHIFT), []).append(pk)
+        self.assertEqual(sorted(c[2] for c in tiles.clusters(Place, z, x, y)), sorted(len(v) for v in cells.values()))
+
+    @override_settings(SHARED_CACHE=False)
+    def test_warming_needs_a_shared_cache(self):
+        with self.assertRaises(CommandError):
+            call_command("warm_map_tiles", stdout=io.StringIO())
+
+
+class RequestMetricsTests(TestCase):
+    @override_settings(METRICS_SLOW_REQUEST_MS=0, METRICS_SLOW_QUERY_LOG=True, METRICS_SLOW_SAMPLE_RATE=1.0)
+    def test_slow_request_log_has_no_query_params(self):
+        User.objects.create_user("secretive", password="secret123")
+        with self.assertLogs("main_app.middleware", "WARNING") as logs:
+            self.client.post("/api/auth/login/", {"username": "secretive", "password": "secret123"})
+        self.assertIn("auth_user", logs.output[0])
+        self.assertNotIn("secretive", logs.output[0])
+
+    @override_settings(METRICS_TOKEN=None, DEBUG=False)
+    def test_metrics_closed_without_token(self):
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 403)
+
+    @override_settings(METRICS_TOKEN="t0k3n")
+    def test_metrics_with_token(self):
+        self.assertEqual(self.client.get("/api/metrics/", HTTP_X_METRICS_TOKEN="t0k3n").status_code, 200)
+        self.assertEqual(self.client.get("/api/metrics/", HTTP_X_METRICS_TOKEN="nope").status_code, 403)
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class FeedTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user("author", password="secret123")
+        self.reader = User.objects.create_user("reader", password="secret123")
+        line = Line.objects.create(name="Blue", code="L1", color="#0000ff")
+        self.station = Station.objects.create(line=line, name="Olaya", code="L1-01", lat="24.690000", lng="46.685000")
+        self.other = Station.objects.create(line=line, name="Malaz", code="L1-02", lat="24.700000", lng="46.700000")
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def publish(self, title, station):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Post.objects.create(title=title, is_public=True, station=station, created_by=self.author)
+
+    def follow(self, station):
+        res = self.client.post("/api/subscriptions/", {"station": station.pk})
+        return Subscription.objects.get(pk=res.json()["id"])
+
+    def feed_titles(self):
+        return [p["title"] for p in self.client.get("/api/feed/").json()["results"]]
+
+    def test_new_posts_fan_out_to_followers(self):
+        self.follow(self.station)
+        self.publish("first", self.station)
+        self.publish("elsewhere", self.other)
+        self.publish("second", self.station)
+        self.assertEqual(self.feed_titles(), ["second", "first"])
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader).count(), 2)
+        self.assertEqual(self.client.get("/api/feed/").json()["unread"], 2)
+
+    @override_settings(FEED_FANOUT_MAX_SUBSCRIBERS=1)
+    def test_hot_sources_are_merged_at_read_time(self):
+        fan = User.objects.create_user("fan", password="secret123")
+        feeds.subscribe(fan.id, station=self.station)
+        sub = self.follow(self.station)
+        self.assertFalse(sub.fanout)
+        self.follow(self.other)
+        self.publish("hot", self.station)
+        self.publish("cold", self.other)
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader, post__station=self.station).exists())
+        self.assertEqual(self.feed_titles(), ["cold", "hot"])
+        unread = {s["station"]: s["unread_count"] for s in self.client.get("/api/subscriptions/").json()}
+        self.assertEqual(unread, {self.station.pk: 1, self.other.pk: 1})
+
+    def test_marking_read_resets_unread_counts(self):
+        sub = self.follow(self.station)
+        self.publish("first", self.station)
+        self.client.post(f"/api/subscriptions/{sub.pk}/read/")
+        self.assertEqual(self.client.get("/api/feed/").json()["unread"], 0)
+
+    def test_unfollow_removes_the_sources_posts(self):
+        sub = self.follow(self.station)
+        self.follow(self.other)
+        self.publish("gone", self.station)
+        self.publish("kept", self.other)
+        res = self.client.delete(f"/api/subscriptions/{sub.pk}/")
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(self.feed_titles(), ["kept"])
+
+
+class BulkImportExportTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Cafe", code="CAF")
+        Place.objects.create(name="Corner", description="small", category=self.category, lat="24.6910000", lng="46.6860000")
+        Place.objects.create(name="Roastery", category=self.category, lat="24.7000000", lng="46.7000000")
+
+    def export(self, fmt):
+        out = io.StringIO()
+        bulkio.WRITERS[fmt]("places", bulkio.export_rows("places"), out)
+        return out.getvalue()
+
+    def reimport(self, fmt, text):
+        errors = []
+        importer = bulkio.Importer("places", on_error=lambda row_no, e: errors.append(row_no))
+        ok, failed = importer.run(bulkio.READERS[fmt](io.StringIO(text)))
+        return ok, failed, errors
+
+    def snapshot(self):
+        return list(Place.objects.order_by("id").values_list("id", "name", "description", "category_id", "lat", "lng"))
+
+    def test_station_tree_is_read_once_per_import(self):
+        rows = [{"name": f"P{i}", "category_code": "CAF", "lat": "24.7", "lng": "46.7"} for i in range(50)]
+        importer = bulkio.Importer("places")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(importer.run(enumerate(rows, 1)), (50, 0))
+        version_reads = [q for q in queries if q["sql"].startswith("SELECT") and "'refdata'" in q["sql"]]
+        self.assertLessEqual(len(version_reads), 1)
+
+    def test_round_trip(self):
+        before = self.snapshot()
+        for fmt in ("csv", "jsonl", "geojson"):
+            text = self.export(fmt)
+            Place.objects.all().delete()
+            self.assertEqual(self.reimport(fmt, text), (2, 0, []))
+            self.assertEqual(self.snapshot(), before)
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        text = "\n".join([
+            '{"name": "Good", "category_code": "CAF", "lat": 24.5, "lng": 46.5}',
+            '{"name": "Broken", ',
+            '{"name": "Lost", "category_code": "NOPE", "lat": 24.5, "lng": 46.5}',
+            '["not", "an", "object"]',
+            '{"name": "Also good", "category_code": "CAF", "lat": 24.6, "lng": 46.6}',
+        ])
+        self.assertEqual(self.reimport("jsonl", text), (2, 3, [2, 3, 4]))
+        self.assertTrue(Place.objects.filter(name="Also good").exists())
+
+    def test_truncated_geojson_keeps_earlier_features(self):
+        text = self.export("geojson")
+        ok, failed, errors = self.reimport("geojson", text[:text.rindex("{\"type\"") + 30])
+        self.assertEqual((ok, failed), (1, 1))
+
+
+class PlacesNearTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Cafe", code="cafe")
+
+    def places(self, *points):
+        return Place.objects.bulk_create(
+            [Place(name=f"p{i}", category=self.category, lat=lat, lng=lng) for i, (lat, lng) in enumerate(points)]
+        )
+
+    def test_radius_and_distance_order(self):
+        rng = random.Random(3)
+        places = self.places(*[(round(rng.uniform(24.6, 24.8), 7), round(rng.uniform(46.6, 46.8), 7)) for _ in range(40)])
+        res = self.client.get("/api/places/", {"lat": 24.7, "lng": 46.7, "radius_km": 5})
+        self.assertEqual(res.status_code, 200)
+        expected = sorted((haversine_km(24.7, 46.7, p.lat, p.lng), p.pk) for p in places)
+        expected = [(d, pk) for d, pk in expected if d <= 5]
+        self.assertEqual([p["id"] for p in res.json()], [pk for _d, pk in expected])
+        for p, (d, _pk) in zip(res.json(), expected):
+            self.assertAlmostEqual(p["distance_km"], d, places=3)
+
+    def test_limit_default_and_cap(self):
+        self.places(*[(24.7 + i / 1000, 46.7) for i in range(8)])
+        params = {"lat": 24.7, "lng": 46.7}
+        with mock.patch.object(PlaceViewSet, "geo_default_limit", 3), mock.patch.object(PlaceViewSet, "geo_max_limit", 5):
+            self.assertEqual(len(self.client.get("/api/places/", params).json()), 3)
+            self.assertEqual(len(self.client.get("/api/places/", {**params, "limit": 100}).json()), 5)
+            self.assertEqual(len(self.client.get("/api/places/", {**params, "limit": 2}).json()), 2)
+
+    def test_bad_radius_or_limit(self):
+        for bad in ({"radius_km": "far"}, {"limit": "lots"}):
+            res = self.client.get("/api/places/", {"lat": 24.7, "lng": 46.7, **bad})
+            self.assertEqual(res.status_code, 400)
+
+    def test_radius_across_antimeridian(self):
+        east, west, _far = self.places((0, 179.95), (0, -179.95), (0, -179.5))
+        min_lat, max_lat, min_lng, max_lng = bounding_box(0, 179.99, 20)
+        self.assertGreater(min_lng, max_lng)
+        for lng in (179.99, -179.99):
+            res = self.client.get("/api/places/", {"lat": 0, "lng": lng, "radius_km": 20})
+            self.assertEqual(sorted(p["id"] for p in res.json()), [east.pk, west.pk])
+
+    def test_database_distance_matches_haversine(self):
+        rng = random.Random(11)
+        points = [(round(rng.uniform(-80, 80), 7), round(rng.uniform(-180, 180), 7)) for _ in range(30)]
+        points += [(24.7, 46.7), (0, 179.999), (0, -179.999)]
+        self.places(*points)
+        for lat, lng in [(24.7, 46.7), (0, 180), (-33.9, 151.2)]:
+            for p in Place.objects.annotate(d=distance_expression(lat, lng)):
+                self.assertAlmostEqual(p.d, haversine_km(lat, lng, p.lat, p.lng), places=3)
+
+class StationIndexTests(TestCase):
+    def test_kdtree_matches_brute_force(self):
+        rng = random.Random(7)
+        points = [(i, rng.uniform(24.5, 25.0), rng.uniform(46.5, 47.0)) for i in range(300)]
+        points += [(300, -33.9, 151.2), (301, 51.5, -0.1), (302, 24.7, 179.9), (303, 24.7, -179.9)]
+        tree = KDTree(points)
+        for lat, lng in [(24.7, 46.7), (24.4, 46.4), (25.2, 47.3), (0.0, 0.0), (24.7, 180.0)]:
+            brute = sorted((haversine_km(lat, lng, plat, plng), key) for key, plat, plng in points)[:5]
+            found = tree.nearest(lat, lng, 5)
+            self.assertEqual([k for _d, k in found], [k for _d, k in brute])
+            self.assertEqual([round(d, 6) for d, _k in found], [round(d, 6) for d, _k in brute])
+        self.assertEqual(KDTree([]).nearest(24.7, 46.7, 3), [])
+        self.assertEqual(len(tree.nearest(24.7, 46.7, 1000)), len(points))
+
+    def test_index_follows_station_changes(self):
+        line = Line.objects.create(name="Blue", code="L1", color="#0000ff")
+        with self.captureOnCommitCallbacks(execute=True):
+            far = Station.objects.create(line=line, name="Far", code="L1-01", lat="24.900000", lng="46.900000")
+        self.assertEqual(station_index.nearest(24.7, 46.7, 1)[0][1], far.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            close = Station.objects.create(line=line, name="Close", code="L1-02", lat="24.701000", lng="46.701000")
+        self.assertEqual(station_index.nearest(24.7, 46.7, 1)[0][1], close.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            close.lat, close.lng = "25.500000", "47.500000"
+            close.save()
+        self.assertEqual(station_index.nearest(24.7, 46.7, 1)[0][1], far.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            far.delete()
+        self.assertEqual([k for _d, k in station_index.nearest(24.7, 46.7, 5)], [close.pk])
+
+
+class RefdataETagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Line.objects.create(name="Blue", code="L1", color="#0000ff")
+
+    def test_not_modified_until_reference_data_changes(self):
+        first = self.client.get("/api/lines/")
+        etag = first["ETag"]
+        self.assertEqual(self.client.get("/api/lines/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Line.objects.create(name="Red", code="L2", color="#ff0000")
+        changed = self.client.get("/api/lines/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(len(changed.json()), 2)
+        self.assertNotEqual(changed["ETag"], etag)
+
+    def test_losing_the_cache_does_not_bring_back_old_etags(self):
+        etag = self.client.get("/api/lines/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Line.objects.create(name="Red", code="L2", color="#ff0000")
+        cache.clear()  # evicted, or a fresh worker
+        res = self.client.get("/api/lines/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.json()), 2)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        station_index.invalidate()  # stations of earlier tests were rolled back without signals
+        self.category = Category.objects.create(name="Cafe", code="cafe")
+
+    def place(self, name, description=""):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Place.objects.create(name=name, description=description, category=self.category, lat="24.7", lng="46.7")
+
+    def names(self, q, **params):
+        return [p["name"] for p in self.client.get("/api/places/", {"q": q, **params}).json()["results"]]
+
+    def test_tokenize(self):
+        self.assertEqual(search.tokenize("Al-Olaya Café, 2nd floor!"), ["al", "olaya", "café", "2nd", "floor"])
+        self.assertEqual(search.tokenize(None), [])
+        self.assertEqual(len(search.tokenize("x" * 100)[0]), search.MAX_TOKEN_LENGTH)
+
+    def test_title_hits_rank_above_body_hits(self):
+        self.place("Quiet corner", "good coffee")
+        self.place("Coffee house")
+        self.place("Tea room")
+        self.assertEqual(self.names("coffee"), ["Coffee house", "Quiet corner"])
+        self.assertEqual(self.names("coffee quiet"), ["Quiet corner"])
+        self.assertEqual(self.names("coff"), ["Coffee house", "Quiet corner"])  # the last word is a prefix
+
+    def test_index_follows_saves_and_deletes(self):
+        place = self.place("Coffee house")
+        with self.captureOnCommitCallbacks(execute=True):
+            place.name = "Tea house"
+            place.save()
+        self.assertEqual(self.names("coffee"), [])
+        self.assertEqual(self.names("tea"), ["Tea house"])
+        place.delete()
+        self.assertFalse(SearchTerm.objects.filter(object_id=place.pk, kind=SearchTerm.PLACE).exists())
+
+    def test_pages_through_tied_ranks(self):
+        made = [self.place(f"Cafe {i}") for i in range(7)]
+        seen, url = [], "/api/places/?q=cafe&page_size=3"
+        while url:
+            body = self.client.get(url).json()
+            seen += [p["id"] for p in body["results"]]
+            url = body["next"]
+        self.assertEqual(seen, sorted(p.pk for p in made))
+
+
+class PostScoreTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(f"rater{i}", password="pw") for i in range(3)]
+
+    def post(self, title, *ratings):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(title=title, created_by=self.users[0])
+        for user, value in zip(self.users, ratings):
+            with self.captureOnCommitCallbacks(execute=True):
+                Rating.objects.create(post=post, created_by=user, value=value)
+        return post
+
+    def test_formulas(self):
+        self.assertEqual(ranking.top_score(0, 0), ranking.PRIOR_MEAN)
+        self.assertAlmostEqual(ranking.top_score(5, 25), 4.0)  # half way to a perfect 5
+        now = ranking.EPOCH + timedelta(days=10)
+        self.assertAlmostEqual(ranking.trending_score(now, 0, 0, 0), 10.0)
+        # one half-life of age is worth a doubling of engagement (1 + 3 -> 1 + 7 comments' worth)
+        self.assertAlmostEqual(
+            ranking.trending_score(now, 0, 0, 3 / ranking.COMMENT_WEIGHT) + 1,
+            ranking.trending_score(now + ranking.HALF_LIFE, 0, 0, 3 / ranking.COMMENT_WEIGHT),
+        )
+        self.assertAlmostEqual(
+            ranking.trending_score(now, 0, 0, 3 / ranking.COMMENT_WEIGHT) + 1,
+            ranking.trending_score(now, 0, 0, 7 / ranking.COMMENT_WEIGHT),
+        )
+
+    def test_sort_orders_explore(self):
+        loved = self.post("loved", 5, 5, 5)
+        meh = self.post("meh", 2, 2)
+        new = self.post("new")
+        ids = lambda sort: [p["id"] for p in self.client.get("/api/explore/", {"sort": sort}).json()["results"]]
+        self.assertEqual(ids("top"), [loved.pk, new.pk, meh.pk])
+        self.assertEqual(ids("new"), [new.pk, meh.pk, loved.pk])
+        self.assertEqual(ids("trending")[0], loved.pk)
+
+    def test_recompute_picks_up_comments_leaving_the_window(self):
+        post = self.post("chatty")
+        with self.captureOnCommitCallbacks(execute=True):
+            comment = Comment.objects.create(post=post, created_by=self.users[1], body="hi")
+        post.refresh_from_db()
+        busy = post.trending_score
+        Comment.objects.filter(pk=comment.pk).update(created_at=comment.created_at - ranking.COMMENT_WINDOW * 1.5)
+        call_command("recompute_post_scores", stdout=io.StringIO())
+        post.refresh_from_db()
+        self.assertAlmostEqual(post.trending_score, ranking.trending_score(post.created_at, 0, 0, 0))
+        self.assertLess(post.trending_score, busy)
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("counter", password="pw")
+        self.other = User.objects.create_user("other", password="pw")
+        self.post = Post.objects.create(title="one", created_by=self.user)
+        self.second = Post.objects.create(title="two", created_by=self.user)
+
+    def counts(self, post):
+        post.refresh_from_db()
+        return post.comments_count, post.ratings_count, post.ratings_sum, post.avg_rating
+
+    def test_comments(self):
+        comment = Comment.objects.create(post=self.post, created_by=self.user, body="hi")
+        Comment.objects.create(post=self.post, created_by=self.other, body="yo")
+        self.assertEqual(self.counts(self.post)[0], 2)
+        comment.post = self.second
+        comment.save()
+        self.assertEqual((self.counts(self.post)[0], self.counts(self.second)[0]), (1, 1))
+        comment.delete()
+        self.assertEqual(self.counts(self.second)[0], 0)
+
+    def test_ratings(self):
+        rating = Rating.objects.create(post=self.post, created_by=self.user, value=4)
+        Rating.objects.create(post=self.post, created_by=self.other, value=2)
+        self.assertEqual(self.counts(self.post)[1:], (2, 6, 3.0))
+        rating.value = 5
+        rating.save()
+        self.assertEqual(self.counts(self.post)[1:], (2, 7, 3.5))
+        rating.post = self.second
+        rating.save()
+        self.assertEqual(self.counts(self.post)[1:], (1, 2, 2.0))
+        self.assertEqual(self.counts(self.second)[1:], (1, 5, 5.0))
+        Rating.objects.filter(pk=rating.pk).get().delete()
+        self.assertEqual(self.counts(self.second)[1:], (0, 0, None))
+
+    def test_deleting_a_post_skips_its_counters(self):
+        for i in range(3):
+            Comment.objects.create(post=self.post, created_by=self.other, body=str(i))
+        Rating.objects.create(post=self.post, created_by=self.other, value=3)
+        with CaptureQueriesContext(connection) as queries:
+            self.post.delete()
+        self.assertFalse([q for q in queries if q["sql"].startswith('UPDATE "main_app_post"')])
+
+    def test_deleting_a_user_updates_posts_that_stay(self):
+        Comment.objects.create(post=self.post, created_by=self.other, body="bye")
+        Rating.objects.create(post=self.post, created_by=self.other, value=1)
+        self.other.delete()
+        self.assertEqual(self.counts(self.post), (0, 0, 0, None))
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class PostImageTests(TestCase):
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.user = User.objects.create_user("snapper", password="pw")
+
+    def upload(self):
+        buf = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x010F] = "SecretCam"  # camera make
+        Image.new("RGB", (2000, 1000), "red").save(buf, "JPEG", exif=exif)
+        return SimpleUploadedFile("photo.jpg", buf.getvalue(), content_type="image/jpeg")
+
+    def test_variants_are_written_and_removed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(title="pic", created_by=self.user, image=self.upload())
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants["source"], post.image.name)
+        with default_storage.open(post.image.name) as f:
+            self.assertFalse(Image.open(f).getexif())
+        with default_storage.open(post.image_variants["thumb"]["webp"]) as f:
+            self.assertEqual(Image.open(f).size, (320, 160))
+        files = list(images.iter_variant_files(post.image_variants))
+        self.assertEqual(len(files), len(images.VARIANT_WIDTHS) * len(images.VARIANT_FORMATS))
+
+        # clearing the image keeps the files until the change is committed
+        with self.captureOnCommitCallbacks() as callbacks:
+            post.image = None
+            post.save()
+        self.assertTrue(all(default_storage.exists(name) for name in files))
+        for callback in callbacks:
+            callback()
+        self.assertFalse(any(default_storage.exists(name) for name in files))
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants, {})
+
+
+class StreamingTests(TestCase):
+    def setUp(self):
+        station_index.invalidate()
+        category = Category.objects.create(name="Cafe", code="cafe")
+        for i, lat in enumerate(("24.700000", "24.800000", "24.710000")):
+            Place.objects.create(name=f"P{i}", category=category, lat=lat, lng="46.700000")
+
+    def stream(self, **params):
+        res = self.client.get("/api/places/", params)
+        return res, b"".join(res.streaming_content) if res.streaming else None
+
+    def test_ndjson_and_json(self):
+        res, body = self.stream(stream="ndjson")
+        self.assertEqual(res["Content-Type"], "application/x-ndjson")
+        self.assertEqual([json.loads(line)["name"] for line in body.splitlines()], ["P0", "P1", "P2"])
+        _res, body = self.stream(stream="json")
+        self.assertEqual([p["name"] for p in json.loads(body)], ["P0", "P1", "P2"])
+
+    def test_near_a_point_needs_a_bound(self):
+        res, _body = self.stream(stream="ndjson", lat=24.7, lng=46.7)
+        self.assertEqual(res.status_code, 400)
+        _res, body = self.stream(stream="ndjson", lat=24.7, lng=46.7, limit=2)
+        self.assertEqual([json.loads(line)["name"] for line in body.splitlines()], ["P0", "P2"])
+        _res, body = self.stream(stream="ndjson", lat=24.7, lng=46.7, radius_km=5)
+        self.assertEqual(len(body.splitlines()), 2)
+
+    async def test_asgi_gets_an_async_stream(self):
+        res = await AsyncClient().get("/api/places/", {"stream": "ndjson"})
+        self.assertTrue(res.is_async)  # sent as it is read, not collected into a list first
+        body = b"".join([chunk async for chunk in res.streaming_content])
+        self.assertEqual([json.loads(line)["name"] for line in body.splitlines()], ["P0", "P1", "P2"])
+
+    @override_settings(DATABASE_REPLICAS=["replica1"])
+    def test_rows_come_from_the_replica_picked_for_the_request(self):
+        with read_from_replica("replica1"):
+            res = stream_response(RequestFactory().get("/"), Place.objects.values("name"), dict, "ndjson")
+        # read after the request's block has ended; the test setup has no replica1 to connect to
+        with self.assertRaises(ConnectionDoesNotExist):
+            b"".join(res.streaming_content)
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("pager", password="pw")
+        self.posts = [Post.objects.create(title=f"p{i}", created_by=self.user) for i in range(7)]
+        # an import can give many posts the same timestamp
+        Post.objects.filter(pk__in=[p.pk for p in self.posts[1:5]]).update(created_at=self.posts[0].created_at)
+
+    def walk(self, url, during=None):
+        seen = []
+        while url:
+            body = self.client.get(url).json()
+            seen += [p["id"] for p in body["results"]]
+            self.assertIsNone(body["previous"])
+            url = body["next"]
+            if during:
+                during()
+                during = None
+        return seen
+
+    def test_pages_through_equal_timestamps(self):
+        expected = list(Post.objects.order_by("-created_at", "id").values_list("id", flat=True))
+        self.assertEqual(self.walk("/api/explore/?page_size=2"), expected)
+        self.assertEqual(self.walk("/api/explore/?page_size=3&sort=top"), sorted(expected))
+
+    def test_new_posts_do_not_shift_later_pages(self):
+        expected = list(Post.objects.order_by("-created_at", "id").values_list("id", flat=True))
+        seen = self.walk("/api/explore/?page_size=2", during=lambda: Post.objects.create(title="late", created_by=self.user))
+        self.assertEqual(seen, expected)
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get("/api/explore/?cursor=nonsense").status_code, 404)
+
+    def test_well_formed_cursor_of_the_wrong_type(self):
+        auth = {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(self.user)}"}
+        for value in ("abc", [1, 2]):
+            cursor = encode_cursor(value, 1)
+            for url in ("/api/explore/", "/api/explore/?sort=top", "/api/posts/", "/api/async/explore/", "/api/feed/"):
+                with self.subTest(url=url, value=value):
+                    res = self.client.get(replace_query_param(url, "cursor", cursor), **auth)
+                    self.assertEqual(res.status_code, 404)
+
+    def test_places_page_through_equal_names(self):
+        station_index.invalidate()
+        category = Category.objects.create(name="Cafe", code="cafe")
+        made = [Place.objects.create(name="Same" if i % 2 else f"P{i}", category=category, lat="24.7", lng="46.7") for i in range(7)]
+        expected = [p.pk for p in sorted(made, key=lambda p: (p.name, p.pk))]
+        self.assertEqual(self.walk("/api/places/?page_size=2"), expected)
+
+
+class RoutingTests(TestCase):
+    def setUp(self):
+        station_graph.invalidate()  # built from the stations of an earlier test
+        blue = Line.objects.create(name="Blue", code="L1", color="#0000ff")
+        red = Line.objects.create(name="Red", code="L2", color="#ff0000")
+        station = lambda line, code, lat, lng: Station.objects.create(line=line, name=code, code=code, lat=lat, lng=lng)
+        self.b1, self.b2, self.b3 = (station(blue, f"L1-0{i}", 24.70 + i / 100, "46.700000") for i in (1, 2, 3))
+        self.r1, self.r2 = (station(red, f"L2-0{i}", "24.720000", 46.70 + i / 100) for i in (1, 2))
+        self.lonely = station(red, "L2-09", "25.000000", "47.000000")
+        link = lambda a, b, seconds, kind=StationLink.LINE: StationLink.objects.create(from_station=a, to_station=b, travel_seconds=seconds, kind=kind)
+        link(self.b1, self.b2, 120)
+        link(self.b2, self.b3, 120)
+        link(self.b2, self.r1, 60, StationLink.TRANSFER)
+        link(self.r1, self.r2, 90)
+
+    def route(self, a, b):
+        return self.client.get("/api/routes/", {"from": a.pk, "to": b.pk})
+
+    def test_same_line(self):
+        route = self.route(self.b3, self.b1).json()
+        self.assertEqual([s["code"] for s in route["stops"]], ["L1-03", "L1-02", "L1-01"])
+        self.assertEqual((route["total_seconds"], route["transfers"]), (240, 0))
+
+    def test_with_transfer(self):
+        for precompute in (False, True):
+            with self.subTest(precompute=precompute), override_settings(ROUTES_PRECOMPUTE_ALL_PAIRS=precompute):
+                station_graph.invalidate()
+                route = self.route(self.b1, self.r2).json()
+                self.assertEqual([s["code"] for s in route["stops"]], ["L1-01", "L1-02", "L2-01", "L2-02"])
+                self.assertEqual((route["total_seconds"], route["transfers"]), (270, 1))
+
+    def test_unreachable_and_unknown(self):
+        self.assertEqual(self.route(self.b1, self.lonely).status_code, 404)
+        self.assertEqual(self.client.get("/api/routes/", {"from": self.b1.pk, "to": 999999}).status_code, 404)
+        self.assertEqual(self.client.get("/api/routes/", {"from": "x", "to": 1}).status_code, 400)
+
+
+class NearestStationTests(TestCase):
+    def setUp(self):
+        station_index.invalidate()
+        line = Line.objects.create(name="Blue", code="L1", color="#0000ff")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.north = Station.objects.create(line=line, name="North", code="L1-01", lat="24.800000", lng="46.700000")
+            self.south = Station.objects.create(line=line, name="South", code="L1-02", lat="24.600000", lng="46.700000")
+        self.category = Category.objects.create(name="Cafe", code="cafe")
+
+    def test_saving_and_moving_a_place(self):
+        place = Place.objects.create(name="Up", category=self.category, lat="24.790000", lng="46.700000")
+        self.assertEqual(place.nearest_station_id, self.north.pk)
+        self.assertAlmostEqual(place.nearest_station_distance_km, haversine_km(24.79, 46.7, 24.8, 46.7), places=3)
+        place.lat = "24.610000"
+        place.save(update_fields=["lat"])
+        place.refresh_from_db()
+        self.assertEqual(place.nearest_station_id, self.south.pk)
+
+    def test_backfill_in_batches_and_after_a_station_moves(self):
+        places = [Place(name=f"P{i}", category=self.category, lat=f"{24.61 + i * 0.02:.6f}", lng="46.700000") for i in range(10)]
+        Place.objects.bulk_create(places)  # no nearest station yet
+        with self.assertNumQueries(9):  # the tree once (2), a read and an update per batch of 4 (6), the last empty read
+            call_command("assign_nearest_stations", "--batch-size", "4", stdout=io.StringIO())
+        nearest = dict(Place.objects.values_list("name", "nearest_station_id"))
+        self.assertEqual(nearest["P0"], self.south.pk)
+        self.assertEqual(nearest["P9"], self.north.pk)
+
+        Station.objects.filter(pk=self.north.pk).update(lat="30.000000")  # moved, without signals
+        out = io.StringIO()
+        call_command("assign_nearest_stations", stdout=out)
+        self.assertIn("updated 5", out.getvalue())
+        self.assertEqual(set(Place.objects.values_list("nearest_station_id", flat=True)), {self.south.pk})
+
+    def test_nearest_station_is_read_only_in_the_api(self):
+        data = {"name": "X", "category": self.category.pk, "lat": "24.790000", "lng": "46.700000", "nearest_station": self.south.pk}
+        serializer = PlaceSerializer(data=data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertNotIn("nearest_station", serializer.validated_data)
+        self.assertEqual(serializer.save().nearest_station_id, self.north.pk)
+
+
+class AsyncEndpointTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        station_index.invalidate()
+        self.user = User.objects.create_user("async", password="pw")
+        self.token = AccessToken.for_user(self.user)
+        line = Line.objects.create(name="Blue", code="L1", color="#0000ff")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.station = Station.objects.create(line=line, name="Olaya", code="L1-01", lat="24.700000", lng="46.700000")
+            Station.objects.create(line=line, name="Far", code="L1-02", lat="25.000000", lng="47.000000")
+        category = Category.objects.create(name="Cafe", code="cafe")
+        for name in ("Coffee corner", "Tea room", "Coffee far"):
+            with self.captureOnCommitCallbacks(execute=True):
+                Place.objects.create(name=name, category=category, lat="24.710000" if "far" not in name else "24.990000", lng="46.700000")
+        self.posts = [Post.objects.create(title=f"p{i}", created_by=self.user) for i in range(5)]
+        for i in range(3):
+            Comment.objects.create(post=self.posts[0], created_by=self.user, body=f"c{i}")
+
+    def aget(self, path, params=None, token=None):
+        headers = {"authorization": f"Bearer {token}"} if token else None
+        return async_to_sync(AsyncClient().get)(path, params or {}, headers=headers)
+
+    def same(self, sync_path, async_path, params, token=None):
+        sync = self.client.get(sync_path, params, **({"HTTP_AUTHORIZATION": f"Bearer {token}"} if token else {})).json()
+        found = self.aget(async_path, params, token).json()
+        if isinstance(sync, dict) and sync["next"]:
+            # same cursor, on the async path
+            query = lambda url: parse_qs(urlparse(url).query)
+            self.assertEqual(query(found.pop("next")), query(sync.pop("next")))
+        self.assertEqual(found, sync)
+        return sync
+
+    def test_same_json_as_the_sync_views(self):
+        Rating.objects.create(post=self.posts[0], created_by=self.user, value=4)
+        self.same("/api/explore/", "/api/async/explore/", {"page_size": 2}, self.token)
+        self.same("/api/explore/", "/api/async/explore/", {"sort": "top"})
+        self.same("/api/comments/", "/api/async/comments/", {"post_id": self.posts[0].pk, "page_size": 2})
+        self.same("/api/stations/nearest/", "/api/async/stations/nearest/", {"lat": 24.7, "lng": 46.7, "limit": 2})
+        near = {"lat": 24.7, "lng": 46.7, "limit": 10}
+        self.same("/api/places/", "/api/async/places/", near)
+        found = self.same("/api/places/", "/api/async/places/", {**near, "q": "coffee", "station_id": self.station.pk})
+        self.assertEqual([p["name"] for p in found], ["Coffee corner"])
+        self.assertEqual(self.aget("/api/async/places/", {"lng": 46.7}).status_code, 400)
+
+    def test_paging_follows_next_links(self):
+        seen, url, params = [], "/api/async/explore/", {"page_size": 2}
+        while url:
+            body = self.aget(url, params).json()
+            self.assertIsNone(body["previous"])
+            seen += [p["id"] for p in body["results"]]
+            url, params = body["next"], None
+        self.assertEqual(seen, [p.pk for p in reversed(self.posts)])
+        self.assertEqual(self.aget("/api/async/comments/", {"post_id": self.posts[0].pk, "cursor": "nonsense"}).status_code, 404)
+
+    def test_authentication(self):
+        anonymous = self.aget("/api/async/explore/").json()["results"]
+        self.assertIsNone(anonymous[0]["my_rating"])
+        self.assertEqual(self.aget("/api/async/explore/", token="junk").status_code, 401)
+        self.assertEqual(self.aget("/api/async/explore/", token=self.token).status_code, 200)
+
+    @override_settings(JWT_STATELESS=True)
+    def test_revoked_token(self):
+        token = AccessToken.for_user(self.user)
+        token["iat"] = int(time.time()) - 5
+        self.assertEqual(self.aget("/api/async/explore/", token=token).status_code, 200)
+        revoke_user_tokens(self.user.pk)
+        res = self.aget("/api/async/explore/", token=token)
+        self.assertEqual(res.status_code, 401)
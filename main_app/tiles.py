@@ -0,0 +1,136 @@
+import math
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, FloatField, Value
+from django.db.models.functions import Cast, Cos, Floor, Greatest, Least, Ln, Radians, Tan
+from .caching import bump_version, get_version
+from .models import Place, Station
+
+# Map tiles: places and stations of one web-mercator tile (the z/x/y scheme of
+# OpenStreetMap and Google maps). From CLUSTER_BELOW down, points are merged into
+# a CLUSTER_GRID x CLUSTER_GRID grid of clusters per tile, so any tile is small.
+# Tiles are built once and cached; saving a place or station drops only the tiles
+# that contain its old and new position, one per zoom level. Bulk changes (imports,
+# seeding) call invalidate_all(), which moves every process on to a new generation.
+# Dropping single tiles only reaches other workers through a shared cache; on a
+# per-process cache (LocMem) every change starts a new generation instead.
+MAX_ZOOM = 18
+CLUSTER_BELOW = 14
+CLUSTER_GRID = 8  # a power of two: cells are the tiles CLUSTER_SHIFT levels down
+CLUSTER_SHIFT = int(math.log2(CLUSTER_GRID))
+GENERATION = "tiles"
+MAX_LAT = 85.0511287798  # web mercator stops here
+
+
+def tile_of(lat, lng, z):
+    lat = min(max(float(lat), -MAX_LAT), MAX_LAT)
+    n = 2 ** z
+    x = int((float(lng) + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(z, x, y):
+    """(south, north, west, east) of the tile in degrees."""
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return lat(y + 1), lat(y), x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def generation():
+    return get_version(GENERATION)
+
+
+def invalidate_all():
+    bump_version(GENERATION)
+
+
+def tile_key(gen, z, x, y):
+    return f"tiles:{gen}:{z}:{x}:{y}"
+
+
+def invalidate_points(points):
+    if not getattr(settings, "SHARED_CACHE", False):
+        invalidate_all()
+        return
+    gen = generation()
+    keys = {
+        tile_key(gen, z, *tile_of(lat, lng, z))
+        for lat, lng in points if lat is not None and lng is not None
+        for z in range(MAX_ZOOM + 1)
+    }
+    cache.delete_many(list(keys))
+
+
+def in_bounds(model, z, x, y):
+    south, north, west, east = tile_bounds(z, x, y)
+    pad = 1e-6  # the bounds are rounded; the exact tile test comes after
+    return model.objects.filter(lat__gte=south - pad, lat__lte=north + pad, lng__gte=west - pad, lng__lte=east + pad)
+
+
+def points_in(model, z, x, y, *columns):
+    rows = in_bounds(model, z, x, y).order_by("id").values_list("id", "lat", "lng", *columns)
+    return [r for r in rows if tile_of(r[1], r[2], z) == (x, y)]
+
+
+def clusters(model, z, x, y):
+    # tile_of in SQL for the cells CLUSTER_SHIFT levels down, counted by the database
+    n = 2 ** (z + CLUSTER_SHIFT)
+    lat = Cast(F("lat"), FloatField())
+    lng = Cast(F("lng"), FloatField())
+    phi = Radians(Greatest(Least(lat, Value(MAX_LAT)), Value(-MAX_LAT)))
+    rows = (
+        in_bounds(model, z, x, y)
+        .annotate(
+            cx=Floor((lng + Value(180.0)) / Value(360.0) * Value(float(n))),
+            cy=Floor((Value(1.0) - Ln(Tan(phi) + Value(1.0) / Cos(phi)) / Value(math.pi)) / Value(2.0) * Value(float(n))),
+        )
+        .filter(
+            cx__gte=x * CLUSTER_GRID, cx__lt=(x + 1) * CLUSTER_GRID,
+            cy__gte=y * CLUSTER_GRID, cy__lt=(y + 1) * CLUSTER_GRID,
+        )
+        .values("cx", "cy")
+        .annotate(count=Count("id"), mean_lat=Avg(lat), mean_lng=Avg(lng))
+        .order_by("cx", "cy")
+    )
+    return [[round(r["mean_lat"], 6), round(r["mean_lng"], 6), r["count"]] for r in rows]
+
+
+def points(rows):
+    return [[pk, float(lat), float(lng), *rest] for pk, lat, lng, *rest in rows]
+
+
+def build_tile(z, x, y):
+    if z < CLUSTER_BELOW:
+        # [lat, lng, count]
+        return {"z": z, "x": x, "y": y, "clustered": True,
+                "places": clusters(Place, z, x, y), "stations": clusters(Station, z, x, y)}
+    # [id, lat, lng, name, category or line id]
+    return {"z": z, "x": x, "y": y, "clustered": False,
+            "places": points(points_in(Place, z, x, y, "name", "category_id")),
+            "stations": points(points_in(Station, z, x, y, "name", "line_id"))}
+
+
+def get_tile(z, x, y):
+    key = tile_key(generation(), z, x, y)
+    tile = cache.get(key)
+    if tile is None:
+        tile = build_tile(z, x, y)
+        cache.set(key, tile, getattr(settings, "TILES_CACHE_TIMEOUT", 60 * 60 * 24))
+    return tile
+
+
+def occupied_tiles(z):
+    """Every tile at zoom z with at least one place or station in it."""
+    found = set()
+    for model in (Place, Station):
+        for lat, lng in model.objects.values_list("lat", "lng").iterator():
+            found.add(tile_of(lat, lng, z))
+    return sorted(found)
@@ -1,6 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import LineViewSet, StationViewSet, RegisterView, MeView, CategoryViewSet, PlaceViewSet, PostViewSet, CommentViewSet, RatingViewSet, ExploreViewSet
+from . import async_views
+from .batch import BatchView
+from .views import LineViewSet, StationViewSet, RegisterView, MeView, CategoryViewSet, PlaceViewSet, PostViewSet, CommentViewSet, RatingViewSet, ExploreViewSet, RouteView, SubscriptionViewSet, FeedView, TileView, metrics_view
 
 router = DefaultRouter()
 router.register(r"lines", LineViewSet, basename="line")
@@ -11,9 +13,19 @@ router.register(r"posts", PostViewSet, basename="post")
 router.register(r"explore", ExploreViewSet, basename="explore")
 router.register(r"comments", CommentViewSet, basename="comment")
 router.register(r"ratings", RatingViewSet, basename="rating")
+router.register(r"subscriptions", SubscriptionViewSet, basename="subscription")
 urlpatterns = [
     path("auth/register/", RegisterView.as_view(), name="auth-register"),
     path("auth/me/", MeView.as_view(), name="auth-me"),
+    path("routes/", RouteView.as_view(), name="routes"),
+    path("feed/", FeedView.as_view(), name="feed"),
+    path("batch/", BatchView.as_view(), name="batch"),
+    path("tiles/<int:z>/<int:x>/<int:y>/", TileView.as_view(), name="tiles"),
+    path("metrics/", metrics_view, name="metrics"),
+    path("async/explore/", async_views.explore, name="async-explore"),
+    path("async/stations/nearest/", async_views.stations_nearest, name="async-stations-nearest"),
+    path("async/places/", async_views.places_near, name="async-places-near"),
+    path("async/comments/", async_views.comments, name="async-comments"),
     path("", include(router.urls))
     
     ]
\ No newline at end of file
@@ -1,15 +1,44 @@
+from datetime import datetime
 from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly, AllowAny
 from rest_framework import status
-from django.db.models import QuerySet, Q, Count, Avg
-from .models import Line, Station, Category, Place, Post, Comment, Rating
-from .serializers import LineSerializer, StationSerializer, RegisterSerializer, MeSerializer, CategorySerializer, PlaceSerializer, PostSerializer, CommentSerializer, RatingSerializer, PostPublicSerializer, PostOwnerSerializer
+from django.contrib.auth.models import User
+from django.db.models import Case, QuerySet, OuterRef, Subquery, IntegerField, Value, F, When, Window
+from django.db.models.functions import RowNumber
+from django.urls import reverse
+from rest_framework.utils.urls import replace_query_param
+from .models import Line, Station, Category, Place, Post, Comment, Rating, SearchTerm, Subscription
+from .serializers import LineSerializer, StationSerializer, RegisterSerializer, MeSerializer, CategorySerializer, PlaceSerializer, PostSerializer, CommentSerializer, RatingSerializer, PostPublicSerializer, PostOwnerSerializer, SubscriptionSerializer
 from .permissions import IsAdminOrReadOnly, IsOwnerOrAdminOrReadOnly
+from .pagination import NewestFirstCursorPagination, NameCursorPagination, FeedCursorPagination, encode_cursor, decode_cursor
+from .search import search
+from .caching import VersionedCacheMixin
+from .renderers import CompactRenderersMixin
+from .streaming import stream_format, stream_response
+from .fastpath import FastStationSerializer, FastPlaceSerializer, FastPostPublicSerializer, FastCommentSerializer
+from .geo import near, station_index
+from .routing import station_graph
+from .metrics import registry
+from .writebehind import pending_for, rating_buffer, enabled as write_behind
+from . import feeds, tiles
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
-import math
+
+def metrics_view(request):
+    # closed unless METRICS_TOKEN is set (and sent), or in DEBUG
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if token:
+        allowed = constant_time_compare(request.headers.get("X-Metrics-Token", ""), token)
+    else:
+        allowed = settings.DEBUG
+    if not allowed:
+        return HttpResponse(status=403)
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 class RegisterView(APIView):
     def post(self, request):
@@ -23,27 +52,55 @@ class MeView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        s = MeSerializer(request.user)
+        # the token only carries a few claims, so read the rest fresh
+        user = User.objects.filter(pk=request.user.id).first()
+        if user is None:
+            return Response({"detail": "User not found"}, status=404)
+        s = MeSerializer(user)
         return Response(s.data, status=200)
     
-class LineViewSet(viewsets.ModelViewSet):
+class RouteView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        try:
+            source = int(request.query_params.get("from"))
+            goal = int(request.query_params.get("to"))
+        except (TypeError, ValueError):
+            return Response({"error": "from and to must be station ids"}, status=400)
+        graph = station_graph.graph()
+        if source not in graph.nodes or goal not in graph.nodes:
+            return Response({"error": "station not found"}, status=404)
+        route = graph.route(source, goal)
+        if route is None:
+            return Response({"error": "no route between these stations"}, status=404)
+        return Response(route, status=200)
+    
+class LineViewSet(VersionedCacheMixin, viewsets.ModelViewSet):
     queryset = Line.objects.all().order_by("code")
     serializer_class = LineSerializer
     permission_classes = [IsAdminOrReadOnly]
 
     @action(detail=True, methods=["get"], url_path="stations")
     def stations(self, request, pk=None):
-        qs = Station.objects.select_related("line").filter(line_id=pk).order_by("code")
-        data = StationSerializer(qs, many=True).data
-        return Response(data, status=200)
+        fast = FastStationSerializer()
+        qs = fast.values(Station.objects.filter(line_id=pk).order_by("code"))
+        fmt = stream_format(request)
+        if fmt:
+            return stream_response(request, qs, fast.to_dict, fmt)
+
+        def build():
+            return Response(fast.many(qs), status=200)
+        return self.cached_response(request, build)
     
-class StationViewSet(viewsets.ModelViewSet):
+class StationViewSet(CompactRenderersMixin, VersionedCacheMixin, viewsets.ModelViewSet):
     queryset: QuerySet[Station] = Station.objects.select_related("line").all().order_by("code")
     serializer_class = StationSerializer
     permission_classes = [IsAdminOrReadOnly]
 
 # got the idea from a github example about nearest location
 # it uses lat & lng with haversine formula to find closest stations
+# stations are kept in a k-d tree (see geo.py) so we only load the k we return
 # ref: https://stackoverflow.com/questions/29765052/how-to-get-the-nearest-location-entries-from-a-database
    
     @action(detail=False, methods=["get"], url_path="nearest")
@@ -55,54 +112,47 @@ class StationViewSet(viewsets.ModelViewSet):
             return Response({"error :"}, status=400)
 
         limit = int(request.query_params.get("limit", 1))
-        R = 6371.0
 
-        def haversine(lat1, lon1, lat2, lon2):
-            phi1, phi2 = math.radians(lat1), math.radians(lat2)
-            dphi = math.radians(lat2 - lat1)
-            dlambda = math.radians(lon2 - lon1)
-            a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-            return 2*R*math.asin(math.sqrt(a))
-
-        stations = []
-        for s in Station.objects.select_related("line").all():
-            d = haversine(lat, lng, float(s.lat), float(s.lng))
-            stations.append((d, s))
-        stations.sort(key=lambda x: x[0])
+        found = station_index.nearest(lat, lng, limit)
+        fast = FastStationSerializer()
+        rows = {r["id"]: r for r in fast.values(Station.objects.filter(pk__in=[pk for _d, pk in found]))}
 
         data = []
-        for d, s in stations[:limit]:
-            item = StationSerializer(s).data
+        for d, pk in found:
+            r = rows.get(pk)
+            if r is None:
+                continue
+            item = fast.to_dict(r)
             item["distance_km"] = round(d, 3)
             data.append(item)
         return Response(data, status=200)
+
+    def list(self, request, *args, **kwargs):
+        def build():
+            fast = FastStationSerializer()
+            return Response(fast.many(fast.values(self.get_queryset())), status=200)
+        return self.cached_response(request, build)
     
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(VersionedCacheMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all().order_by("name")
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
 
-def haversine_km(lat1, lon1, lat2, lon2):
-    R = 6371.0
-    lat1, lon1, lat2, lon2 = map(float, (lat1, lon1, lat2, lon2))
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-    return 2*R*math.asin(math.sqrt(a))
-
-class PlaceViewSet(viewsets.ModelViewSet):
+class PlaceViewSet(CompactRenderersMixin, viewsets.ModelViewSet):
     queryset = Place.objects.select_related(
         "category", "nearest_station", "nearest_station__line"
     ).all()
     serializer_class = PlaceSerializer
     permission_classes = [IsOwnerOrAdminOrReadOnly]
+    pagination_class = NameCursorPagination
 
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user)
+        serializer.save(created_by_id=self.request.user.id)
 
     def list(self, request, *args, **kwargs):
         qs = self.get_queryset()
+        fmt = stream_format(request)
+        fast = FastPlaceSerializer(self.get_serializer_context())
 
         cat_id = request.query_params.get("category_id")
         if cat_id:
@@ -110,59 +160,100 @@ class PlaceViewSet(viewsets.ModelViewSet):
         station_id = request.query_params.get("station_id")
         if station_id:
             qs = qs.filter(nearest_station_id=station_id)
+        q = request.query_params.get("q")
+        if q:
+            qs = search(qs, SearchTerm.PLACE, q)
 
-        lat = request.query_params.get("lat")
-        lng = request.query_params.get("lng")
-
-        data = PlaceSerializer(qs, many=True).data
-        if lat and lng:
+        try:
+            lat = float(request.query_params.get("lat", ""))
+            lng = float(request.query_params.get("lng", ""))
+        except ValueError:
+            lat = lng = None
+        if lat is not None:
             try:
-                lat = float(lat)
-                lng = float(lng)
+                radius_km = request.query_params.get("radius_km")
+                radius_km = float(radius_km) if radius_km else None
+                limit = min(int(request.query_params.get("limit", self.geo_default_limit)), self.geo_max_limit)
+                if fmt:
+                    # streamed bodies are not held in memory, so only an explicit limit applies
+                    limit = int(request.query_params["limit"]) if "limit" in request.query_params else None
             except ValueError:
-                return Response(data, status=200)
+                return Response({"error": "radius_km and limit must be numbers"}, status=400)
+            if fmt and radius_km is None and limit is None:
+                # sorting every place by distance would hold up the first byte
+                return Response({"error": "streaming places near a point needs radius_km or limit"}, status=400)
+            qs = near(qs, lat, lng, radius_km)
+            if limit is not None:
+                qs = qs[:max(limit, 0)]
+            rows = fast.values(qs, "distance_km")
+            if fmt:
+                return stream_response(request, rows, fast.to_dict, fmt)
+            return Response(fast.many(rows), status=200)
 
-            for item in data:
-                try:
-                    d = haversine_km(lat, lng, float(item["lat"]), float(item["lng"]))
-                    item["distance_km"] = round(d, 3)
-                except:
-                    item["distance_km"] = None
+        rows = fast.values(qs, "search_rank") if q else fast.values(qs)
+        if fmt:
+            ordering = ("-search_rank", "id") if q else ("name", "id")
+            return stream_response(request, rows.order_by(*ordering), fast.to_dict, fmt)
+        page = self.paginate_queryset(rows)
+        return self.get_paginated_response(fast.many(page))
 
-            data.sort(key=lambda x: (x.get("distance_km") is None, x.get("distance_km")))
+    geo_default_limit = 50
+    geo_max_limit = 500
 
-        return Response(data, status=200)
-    
+
+def with_my_rating(qs, user):
+    # the current user's rating comes back with the posts instead of one query per post
+    if not user or not user.is_authenticated:
+        return qs.annotate(my_rating=Value(None, output_field=IntegerField()))
+    mine = Subquery(Rating.objects.filter(post=OuterRef("pk"), created_by_id=user.id).values("value")[:1])
+    pending = pending_for(user.id)
+    if pending:
+        # taps not written yet, on any worker (see writebehind.py)
+        mine = Case(*[When(pk=p, then=Value(v)) for p, v in pending.items()], default=mine, output_field=IntegerField())
+    return qs.annotate(my_rating=mine)
+
+def explore_queryset(params, user):
+    qs = (
+        Post.objects.filter(is_public=True)
+        .select_related("created_by", "station", "place")
+        .order_by("-created_at")
+    )
+    q = params.get("q")
+    place_id = params.get("place_id")
+    station_id = params.get("station_id")
+    if q:
+        qs = search(qs, SearchTerm.POST, q)
+    if place_id:
+        qs = qs.filter(place_id=place_id)
+    if station_id:
+        qs = qs.filter(station_id=station_id)
+    return with_my_rating(qs, user)
 
 class PostViewSet(viewsets.ModelViewSet):
     queryset = Post.objects.select_related("station","place","created_by").all()
     serializer_class = PostSerializer
     permission_classes = [IsOwnerOrAdminOrReadOnly]
+    pagination_class = NewestFirstCursorPagination
     parser_classes = [MultiPartParser, FormParser, JSONParser]
 
     def get_queryset(self):
         qs = super().get_queryset()
         if self.action == "list" and not self.request.user.is_staff:
-            qs = qs.filter(created_by=self.request.user)
+            qs = qs.filter(created_by_id=self.request.user.id)
 
         q = self.request.query_params.get("q")
         station_id = self.request.query_params.get("station_id")
         place_id = self.request.query_params.get("place_id")
         if q:
-            qs = qs.filter(Q(title_icontains=q) | Q(body_icontains=q))
+            qs = search(qs, SearchTerm.POST, q)
         if station_id:
             qs = qs.filter(station_id=station_id)
         if place_id:
             qs = qs.filter(place_id=place_id)
 
+        qs = qs.order_by("-created_at")
         if self.action == "list":
-            qs = qs.annotate(
-                comments_count=Count("comments"),
-                ratings_count=Count("ratings"),
-                avg_rating=Avg("ratings__value"),
-            ).order_by("-created_at")
-        else:
-            qs = qs.order_by("-created_at")
+            qs = with_my_rating(qs, self.request.user)
         return qs
 
     def get_serializer_class(self):
@@ -171,37 +262,37 @@ class PostViewSet(viewsets.ModelViewSet):
         return PostSerializer
 
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user)
+        serializer.save(created_by_id=self.request.user.id)
 
-class ExploreViewSet(viewsets.ReadOnlyModelViewSet):
+class ExploreViewSet(CompactRenderersMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = PostPublicSerializer
     permission_classes = [AllowAny]
+    pagination_class = FeedCursorPagination
 
     def get_queryset(self):
-        qs = (
-            Post.objects.filter(is_public=True)
-            .select_related("created_by", "station", "place")
-            .annotate(
-                comments_count=Count("comments"),
-                ratings_count=Count("ratings"),
-                avg_rating=Avg("ratings__value"),
-            )
-            .order_by("-created_at")
-        )
-        q = self.request.query_params.get("q")
-        place_id = self.request.query_params.get("place_id")
-        station_id = self.request.query_params.get("station_id")
-        if q:
-            qs = qs.filter(Q(title_icontains=q) | Q(body_icontains=q))
-        if place_id:
-            qs = qs.filter(place_id=place_id)
-        if station_id:
-            qs = qs.filter(station_id=station_id)
-        return qs
+        return explore_queryset(self.request.query_params, self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        qs = self.filter_queryset(self.get_queryset())
+        fast = FastPostPublicSerializer(self.get_serializer_context())
+        # the cursor needs the sort columns in each row
+        ordering = self.paginator.get_ordering(request, qs, self)
+        rows = fast.values(qs, *(f.lstrip("-") for f in ordering))
+        page = self.paginate_queryset(rows)
+        return self.get_paginated_response(fast.many(page))
+
+def latest_comments(post_ids, per_post):
+    # newest comments of each post in one query, plus one extra to tell if there are more
+    newest = Window(RowNumber(), partition_by=F("post_id"), order_by=[F("created_at").desc(), F("id").asc()])
+    return Comment.objects.filter(post_id__in=post_ids).annotate(row=newest).filter(row__lte=per_post + 1)
 
 class CommentViewSet(viewsets.ModelViewSet):
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = NewestFirstCursorPagination
+    batch_max_posts = 100
+    batch_default_per_post = 3
+    batch_max_per_post = 20
     def get_queryset(self):
         qs = Comment.objects.select_related("created_by","post")
         post_id = self.request.query_params.get("post_id")
@@ -209,22 +300,81 @@ class CommentViewSet(viewsets.ModelViewSet):
             qs = qs.filter(post_id=post_id)
         return qs
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user)
+        serializer.save(created_by_id=self.request.user.id)
+
+    @action(detail=False, methods=["get"])
+    def batch(self, request):
+        """
+        ?post_ids=1,2,3&per_post=3: the latest comments of every post on a feed page,
+        each with a "next" link to the rest of that post's comments.
+        """
+        try:
+            post_ids = list(dict.fromkeys(int(i) for i in request.query_params.get("post_ids", "").split(",") if i))
+        except ValueError:
+            return Response({"error": "post_ids must be a comma separated list of ids"}, status=400)
+        if not post_ids or len(post_ids) > self.batch_max_posts:
+            return Response({"error": f"post_ids takes 1 to {self.batch_max_posts} ids"}, status=400)
+        try:
+            per_post = int(request.query_params.get("per_post", self.batch_default_per_post))
+        except ValueError:
+            return Response({"error": "per_post must be a number"}, status=400)
+        per_post = min(max(per_post, 1), self.batch_max_per_post)
+
+        fast = FastCommentSerializer(self.get_serializer_context())
+        found = {pk: [] for pk in post_ids}
+        for r in fast.values(latest_comments(post_ids, per_post)).order_by("post_id", "-created_at", "id"):
+            found[r["post_id"]].append(r)
+
+        results = {}
+        for post_id, rows in found.items():
+            page = rows[:per_post]
+            next_url = None
+            if len(rows) > per_post:
+                # the cursor the list endpoint hands out after this page
+                url = self.request.build_absolute_uri(f"{reverse('comment-list')}?post_id={post_id}")
+                next_url = replace_query_param(url, "cursor", encode_cursor(page[-1]["created_at"], page[-1]["id"]))
+            results[post_id] = {"comments": fast.many(page), "next": next_url}
+        return Response({"results": results})
 
 class RatingViewSet(viewsets.ModelViewSet):
     serializer_class = RatingSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = NewestFirstCursorPagination
     def get_queryset(self):
         qs = Rating.objects.select_related("created_by","post")
         post_id = self.request.query_params.get("post_id")
         if post_id:
             qs = qs.filter(post_id=post_id)
-        return qs.filter(created_by=self.request.user)
+        deleted = [p for p, v in pending_for(self.request.user.id).items() if v is None]
+        if deleted:
+            qs = qs.exclude(post_id__in=deleted)
+        return qs.filter(created_by_id=self.request.user.id)
+
+    def with_pending(self, ratings):
+        # values tapped but not written yet; new ratings show up once written
+        pending = pending_for(self.request.user.id)
+        for r in ratings:
+            if pending.get(r.post_id) is not None:
+                r.value = pending[r.post_id]
+        return ratings
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        return self.get_paginated_response(self.get_serializer(self.with_pending(page), many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.get_serializer(self.with_pending([self.get_object()])[0]).data)
 
     def perform_create(self, serializer):
+        if write_behind():
+            # queued: written with the next flush, 202 tells the client it isn't stored yet
+            post, value = serializer.validated_data["post"], serializer.validated_data["value"]
+            rating_buffer.add(post.pk, self.request.user.id, value)
+            self.instance = Rating(post=post, created_by_id=self.request.user.id, value=value)
+            return
         obj, _created = Rating.objects.update_or_create(
             post=serializer.validated_data["post"],
-            created_by=self.request.user,
+            created_by_id=self.request.user.id,
             defaults={"value": serializer.validated_data["value"]},
         )
         self.instance = obj
@@ -233,4 +383,91 @@ class RatingViewSet(viewsets.ModelViewSet):
         s = self.get_serializer(data=request.data)
         s.is_valid(raise_exception=True)
         self.perform_create(s)
-        return Response(self.get_serializer(self.instance).data, status=status.HTTP_201_CREATED)
\ No newline at end of file
+        code = status.HTTP_201_CREATED if self.instance.pk else status.HTTP_202_ACCEPTED
+        return Response(self.get_serializer(self.instance).data, status=code)
+
+    def perform_update(self, serializer):
+        instance = serializer.instance
+        if write_behind() and serializer.validated_data.get("post", instance.post) == instance.post:
+            value = serializer.validated_data.get("value", instance.value)
+            rating_buffer.add(instance.post_id, self.request.user.id, value)
+            instance.value = value
+            return
+        serializer.save()
+
+    def perform_destroy(self, instance):
+        # a queued tap from before the delete mustn't bring the rating back
+        rating_buffer.discard(instance.post_id, instance.created_by_id)
+        instance.delete()
+
+class SubscriptionViewSet(viewsets.ModelViewSet):
+    serializer_class = SubscriptionSerializer
+    permission_classes = [IsAuthenticated]
+    http_method_names = ["get", "post", "delete", "head", "options"]
+
+    def get_queryset(self):
+        return Subscription.objects.filter(user_id=self.request.user.id).order_by("-created_at")
+
+    def list(self, request, *args, **kwargs):
+        subs = list(self.get_queryset())
+        s = self.get_serializer(subs, many=True, context={**self.get_serializer_context(), "unread_counts": feeds.unread_counts(subs)})
+        return Response(s.data, status=200)
+
+    def create(self, request, *args, **kwargs):
+        s = self.get_serializer(data=request.data)
+        s.is_valid(raise_exception=True)
+        sub, created = feeds.subscribe(request.user.id, s.validated_data.get("station"), s.validated_data.get("place"))
+        return Response(self.get_serializer(sub).data, status=201 if created else 200)
+
+    def perform_destroy(self, instance):
+        feeds.unsubscribe(instance)
+
+    @action(detail=True, methods=["post"], url_path="read")
+    def read(self, request, pk=None):
+        feeds.mark_read(self.get_queryset().filter(pk=pk))
+        return Response(status=204)
+
+    @action(detail=False, methods=["post"], url_path="read", url_name="read-all")
+    def read_all(self, request):
+        feeds.mark_read(self.get_queryset())
+        return Response(status=204)
+
+class FeedView(APIView):
+    # posts from every followed station and place, newest first
+    permission_classes = [IsAuthenticated]
+    page_size = 20
+    max_page_size = 100
+
+    def get(self, request):
+        after = None
+        if request.query_params.get("cursor"):
+            after = decode_cursor(request.query_params["cursor"])
+            if after is None or not isinstance(after[0], datetime):
+                return Response({"detail": "Invalid cursor"}, status=404)
+        try:
+            size = min(max(int(request.query_params.get("page_size", self.page_size)), 1), self.max_page_size)
+        except ValueError:
+            size = self.page_size
+
+        subs = list(Subscription.objects.filter(user_id=request.user.id))
+        fast = FastPostPublicSerializer({"request": request})
+        page, more = feeds.timeline(request.user.id, subs, lambda qs: fast.values(with_my_rating(qs, request.user)), size, after)
+        next_url = None
+        if more:
+            params = request.query_params.copy()
+            params["cursor"] = encode_cursor(page[-1]["created_at"], page[-1]["id"])
+            next_url = request.build_absolute_uri(f"{request.path}?{params.urlencode()}")
+        return Response({
+            "next": next_url,
+            "unread": sum(feeds.unread_counts(subs).values()),
+            "results": fast.many(page),
+        }, status=200)
+
+class TileView(APIView):
+    # places and stations of one map tile, clustered when zoomed out (see tiles.py)
+    permission_classes = [AllowAny]
+
+    def get(self, request, z, x, y):
+        if not tiles.valid_tile(z, x, y):
+            return Response({"detail": "Not found."}, status=404)
+        return Response(tiles.get_tile(z, x, y), headers={"Cache-Control": "public, max-age=60"})
@@ -0,0 +1,162 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from .models import Post, Rating
+from .db_router import read_from_replica
+from . import counters, ranking
+
+logger = logging.getLogger(__name__)
+
+# Optional buffered write path for ratings (RATINGS_WRITE_BEHIND=True). Taps are
+# accepted into a per-process buffer keyed by (post, user), so only the last value
+# counts, and a background thread writes the buffer out every RATINGS_FLUSH_INTERVAL
+# seconds: one bulk upsert, then one counter update per post. The buffer is flushed
+# on exit as well.
+#
+# Read your own rating: every tap (and every delete, as a None value) is also kept
+# in the shared cache, per user as {post_id: (value, tapped at)}, for a while after
+# it has been written. Reads lay those over the database (my_rating, /ratings/), on
+# whichever worker serves them. A flush only writes a tap that is still the user's
+# latest for the post, so a delete or a newer tap on another worker wins.
+PENDING_KEY = "ratings:pending:{}"
+LOCK_KEY = "ratings:pending:{}:lock"
+
+
+def enabled():
+    return getattr(settings, "RATINGS_WRITE_BEHIND", False)
+
+
+def interval():
+    return getattr(settings, "RATINGS_FLUSH_INTERVAL", 1.0)
+
+
+def marker_timeout():
+    # long enough for any worker's buffer to have been flushed
+    return max(int(interval() * 10), 10)
+
+
+@contextmanager
+def user_lock(user_id):
+    # two workers updating the same user's pending taps at once would lose one
+    key, deadline = LOCK_KEY.format(user_id), time.monotonic() + 1
+    while not cache.add(key, 1, timeout=5) and time.monotonic() < deadline:
+        time.sleep(0.005)
+    try:
+        yield
+    finally:
+        cache.delete(key)
+
+
+def pending_for(user_id):
+    """{post_id: value} of the user's recent taps, None for a deleted rating."""
+    if not enabled() or user_id is None:
+        return {}
+    return {post_id: value for post_id, (value, _tapped) in (cache.get(PENDING_KEY.format(user_id)) or {}).items()}
+
+
+class RatingBuffer:
+    def __init__(self):
+        self.pending = {}  # (post_id, user_id) -> (value, tapped at)
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pid = None
+
+    def start(self):
+        # once per process; a forked worker starts its own thread
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        threading.Thread(target=self.run, name="metro-ratings-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            self.wake.wait(interval())
+            self.wake.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def record(self, user_id, post_id, value, tapped):
+        key = PENDING_KEY.format(user_id)
+        with user_lock(user_id):
+            taps = {p: t for p, t in (cache.get(key) or {}).items() if t[1] > tapped - marker_timeout()}
+            taps[post_id] = (value, tapped)
+            cache.set(key, taps, timeout=marker_timeout())
+
+    def add(self, post_id, user_id, value):
+        self.start()
+        tapped = time.time()
+        self.record(user_id, post_id, value, tapped)
+        with self.lock:
+            self.pending[(post_id, user_id)] = (value, tapped)
+            full = len(self.pending) >= getattr(settings, "RATINGS_FLUSH_BATCH", 500)
+        if full:
+            self.wake.set()
+
+    def discard(self, post_id, user_id):
+        self.record(user_id, post_id, None, time.time())
+        with self.lock:
+            self.pending.pop((post_id, user_id), None)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+            if not batch:
+                return 0
+            try:
+                self.write(batch)
+            except Exception:
+                logger.exception("flushing %d buffered ratings failed, will retry", len(batch))
+                with self.lock:
+                    for k, v in batch.items():
+                        self.pending.setdefault(k, v)  # keep anything newer
+                return 0
+            return len(batch)
+
+    def write(self, batch):
+        # a tap replaced or deleted since, on any worker, isn't written; neither are taps
+        # on posts or by users deleted since
+        latest = cache.get_many([PENDING_KEY.format(u) for u in {u for _p, u in batch}])
+        post_ids = set(Post.objects.filter(pk__in={p for p, _u in batch}).values_list("pk", flat=True))
+        user_ids = set(User.objects.filter(pk__in={u for _p, u in batch}).values_list("pk", flat=True))
+        batch = {
+            (p, u): value for (p, u), (value, tapped) in batch.items()
+            if p in post_ids and u in user_ids
+            and tapped >= latest.get(PENDING_KEY.format(u), {}).get(p, (None, 0))[1]
+        }
+        if not batch:
+            return
+        with read_from_replica(None), transaction.atomic():
+            existing = Rating.objects.select_for_update().filter(
+                post_id__in={p for p, _u in batch}, created_by_id__in={u for _p, u in batch},
+            ).values_list("post_id", "created_by_id", "value")
+            old = {(p, u): v for p, u, v in existing if (p, u) in batch}
+            Rating.objects.bulk_create(
+                [Rating(post_id=p, created_by_id=u, value=v) for (p, u), v in batch.items()],
+                update_conflicts=True, unique_fields=["post", "created_by"], update_fields=["value"],
+            )
+            # bulk_create skips the rating signals, so counters and scores are updated here, once per post
+            deltas = {}
+            for (p, u), v in batch.items():
+                count, total = deltas.get(p, (0, 0))
+                deltas[p] = (count + ((p, u) not in old), total + v - old.get((p, u), 0))
+            for post_id, (count, total) in deltas.items():
+                counters.bump_ratings(post_id, count, total)
+            transaction.on_commit(lambda: ranking.rescore(list(deltas)))
+
+
+rating_buffer = RatingBuffer()
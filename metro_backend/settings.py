@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -45,16 +46,42 @@ INSTALLED_APPS = [
     'corsheaders',
     'main_app',
 ]
+# Cache used for reference data responses, map tiles, token revocation and more.
+# Point CACHE_BACKEND at django.core.cache.backends.redis.RedisCache (or memcached)
+# so every worker shares one cache; the default LocMemCache is per process.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+SHARED_CACHE = CACHE_BACKEND not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.filebased.FileBasedCache',  # one host only, and culls entries
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# JWT_STATELESS: trust the user id, username and is_staff claims in the token instead of
+# loading the user on every request (see main_app/authentication.py). Revoking the tokens
+# of a deactivated or demoted user goes through the cache, so this needs a shared one.
+JWT_STATELESS = os.getenv('JWT_STATELESS', str(SHARED_CACHE)) == 'True'
+if JWT_STATELESS and not SHARED_CACHE:
+    raise ImproperlyConfigured("JWT_STATELESS needs a CACHE_BACKEND shared by all workers (e.g. Redis)")
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "main_app.authentication.StatelessJWTAuthentication" if JWT_STATELESS
+        else "rest_framework_simplejwt.authentication.JWTAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.AllowAny",
     ],
 }
 
+SIMPLE_JWT = {
+    "TOKEN_OBTAIN_SERIALIZER": "main_app.serializers.TokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "main_app.serializers.TokenRefreshSerializer",
+    "TOKEN_USER_CLASS": "main_app.authentication.TokenUser",
+}
+
 MIDDLEWARE = [
+    'main_app.middleware.RequestMetricsMiddleware',
+    'main_app.middleware.ReadReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -91,16 +118,94 @@ WSGI_APPLICATION = 'metro_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+DB_ENGINE = os.getenv('DB_ENGINE', 'postgresql')
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': f'django.db.backends.{DB_ENGINE}',
         'NAME': os.getenv('DB_NAME'),
         'USER': os.getenv('DB_USER'),
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        # keep connections open between requests instead of reconnecting every time
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+if os.getenv('DB_POOL') == 'True':
+    # psycopg connection pool (pip install "psycopg[pool]"); replaces CONN_MAX_AGE and suits ASGI
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+        },
+    }
+
+# Read replicas: DB_REPLICAS is a comma separated list of host[:port]
+# (or database file names with DB_ENGINE=sqlite3), same credentials as default.
+# Safe-method requests read from a replica, except for a user's requests in the
+# REPLICA_PIN_SECONDS after they wrote something (see main_app/db_router.py).
+DATABASE_REPLICAS = []
+for i, replica in enumerate(r for r in os.getenv('DB_REPLICAS', '').split(',') if r):
+    alias = f'replica{i + 1}'
+    DATABASES[alias] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if DB_ENGINE == 'sqlite3':
+        DATABASES[alias]['NAME'] = replica
+    else:
+        host, _, port = replica.partition(':')
+        DATABASES[alias].update(HOST=host, PORT=port or DATABASES['default']['PORT'])
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['main_app.db_router.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))
+
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', 'metro-backend'),
     }
 }
+REFDATA_CACHE_TIMEOUT = int(os.getenv('REFDATA_CACHE_TIMEOUT', 60 * 60 * 24))
+
+# Background jobs (image variants, ...) run on a thread pool in each process
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', 2))
+BACKGROUND_TASKS_EAGER = os.getenv('BACKGROUND_TASKS_EAGER') == 'True'
+
+# Request metrics (main_app/middleware.py), scraped from /api/metrics/ with the
+# METRICS_TOKEN sent as the X-Metrics-Token header (without a token the endpoint
+# only answers in DEBUG). Slow requests are logged; METRICS_SLOW_QUERY_LOG adds
+# the SQL statements (never their params) for a sample of them.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_SLOW_REQUEST_MS = float(os.getenv('METRICS_SLOW_REQUEST_MS', 500))
+METRICS_SLOW_QUERY_LOG = os.getenv('METRICS_SLOW_QUERY_LOG') == 'True'
+METRICS_SLOW_SAMPLE_RATE = float(os.getenv('METRICS_SLOW_SAMPLE_RATE', 0.05))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Station/place feeds: sources with more followers than this aren't fanned out
+# into timelines but merged in when a timeline is read (see main_app/feeds.py)
+FEED_FANOUT_MAX_SUBSCRIBERS = int(os.getenv('FEED_FANOUT_MAX_SUBSCRIBERS', 5000))
+
+# Write-behind ratings (main_app/writebehind.py): taps are answered with 202 and
+# written in batches every RATINGS_FLUSH_INTERVAL seconds, or as soon as
+# RATINGS_FLUSH_BATCH of them are waiting. The taps not written yet are shared with
+# the other workers through the cache, so this needs a shared one.
+RATINGS_WRITE_BEHIND = os.getenv('RATINGS_WRITE_BEHIND') == 'True'
+if RATINGS_WRITE_BEHIND and not SHARED_CACHE:
+    raise ImproperlyConfigured("RATINGS_WRITE_BEHIND needs a CACHE_BACKEND shared by all workers (e.g. Redis)")
+RATINGS_FLUSH_INTERVAL = float(os.getenv('RATINGS_FLUSH_INTERVAL', 1.0))
+RATINGS_FLUSH_BATCH = int(os.getenv('RATINGS_FLUSH_BATCH', 500))
+
+# Map tiles (main_app/tiles.py) stay cached until a place or station in them changes
+TILES_CACHE_TIMEOUT = int(os.getenv('TILES_CACHE_TIMEOUT', 60 * 60 * 24))
+
+# Threads per process for the reads of a parallel /api/batch/ request
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', 4))
+
+# Precompute shortest paths between every pair of stations when the route graph is built
+ROUTES_PRECOMPUTE_ALL_PAIRS = os.getenv('ROUTES_PRECOMPUTE_ALL_PAIRS') == 'True'
 
 
 # Password validation